@@ -1,19 +1,23 @@
 
 
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel, EmailStr
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Literal
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 import sys
 import os
+import json
+import asyncio
 
 # Import classes from main.py
 from main import (
     MedicalDiagnosisSystem,
+    DiagnosisContext,
     UserAuthSystem,
     DoctorProfile,
     AppointmentSystem,
@@ -21,15 +25,76 @@ from main import (
     HealthMonitor,
     HospitalLocator,
     logger,
-    SUPABASE_AVAILABLE,
-    supabase
+    supabase_available,
+    supabase_connected,
+    init_clients,
+    decode_cursor,
+    history_position,
+    history_sort_key,
+    DATA_BACKEND,
+    encode_cursor,
+    IMPORT_SECONDS
 )
 
+# Medical system, created in the background at startup by lifespan()
+medical_system = None
+# "starting" until the catalogs are loaded, then "ready" or "failed"
+startup_state = {"status": "starting", "seconds": None}
+
+def create_medical_system():
+    """Initialize system components with error handling; None on failure"""
+    try:
+        system = MedicalDiagnosisSystem()
+        print("✅ Medical system initialized successfully")
+        system.analysis_jobs.add_listener(save_ai_analysis)
+        # Pick up edits to the diseases table without a restart
+        if system.store.available:
+            system.db.start_refresher()
+        return system
+    except Exception as e:
+        print(f"⚠️ Warning: Medical system initialization failed: {e}")
+        print("⚠️ Some features may be unavailable. Check environment variables.")
+        # Endpoints handle the None case via check_system_ready()
+        return None
+
+async def warm_up():
+    """Connect clients and load the catalogs; /api/ready reports the outcome"""
+    global medical_system
+    started = datetime.now()
+    await asyncio.to_thread(init_clients)
+    medical_system = await asyncio.to_thread(create_medical_system)
+    startup_state["seconds"] = round((datetime.now() - started).total_seconds(), 3)
+    startup_state["status"] = "ready" if medical_system else "failed"
+    logger.info("Startup finished", **startup_state)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start serving at once and warm up in the background; stop workers at shutdown.
+    
+    Liveness (/api/health) answers immediately; readiness (/api/ready)
+    returns 503 until the disease, doctor and user tables are loaded.
+    """
+    warm_up_task = None
+    if medical_system is None:
+        warm_up_task = asyncio.create_task(warm_up())
+    else:
+        startup_state["status"] = "ready"
+    yield
+    if warm_up_task and not warm_up_task.done():
+        warm_up_task.cancel()
+    if medical_system:
+        medical_system.db.stop_refresher()
+        await medical_system.analysis_jobs.stop()
+        await medical_system.history_writer.close()
+        medical_system.scoring_pool.shutdown(wait=False)
+        medical_system.repository.shutdown()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Medical Diagnosis System API",
     description="REST API for medical diagnosis, appointments, and health monitoring",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS configuration - Allow frontend to connect
@@ -65,17 +130,27 @@ async def serve_styles():
     """Serve CSS file"""
     return FileResponse(os.path.join(BASE_DIR, "frontend", "assets", "css", "styles.css"))
 
-# Initialize system components with error handling
-medical_system = None
+# Seconds a diagnosis request may spend, AI calls included, before falling
+# back to the rule-based result
+DIAGNOSIS_DEADLINE_SECONDS = float(os.getenv('DIAGNOSIS_DEADLINE_SECONDS', '25'))
 
-try:
-    medical_system = MedicalDiagnosisSystem()
-    print("✅ Medical system initialized successfully")
-except Exception as e:
-    print(f"⚠️ Warning: Medical system initialization failed: {e}")
-    print("⚠️ Some features may be unavailable. Check environment variables.")
-    # Create a minimal fallback - we'll handle None checks in endpoints
-    medical_system = None
+# Upper bound on cases accepted by /api/diagnosis/batch
+MAX_BATCH_CASES = 500
+
+# Upper bound on results from /api/symptoms/suggest
+MAX_SUGGESTIONS = 50
+
+# Longest a GET /api/diagnosis/jobs/{id}?wait=... request is held open
+MAX_JOB_WAIT_SECONDS = 30
+
+# Page size of the history, reminder and health-record lists, and its cap
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+# Fields a client may pick with ?fields=... on those lists
+HISTORY_FIELDS = ('timestamp', 'input_symptoms', 'primary_diagnosis', 'matched_symptoms', 'ai_analysis')
+REMINDER_FIELDS = ('id', 'medicine_name', 'dosage', 'time', 'start_date', 'end_date', 'notes')
+HEALTH_RECORD_FIELDS = ('id', 'date', 'blood_pressure', 'heart_rate', 'sugar_level', 'weight', 'temperature')
 
 # OAuth2 scheme for token authentication
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login", auto_error=False)
@@ -104,8 +179,18 @@ class UserResponse(BaseModel):
 
 class DiagnosisRequest(BaseModel):
     symptoms: str
+    # "inline" waits for the AI analysis; "stream" returns the KNN result at
+    # once and the analysis is read from /api/diagnosis/{id}/analysis/stream;
+    # "job" queues the analysis and it is read from /api/diagnosis/jobs/{id}
+    analysis: Literal['inline', 'stream', 'job'] = 'inline'
+
+class BatchDiagnosisRequest(BaseModel):
+    cases: List[str]
 
 class DiagnosisResponse(BaseModel):
+    diagnosis_id: Optional[str] = None
+    trace_id: Optional[str] = None
+    job_id: Optional[str] = None
     timestamp: str
     symptoms: List[str]
     disease: str
@@ -114,6 +199,8 @@ class DiagnosisResponse(BaseModel):
     is_emergency: bool
     ai_analysis: Optional[str] = None
     alternative_diagnoses: Optional[List[Dict[str, Any]]] = None
+    # Misspelled input symptoms and the catalog symptom each was read as
+    fuzzy_matches: Optional[Dict[str, str]] = None
 
 class AppointmentCreate(BaseModel):
     age: str
@@ -173,15 +260,87 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> Dict:
     # Simple token = email for now (in production, use JWT)
     email = token
     
-    # Get user from system
-    if email not in medical_system.auth_system.users:
+    # Cached users are returned at once; others are looked up by email
+    auth = medical_system.auth_system
+    user = auth.users.get(email)
+    if user is None:
+        try:
+            user = await medical_system.repository.run(auth.find_user, email)
+        except Exception as e:
+            logger.error("User lookup failed", error=str(e))
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Database unavailable. Cannot verify user."
+            )
+    if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found"
         )
     
-    return medical_system.auth_system.users[email]
+    return user
+
+
+def diagnosis_context(http_request: Request, current_user: Dict) -> DiagnosisContext:
+    """Per-request diagnosis context; the trace id comes from X-Request-ID when sent"""
+    return DiagnosisContext.with_timeout(
+        current_user, DIAGNOSIS_DEADLINE_SECONDS, http_request.headers.get('x-request-id')
+    )
+
+def format_diagnosis_response(result: Dict) -> Dict:
+    """Shape a diagnosis result into the DiagnosisResponse payload"""
+    # Alternative diagnoses carry disease info from the snapshot used for the diagnosis
+    alternative_diagnoses = []
+    for alt in result.get('alternative_diagnoses', []):
+        alternative_diagnoses.append({
+            'disease': alt['disease'],
+            'confidence': alt['confidence'],
+            'info': alt['info'],
+            'is_emergency': alt['is_emergency']
+        })
+    
+    return {
+        'diagnosis_id': result.get('diagnosis_id'),
+        'trace_id': result.get('trace_id'),
+        'timestamp': result['timestamp'],
+        'symptoms': result['input_symptoms'],
+        'disease': result['primary_diagnosis']['disease'],
+        'confidence': result['primary_diagnosis']['confidence'],
+        'info': result['primary_diagnosis']['info'],
+        'is_emergency': result['primary_diagnosis']['is_emergency'],
+        'ai_analysis': result.get('ai_analysis'),
+        'alternative_diagnoses': alternative_diagnoses,
+        'fuzzy_matches': result.get('fuzzy_matches') or None
+    }
+
 
+def parse_fields(fields: Optional[str], allowed: tuple) -> List[str]:
+    """Comma-separated field names from ?fields=, all `allowed` ones when omitted"""
+    if not fields:
+        return list(allowed)
+    requested = [f.strip() for f in fields.split(',') if f.strip()]
+    unknown = [f for f in requested if f not in allowed]
+    if unknown or not requested:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(unknown) or fields}. Allowed: {', '.join(allowed)}"
+        )
+    return requested
+
+def parse_cursor(cursor: Optional[str], arity: int = 1) -> Optional[list]:
+    """Keyset position from a next_cursor value; 400 if it is not one"""
+    if not cursor:
+        return None
+    try:
+        return decode_cursor(cursor, arity)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+def page_response(key: str, rows: List[Dict], limit: int, fields: List[str], cursor_of) -> Dict:
+    """One page of `rows` (fetched with limit + 1) projected to `fields`, with the cursor of the next page"""
+    next_cursor = encode_cursor(*cursor_of(rows[limit - 1])) if len(rows) > limit else None
+    items = [{f: row.get(f) for f in fields} for row in rows[:limit]]
+    return {key: items, "count": len(items), "next_cursor": next_cursor}
 
 def check_system_ready():
     """Check if medical system is initialized"""
@@ -194,25 +353,53 @@ def check_system_ready():
 
 
 
+def data_backend_status() -> Dict:
+    """The configured data backend and whether it is connected.
+    
+    Never waits on a connection still being made by the startup warm-up, so
+    it is safe in liveness checks; `connected` is None until that finishes.
+    """
+    if medical_system is not None:
+        store = medical_system.store
+        return {"name": store.name, "connected": store.connected}
+    return {"name": DATA_BACKEND, "connected": supabase_connected() if DATA_BACKEND == 'supabase' else None}
+
 @app.get("/api")
 async def api_root():
     """API root endpoint"""
     return {
         "message": "Medical Diagnosis System API",
         "version": "1.0.0",
-        "supabase_connected": SUPABASE_AVAILABLE
+        "data_backend": data_backend_status()
     }
 
 @app.get("/api/health")
 async def health_check():
-    """Health check endpoint - always returns 200 for Railway"""
+    """Liveness check - always returns 200 once the process is serving"""
     return {
         "status": "healthy",
         "medical_system_ready": medical_system is not None,
-        "supabase": SUPABASE_AVAILABLE,
+        "catalog_version": medical_system.db.version if medical_system else None,
+        "data_backend": data_backend_status(),
+        "import_seconds": round(IMPORT_SECONDS, 3),
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/api/ready")
+async def readiness_check():
+    """Readiness check - 503 until the catalogs are loaded, then 200"""
+    body = {
+        "status": startup_state["status"],
+        "startup_seconds": startup_state["seconds"],
+        "tables": medical_system.startup_report if medical_system else None,
+        "catalog_version": medical_system.db.version if medical_system else None,
+        "classifier": medical_system.db.classifier.name if medical_system else None,
+        "data_backend": medical_system.store.name if medical_system else None
+    }
+    if medical_system is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=body)
+    return body
+
 # ============================================
 # Authentication Endpoints
 # ============================================
@@ -223,7 +410,8 @@ async def register(user: UserRegister):
     check_system_ready()  # Ensure system is initialized
     
     # Require Supabase for registration
-    if not SUPABASE_AVAILABLE or not supabase:
+    repository = medical_system.repository
+    if not repository.available:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Database unavailable. Cannot register users at this time."
@@ -231,16 +419,17 @@ async def register(user: UserRegister):
     
     try:
         # Check if user already exists in Supabase (primary source of truth)
-        existing = supabase.table('users').select('email').eq('email', user.email).execute()
-        if existing.data and len(existing.data) > 0:
+        if await repository.user_exists(user.email):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="User already exists. Please login instead."
             )
         
-        # Hash password
+        # Hash password (deliberately slow, so off the event loop)
         import bcrypt
-        password_hash = bcrypt.hashpw(user.password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        password_hash = (await asyncio.to_thread(
+            bcrypt.hashpw, user.password.encode('utf-8'), bcrypt.gensalt()
+        )).decode('utf-8')
         
         # Create user data
         user_data = {
@@ -265,17 +454,16 @@ async def register(user: UserRegister):
                 logger.info(f"Attempting to save user to Supabase (attempt {retry_count + 1}/{max_retries})", email=user.email)
                 
                 # Insert into Supabase
-                result = supabase.table('users').insert(user_data).execute()
+                inserted = await repository.insert_user(user_data)
                 
                 # Verify the insert worked by checking if data was returned
-                if not result.data or len(result.data) == 0:
+                if not inserted:
                     raise Exception("Insert returned no data - verification failed")
                 
-                logger.info("User saved to Supabase successfully", email=user.email, result_count=len(result.data))
+                logger.info("User saved to Supabase successfully", email=user.email, result_count=len(inserted))
                 
                 # Double-check by querying the database
-                verify = supabase.table('users').select('email').eq('email', user.email).execute()
-                if not verify.data or len(verify.data) == 0:
+                if not await repository.user_exists(user.email):
                     raise Exception("User insert verification query failed - user not found in database")
                 
                 logger.info("User verified in Supabase", email=user.email)
@@ -288,10 +476,9 @@ async def register(user: UserRegister):
                 
                 if retry_count < max_retries:
                     # Wait before retrying (exponential backoff)
-                    import time
                     wait_time = 0.5 * (2 ** (retry_count - 1))  # 0.5s, 1s, 2s
                     logger.info(f"Waiting {wait_time}s before retry...")
-                    time.sleep(wait_time)
+                    await asyncio.sleep(wait_time)
         
         # If all retries failed, raise error
         if not insert_successful:
@@ -302,7 +489,7 @@ async def register(user: UserRegister):
             )
         
         # Only add to memory AFTER successful database insert
-        medical_system.auth_system.users[user.email] = user_data
+        medical_system.auth_system.remember(user_data)
         logger.info("User added to memory cache", email=user.email)
         
         logger.info("User registered successfully", email=user.email)
@@ -327,7 +514,8 @@ async def login(user: UserLogin):
     check_system_ready()  # Ensure system is initialized
     
     # Require Supabase for login
-    if not SUPABASE_AVAILABLE or not supabase:
+    repository = medical_system.repository
+    if not repository.available:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Database unavailable. Cannot login at this time."
@@ -336,9 +524,9 @@ async def login(user: UserLogin):
     try:
         # Reload user from Supabase (in case they just registered)
         logger.info("Fetching user from Supabase", email=user.email)
-        db_user_result = supabase.table('users').select('*').eq('email', user.email).execute()
+        user_data = await repository.get_user(user.email)
         
-        if not db_user_result.data or len(db_user_result.data) == 0:
+        if not user_data:
             logger.warning("User not found in database", email=user.email)
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -346,13 +534,8 @@ async def login(user: UserLogin):
             )
         
         
-        # Get user data from database
-        user_data = db_user_result.data[0]
         logger.info("User found in database", email=user.email)
         
-        # Update memory cache with latest data from database
-        medical_system.auth_system.users[user.email] = user_data
-        
         # Verify password hash exists
         import bcrypt
         password_hash = user_data.get('password_hash')
@@ -374,8 +557,8 @@ async def login(user: UserLogin):
                 detail="Account data corrupted. Please contact support."
             )
         
-        # Verify password
-        if not bcrypt.checkpw(user.password.encode('utf-8'), stored_hash):
+        # Verify password (deliberately slow, so off the event loop)
+        if not await asyncio.to_thread(bcrypt.checkpw, user.password.encode('utf-8'), stored_hash):
             logger.warning("Incorrect password attempt", email=user.email)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -389,17 +572,17 @@ async def login(user: UserLogin):
         
         # Save updated login info to Supabase
         try:
-            supabase.table('users').update({
+            await repository.update_user(user.email, {
                 'login_count': user_data['login_count'],
                 'last_login': user_data['last_login']
-            }).eq('email', user.email).execute()
+            })
             logger.info("Login count updated in database", email=user.email, count=user_data['login_count'])
         except Exception as e:
             logger.error("Failed to update login count in database", error=str(e))
             # Don't fail login if update fails
         
         # Update memory cache
-        medical_system.auth_system.users[user.email] = user_data
+        medical_system.auth_system.remember(user_data)
         
         logger.info("User logged in successfully", email=user.email, login_count=user_data['login_count'])
         
@@ -434,13 +617,17 @@ async def update_profile(
 ):
     """Update user profile"""
     try:
+        changes = {}
         if name:
-            current_user['name'] = name
+            changes['name'] = name
         if phone:
-            current_user['phone'] = phone
+            changes['phone'] = phone
         
-        medical_system.auth_system.users[current_user['email']] = current_user
-        medical_system.auth_system.save_users()
+        if changes:
+            # Drop the cached row first so a failed update is re-read, not trusted
+            medical_system.auth_system.forget(current_user['email'])
+            await medical_system.repository.update_user(current_user['email'], changes)
+        current_user = medical_system.auth_system.remember({**current_user, **changes})
         
         logger.info("Profile updated", email=current_user['email'])
         
@@ -460,15 +647,16 @@ async def update_profile(
 @app.post("/api/diagnosis", response_model=DiagnosisResponse)
 async def diagnose_symptoms(
     request: DiagnosisRequest,
+    http_request: Request,
     current_user: Dict = Depends(get_current_user)
 ):
     """Diagnose symptoms using AI"""
     try:
-        # Set current user for diagnosis
-        medical_system.auth_system.current_user = current_user
-        
         # Perform diagnosis
-        result = medical_system.diagnose(request.symptoms, 'patient')
+        result = await medical_system.diagnose_async(
+            request.symptoms, 'patient', defer_analysis=request.analysis != 'inline',
+            context=diagnosis_context(http_request, current_user)
+        )
         
         if 'error' in result:
             raise HTTPException(
@@ -476,45 +664,20 @@ async def diagnose_symptoms(
                 detail=result['error']
             )
         
-        # Save diagnosis to Supabase
-        if SUPABASE_AVAILABLE and supabase:
-            try:
-                diagnosis_record = {
-                    'user_email': current_user['email'],
-                    'timestamp': result['timestamp'],
-                    'input_symptoms': result['input_symptoms'],
-                    'primary_diagnosis': result['primary_diagnosis'],
-                    'ai_analysis': result.get('ai_analysis')
-                }
-                supabase.table('diagnosis_history').insert(diagnosis_record).execute()
-                logger.info("Diagnosis saved to database", user_email=current_user['email'])
-            except Exception as e:
-                logger.error("Failed to save diagnosis to Supabase", error=str(e))
-                # Don't fail the request if saving fails, just log it
+        # Save diagnosis to Supabase; written behind the request in batches
+        if medical_system.repository.available:
+            await medical_system.history_writer.add(medical_system.history_record(result))
+        medical_system.invalidate_dashboard(current_user['email'])
         
         logger.incr("api_diagnoses")
         
-        # Prepare alternative diagnoses with full disease info
-        alternative_diagnoses = []
-        for alt in result.get('alternative_diagnoses', []):
-            alt_disease_info = medical_system.db.get_disease_info(alt['disease'])
-            alternative_diagnoses.append({
-                'disease': alt['disease'],
-                'confidence': alt['confidence'],
-                'info': alt_disease_info,
-                'is_emergency': medical_system.db.is_emergency(alt['disease'])
-            })
+        response = format_diagnosis_response(result)
+        # Queued only after the history row exists so the worker can update it
+        if request.analysis == 'job':
+            medical_system.submit_analysis_job(result['diagnosis_id'])
+            response['job_id'] = result['diagnosis_id']
         
-        return {
-            'timestamp': result['timestamp'],
-            'symptoms': result['input_symptoms'],
-            'disease': result['primary_diagnosis']['disease'],
-            'confidence': result['primary_diagnosis']['confidence'],
-            'info': result['primary_diagnosis']['info'],
-            'is_emergency': result['primary_diagnosis']['is_emergency'],
-            'ai_analysis': result.get('ai_analysis'),
-            'alternative_diagnoses': alternative_diagnoses
-        }
+        return response
         
     except HTTPException:
         raise
@@ -525,33 +688,164 @@ async def diagnose_symptoms(
             detail=str(e)
         )
 
+async def save_ai_analysis(deferred: Dict):
+    """Write a deferred diagnosis' finished AI analysis back to its history row"""
+    if medical_system is None or not medical_system.repository.available:
+        return
+    result = deferred['result']
+    # Still buffered by the history writer: the analysis goes out with the insert
+    if await medical_system.history_writer.amend(
+        result['user_email'], result['timestamp'], {'ai_analysis': result['ai_analysis']}
+    ):
+        return
+    try:
+        await medical_system.repository.update_diagnosis_analysis(
+            result['user_email'], result['timestamp'], result['ai_analysis']
+        )
+        logger.info("AI analysis saved to database", user_email=result['user_email'])
+    except Exception as e:
+        logger.error("Failed to save AI analysis to Supabase", error=str(e))
+
+def sse_event(event: str, data: Any) -> str:
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.get("/api/diagnosis/{diagnosis_id}/analysis/stream")
+async def stream_diagnosis_analysis(
+    diagnosis_id: str,
+    current_user: Dict = Depends(get_current_user)
+):
+    """Stream the KNN result, then the AI analysis, as Server-Sent Events.
+    
+    Events: "result" (the diagnosis), any number of "chunk" ({"text": ...})
+    and a final "done" ({"ai_analysis": full text}).
+    """
+    deferred = medical_system.get_deferred_analysis(diagnosis_id)
+    if not deferred or deferred['result'].get('user_email') != current_user['email']:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Diagnosis not found or analysis expired"
+        )
+    
+    async def events():
+        yield sse_event("result", format_diagnosis_response(deferred['result']))
+        async for chunk in medical_system.stream_analysis(deferred):
+            yield sse_event("chunk", {"text": chunk})
+        yield sse_event("done", {"ai_analysis": deferred['result']['ai_analysis']})
+        await save_ai_analysis(deferred)
+    
+    logger.incr("api_analysis_streams")
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/diagnosis/jobs/{job_id}")
+async def get_analysis_job(
+    job_id: str,
+    wait: float = 0,
+    current_user: Dict = Depends(get_current_user)
+):
+    """Status of a queued AI analysis.
+    
+    With `wait` (seconds, at most MAX_JOB_WAIT_SECONDS) the request is held
+    until the job finishes or the wait runs out (long-polling).
+    """
+    job = medical_system.get_deferred_analysis(job_id)
+    if not job or 'finished' not in job or job['result'].get('user_email') != current_user['email']:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Analysis job not found or expired"
+        )
+    
+    if wait > 0 and not job['finished'].is_set():
+        try:
+            await asyncio.wait_for(job['finished'].wait(), min(wait, MAX_JOB_WAIT_SECONDS))
+        except asyncio.TimeoutError:
+            pass
+    
+    return {
+        "job_id": job_id,
+        "status": job['status'],
+        "ai_analysis": job['result'].get('ai_analysis'),
+        "diagnosis": format_diagnosis_response(job['result'])
+    }
+
+@app.post("/api/diagnosis/batch")
+async def diagnose_batch(
+    request: BatchDiagnosisRequest,
+    http_request: Request,
+    current_user: Dict = Depends(get_current_user)
+):
+    """Diagnose many symptom sets in one call (KNN only, no AI analysis)"""
+    if len(request.cases) > MAX_BATCH_CASES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_BATCH_CASES} cases per batch"
+        )
+    
+    try:
+        results = await medical_system.run_scoring(
+            medical_system.diagnose_many, request.cases, 'patient', diagnosis_context(http_request, current_user)
+        )
+        
+        logger.incr("api_batch_diagnoses")
+        
+        return {
+            "results": [r if 'error' in r else format_diagnosis_response(r) for r in results],
+            "count": len(results)
+        }
+        
+    except Exception as e:
+        logger.error("Batch diagnosis failed", error=str(e))
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
 @app.get("/api/diagnosis/history")
-async def get_diagnosis_history(current_user: Dict = Depends(get_current_user)):
-    """Get user's diagnosis history from Supabase"""
+async def get_diagnosis_history(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: Dict = Depends(get_current_user)
+):
+    """Get user's diagnosis history from Supabase, newest first.
+    
+    Paged by `limit`; pass the returned `next_cursor` as `cursor` for the next
+    page. `fields` picks a subset of HISTORY_FIELDS.
+    """
     try:
-        if not SUPABASE_AVAILABLE or not supabase:
+        if not medical_system.repository.available:
             raise HTTPException(
                 status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
                 detail="Database not available"
             )
+        fields = parse_fields(fields, HISTORY_FIELDS)
+        before = parse_cursor(cursor, 2)
+        columns = ['id', 'timestamp'] + [c for c in ('input_symptoms', 'primary_diagnosis', 'ai_analysis')
+                                   if c in fields or (c == 'primary_diagnosis' and 'matched_symptoms' in fields)]
+        
+        # Fetch from Supabase and merge in the rows the history writer has not flushed yet
+        stored = await medical_system.repository.diagnosis_history(
+            current_user['email'], limit + 1, before, columns
+        )
+        pending = medical_system.history_writer.pending(current_user['email'])
+        if before:
+            timestamp, row_id = history_position(before)
+            position = history_sort_key({'timestamp': timestamp, 'id': row_id})
+            pending = [r for r in pending if history_sort_key(r) < position]
+        records = sorted(pending + stored, key=history_sort_key, reverse=True)
         
-        # Fetch from Supabase
-        response = supabase.table('diagnosis_history').select('*').eq('user_email', current_user['email']).order('timestamp', desc=True).execute()
-        
-        # Transform data to match expected format
-        history = []
-        for record in (response.data or []):
-            history.append({
-                'timestamp': record['timestamp'],
-                'input_symptoms': record['input_symptoms'],
-                'primary_diagnosis': record['primary_diagnosis'],
-                'ai_analysis': record.get('ai_analysis')
-            })
-        
-        return history
+        # Compact rows get their disease info back from the catalog
+        history = [medical_system.history_entry(record) for record in records[:limit + 1]]
+        return page_response("history", history, limit, fields, lambda row: [row['timestamp'], row['id']])
         
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         logger.error("Failed to get history", error=str(e))
         raise HTTPException(
@@ -567,6 +861,15 @@ async def get_all_symptoms():
         "count": len(medical_system.db.all_symptoms)
     }
 
+@app.get("/api/symptoms/suggest")
+async def suggest_symptoms(q: str = "", limit: int = Query(10, ge=1, le=MAX_SUGGESTIONS)):
+    """Autocomplete symptoms: those with a word starting with `q`, most common first"""
+    check_system_ready()
+    return {
+        "query": q,
+        "suggestions": medical_system.db.suggest_symptoms(q, limit)
+    }
+
 # ============================================
 # Doctor Endpoints
 # ============================================
@@ -636,25 +939,27 @@ async def create_appointment(
             'symptoms': appointment.symptoms
         }
         
-        result = medical_system.appointment_system.book_appointment(
-            patient_info=patient_info,
-            doctor_id=appointment.doctor_id,
-            appointment_date=appointment.appointment_date,
-            appointment_time=appointment.appointment_time,
-            is_emergency=appointment.is_emergency
+        result = await medical_system.repository.run(
+            medical_system.appointment_system.book_appointment,
+            patient_info,
+            appointment.doctor_id,
+            appointment.appointment_date,
+            appointment.appointment_time,
+            appointment.is_emergency
         )
         
         # Add user email to result
         result['user_email'] = current_user['email']
         
         # Save to Supabase if available
-        if SUPABASE_AVAILABLE and supabase:
+        if medical_system.repository.available:
             try:
-                supabase.table('appointments').insert(result).execute()
+                await medical_system.repository.insert_appointment(result)
             except Exception as e:
                 logger.error("Failed to save appointment to Supabase", error=str(e))
         
         logger.incr("api_appointments")
+        medical_system.invalidate_dashboard(current_user['email'])
         
         return result
         
@@ -707,9 +1012,8 @@ async def create_reminder(
             'notes': reminder.notes
         }
         
-        success = medical_system.reminder.add_reminder(
-            user_email=current_user['email'],
-            reminder=reminder_data
+        success = await medical_system.repository.run(
+            medical_system.reminder.add_reminder, current_user['email'], reminder_data
         )
         
         if not success:
@@ -719,6 +1023,7 @@ async def create_reminder(
             )
         
         logger.incr("api_reminders")
+        medical_system.invalidate_dashboard(current_user['email'])
         
         return {
             "message": "Reminder created successfully",
@@ -735,16 +1040,25 @@ async def create_reminder(
         )
 
 @app.get("/api/reminders")
-async def get_reminders(current_user: Dict = Depends(get_current_user)):
-    """Get user's medicine reminders"""
+async def get_reminders(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: Dict = Depends(get_current_user)
+):
+    """Get user's medicine reminders in the order they were added (paged like the history)"""
+    fields = parse_fields(fields, REMINDER_FIELDS)
+    after = parse_cursor(cursor)
     try:
-        reminders = medical_system.reminder.get_reminders(current_user['email'])
+        reminders = await medical_system.repository.run(
+            medical_system.reminder.get_reminders, current_user['email'], limit + 1,
+            after[0] if after else None, sorted({'id', *fields})
+        )
         
-        return {
-            "reminders": reminders,
-            "count": len(reminders)
-        }
+        return page_response("reminders", reminders, limit, fields, lambda row: [row['id']])
         
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         logger.error("Failed to get reminders", error=str(e))
         raise HTTPException(
@@ -772,9 +1086,8 @@ async def create_health_record(
             'temperature': record.temperature
         }
         
-        success = medical_system.health_monitor.add_record(
-            user_email=current_user['email'],
-            record=record_data
+        success = await medical_system.repository.run(
+            medical_system.health_monitor.add_record, current_user['email'], record_data
         )
         
         if not success:
@@ -784,6 +1097,7 @@ async def create_health_record(
             )
         
         logger.incr("api_health_records")
+        medical_system.invalidate_dashboard(current_user['email'])
         
         return {
             "message": "Health record created successfully",
@@ -800,16 +1114,25 @@ async def create_health_record(
         )
 
 @app.get("/api/health-records")
-async def get_health_records(current_user: Dict = Depends(get_current_user)):
-    """Get user's health records"""
+async def get_health_records(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: Dict = Depends(get_current_user)
+):
+    """Get user's health records, newest first (paged like the history)"""
+    fields = parse_fields(fields, HEALTH_RECORD_FIELDS)
+    before = parse_cursor(cursor, 2)
     try:
-        records = medical_system.health_monitor.get_history(current_user['email'])
+        records = await medical_system.repository.run(
+            medical_system.health_monitor.get_history, current_user['email'], limit + 1,
+            before, sorted({'id', 'date', *fields})
+        )
         
-        return {
-            "records": records,
-            "count": len(records)
-        }
+        return page_response("records", records, limit, fields, lambda row: [row['date'], row['id']])
         
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         logger.error("Failed to get health records", error=str(e))
         raise HTTPException(
@@ -817,6 +1140,79 @@ async def get_health_records(current_user: Dict = Depends(get_current_user)):
             detail=str(e)
         )
 
+# ============================================
+# Dashboard Endpoint
+# ============================================
+
+async def build_dashboard_summary(current_user: Dict) -> Dict:
+    """Counts, latest diagnosis and appointment, and latest vitals of a user"""
+    email = current_user['email']
+    repository = medical_system.repository
+    counts, latest_rows, vitals = await asyncio.gather(
+        repository.user_counts(email),
+        repository.diagnosis_history(email, 1, None, ['timestamp', 'primary_diagnosis']),
+        repository.health_records(email, 1, None, list(HEALTH_RECORD_FIELDS))
+    )
+    # Rows still buffered by the history writer are not counted by the database yet
+    pending = medical_system.history_writer.pending(email)
+    latest_diagnosis = None
+    if pending or latest_rows:
+        entry = medical_system.history_entry((pending + latest_rows)[0])
+        latest_diagnosis = {
+            'timestamp': entry['timestamp'],
+            'disease': entry['primary_diagnosis'].get('disease'),
+            'confidence': entry['primary_diagnosis'].get('confidence'),
+            'is_emergency': entry['primary_diagnosis'].get('is_emergency')
+        }
+    # Same source as GET /api/appointments
+    appointments = [
+        apt for apt in medical_system.appointment_system.appointments
+        if apt.get('patient_phone') == current_user['phone']
+    ]
+    return {
+        "counts": {
+            "diagnoses": counts['diagnosis_history'] + len(pending),
+            "appointments": len(appointments),
+            "reminders": counts['medicine_reminders'],
+            "health_records": counts['health_records']
+        },
+        "latest_diagnosis": latest_diagnosis,
+        "latest_appointment": appointments[-1] if appointments else None,
+        "vitals": vitals[0] if vitals else None,
+        "generated_at": datetime.now().isoformat()
+    }
+
+@app.get("/api/dashboard/summary")
+async def get_dashboard_summary(current_user: Dict = Depends(get_current_user)):
+    """Everything the dashboard shows, in one small response.
+    
+    Counts come from count-only queries. The summary is cached per user for
+    DASHBOARD_CACHE_TTL_SECONDS and dropped when the user saves a diagnosis,
+    reminder, health record or appointment.
+    """
+    if not medical_system.repository.available:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database not available"
+        )
+    
+    summary = medical_system.dashboard_cache.get(current_user['email'])
+    if summary is not None:
+        logger.incr("dashboard_cache_hits")
+        return summary
+    
+    try:
+        summary = await build_dashboard_summary(current_user)
+    except Exception as e:
+        logger.error("Failed to build dashboard summary", error=str(e))
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+    logger.incr("dashboard_cache_misses")
+    medical_system.dashboard_cache.set(current_user['email'], summary)
+    return summary
+
 # ============================================
 # Statistics Endpoint
 # ============================================
@@ -838,7 +1234,7 @@ async def get_statistics(current_user: Dict = Depends(get_current_user)):
                 "emergency_available": len(medical_system.doctor_profiles.search_doctors(emergency=True))
             },
             "user": {
-                "total_users": len(medical_system.auth_system.users),
+                "total_users": await medical_system.repository.count_users(),
                 "login_count": current_user.get('login_count', 0),
                 "last_login": current_user.get('last_login'),
                 "registered_on": current_user.get('registered_on')
@@ -862,7 +1258,7 @@ if __name__ == "__main__":
     print("=" * 80)
     print("MEDICAL DIAGNOSIS SYSTEM - API SERVER")
     print("=" * 80)
-    print(f"Supabase Connected: {SUPABASE_AVAILABLE}")
+    print(f"Supabase Connected: {supabase_available()}")
     print("Starting server on http://localhost:8000")
     print("API Documentation: http://localhost:8000/docs")
     print("=" * 80)
@@ -0,0 +1,111 @@
+"""Compare the classifier backends on the same disease catalog.
+
+For every backend in main.CLASSIFIER_BACKENDS this fits the catalog and
+reports top-1 accuracy on noisy symptom queries, single-query latency
+(p50/p99) and the memory allocated while fitting.
+
+    python benchmark_classifiers.py                    # catalog from Supabase (or fallback data)
+    python benchmark_classifiers.py --synthetic 10000  # generated catalog of 10k diseases
+    python benchmark_classifiers.py --backends knn-brute,jaccard --queries 500
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+import numpy as np
+
+from main import CLASSIFIER_BACKENDS, MedicalDatabase, build_training_matrix, create_classifier
+
+
+def synthetic_catalog(disease_count: int, seed: int = 0) -> dict:
+    """Random catalog with 3-12 symptoms per disease over a vocabulary half its size"""
+    rng = random.Random(seed)
+    vocabulary = [f"symptom {i}" for i in range(max(100, disease_count // 2))]
+    return {
+        f"disease {i}": {'symptoms': rng.sample(vocabulary, rng.randint(3, 12))}
+        for i in range(disease_count)
+    }
+
+
+def make_queries(X_train, labels, count: int, seed: int = 0):
+    """Query rows built from a disease's symptoms: some dropped, sometimes one unrelated added"""
+    from scipy import sparse
+
+    rng = random.Random(seed)
+    columns, row_starts, expected = [], [0], []
+    for _ in range(count):
+        row = rng.randrange(len(labels))
+        symptoms = list(X_train.indices[X_train.indptr[row]:X_train.indptr[row + 1]])
+        keep = rng.sample(symptoms, max(1, round(len(symptoms) * rng.uniform(0.5, 1.0))))
+        if rng.random() < 0.3:
+            keep.append(rng.randrange(X_train.shape[1]))
+        columns.extend(sorted(set(keep)))
+        row_starts.append(len(columns))
+        expected.append(labels[row])
+    queries = sparse.csr_matrix(
+        (np.ones(len(columns)), np.array(columns, dtype=np.int32), np.array(row_starts, dtype=np.int32)),
+        shape=(count, X_train.shape[1])
+    )
+    return queries, expected
+
+
+def benchmark(name: str, X_train, y_train, queries, expected) -> dict:
+    # Warm-up fit so library imports are not counted as fit time or memory
+    create_classifier(name).fit(X_train[:2], y_train[:2])
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    classifier = create_classifier(name).fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - started
+    fit_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    latencies = []
+    correct = 0
+    for row, disease in enumerate(expected):
+        started = time.perf_counter()
+        prediction = classifier.predict(queries[row])[0]
+        latencies.append((time.perf_counter() - started) * 1000)
+        correct += prediction['primary_prediction'] == disease
+
+    started = time.perf_counter()
+    classifier.predict(queries)
+    batch_ms = (time.perf_counter() - started) * 1000
+
+    return {
+        'backend': name,
+        'accuracy': correct / len(expected),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'batch_ms': batch_ms,
+        'fit_s': fit_seconds,
+        'memory_mb': fit_bytes / 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--synthetic', type=int, default=0, help="generate a catalog with this many diseases")
+    parser.add_argument('--queries', type=int, default=200, help="number of test queries")
+    parser.add_argument('--backends', default=','.join(CLASSIFIER_BACKENDS), help="comma-separated backend names")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        disease_data = synthetic_catalog(args.synthetic)
+    else:
+        disease_data = MedicalDatabase().disease_data
+    all_symptoms, X_train, labels = build_training_matrix(disease_data)
+    y_train = np.array(labels)
+    queries, expected = make_queries(X_train, labels, args.queries)
+
+    print(f"📊 {len(labels)} diseases, {len(all_symptoms)} symptoms, {args.queries} queries\n")
+    print(f"{'backend':<16}{'accuracy':>10}{'p50 ms':>10}{'p99 ms':>10}{'batch ms':>11}{'fit s':>9}{'fit MB':>9}")
+    for name in args.backends.split(','):
+        r = benchmark(name.strip(), X_train, y_train, queries, expected)
+        print(f"{r['backend']:<16}{r['accuracy']:>10.3f}{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}"
+              f"{r['batch_ms']:>11.1f}{r['fit_s']:>9.3f}{r['memory_mb']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
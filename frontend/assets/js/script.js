@@ -186,27 +186,30 @@ function setupForms() {
 
 async function loadDashboardStats() {
     try {
-        const [diagnoses, appointments, reminders, healthRecords] = await Promise.all([
-            apiCall('/diagnosis/history'),
-            apiCall('/appointments'),
-            apiCall('/reminders'),
-            apiCall('/health-records')
-        ]);
-
-        document.getElementById('totalDiagnoses').textContent = diagnoses.length;
-        document.getElementById('totalAppointments').textContent = appointments.count;
-        document.getElementById('totalReminders').textContent = reminders.count;
-        document.getElementById('totalHealthRecords').textContent = healthRecords.count;
+        // Counts and latest items come pre-aggregated from the server
+        const summary = await apiCall('/dashboard/summary');
+
+        document.getElementById('totalDiagnoses').textContent = summary.counts.diagnoses;
+        document.getElementById('totalAppointments').textContent = summary.counts.appointments;
+        document.getElementById('totalReminders').textContent = summary.counts.reminders;
+        document.getElementById('totalHealthRecords').textContent = summary.counts.health_records;
 
         // Load recent activity
         const activities = [];
-        if (diagnoses.length > 0) {
-            const latest = diagnoses[diagnoses.length - 1];
-            activities.push(`Diagnosis: ${latest.primary_diagnosis.disease} (${new Date(latest.timestamp).toLocaleDateString()})`);
+        if (summary.latest_diagnosis) {
+            const latest = summary.latest_diagnosis;
+            activities.push(`Diagnosis: ${latest.disease} (${new Date(latest.timestamp).toLocaleDateString()})`);
+        }
+        if (summary.latest_appointment) {
+            activities.push(`Appointment with doctor on ${summary.latest_appointment.appointment_date}`);
         }
-        if (appointments.count > 0) {
-            const latest = appointments.appointments[appointments.appointments.length - 1];
-            activities.push(`Appointment with doctor on ${latest.appointment_date}`);
+        if (summary.vitals) {
+            const vitals = summary.vitals;
+            const readings = [
+                vitals.blood_pressure && `BP ${vitals.blood_pressure}`,
+                vitals.heart_rate && `HR ${vitals.heart_rate} bpm`
+            ].filter(Boolean).join(', ');
+            if (readings) activities.push(`Vitals on ${vitals.date}: ${readings}`);
         }
 
         const activityList = document.getElementById('recentActivity');
@@ -223,16 +226,19 @@ async function loadDashboardStats() {
 // Symptoms
 // ============================================
 
-let allSymptoms = [];
+const SYMPTOM_SUGGESTION_LIMIT = 50;
+let symptomSearchTimer = null;
 
-async function loadSymptomsList() {
+// Suggestions come from the server ranked by how many diseases list them,
+// so only a small page of symptoms is downloaded per query
+async function loadSymptomsList(query = '') {
     try {
-        const data = await apiCall('/symptoms');
-        allSymptoms = data.symptoms;
+        const params = new URLSearchParams({ q: query, limit: SYMPTOM_SUGGESTION_LIMIT });
+        const data = await apiCall(`/symptoms/suggest?${params}`);
 
         const container = document.getElementById('symptomsList');
-        container.innerHTML = allSymptoms.map(symptom =>
-            `<div class="list-item">${symptom}</div>`
+        container.innerHTML = data.suggestions.map(s =>
+            `<div class="list-item">${s.symptom}</div>`
         ).join('');
 
     } catch (error) {
@@ -241,12 +247,9 @@ async function loadSymptomsList() {
 }
 
 function filterSymptoms(e) {
-    const query = e.target.value.toLowerCase();
-    const filtered = allSymptoms.filter(s => s.toLowerCase().includes(query));
-    const container = document.getElementById('symptomsList');
-    container.innerHTML = filtered.map(symptom =>
-        `<div class="list-item">${symptom}</div>`
-    ).join('');
+    const query = e.target.value.trim();
+    clearTimeout(symptomSearchTimer);
+    symptomSearchTimer = setTimeout(() => loadSymptomsList(query), 150);
 }
 
 // ============================================
@@ -270,14 +273,15 @@ async function handleDiagnosis(e) {
         submitBtn.textContent = 'Analyzing...';
         submitBtn.disabled = true;
 
-        // Call API
+        // Call API - the diagnosis comes back at once, the AI analysis is streamed after it
         const result = await apiCall('/diagnosis', {
             method: 'POST',
-            body: JSON.stringify({ symptoms: symptomsInput })
+            body: JSON.stringify({ symptoms: symptomsInput, analysis: 'stream' })
         });
 
         // Display result
         displayDiagnosisResult(result);
+        streamAiAnalysis(result.diagnosis_id);
 
         // Reload stats and history
         await loadDashboardStats();
@@ -343,6 +347,9 @@ function displayDiagnosisResult(result) {
 
         ${alternativesHTML}
 
+        <h3 class="mt-3">🤖 AI Analysis</h3>
+        <div class="list-item" id="aiAnalysisContent" style="white-space: pre-wrap;">Generating AI analysis...</div>
+
         <div class="alert alert-info mt-3">
             <strong>⚠️ DISCLAIMER:</strong> This is an AI-assisted diagnostic tool. Always consult with a qualified healthcare professional for medical advice.
         </div>
@@ -356,12 +363,68 @@ function displayDiagnosisResult(result) {
         ` : ''}
     `;
 
+    if (result.ai_analysis) {
+        document.getElementById('aiAnalysisContent').textContent = result.ai_analysis;
+    }
+
     resultDiv.style.display = 'block';
 }
 
+async function streamAiAnalysis(diagnosisId) {
+    /**
+     * Read the AI analysis Server-Sent Events stream and render it as it arrives
+     */
+    const container = document.getElementById('aiAnalysisContent');
+    if (!container || !diagnosisId) return;
+
+    try {
+        // fetch instead of EventSource so the bearer token can be sent
+        const response = await fetch(`${API_BASE_URL}/diagnosis/${diagnosisId}/analysis/stream`, {
+            headers: { 'Authorization': `Bearer ${authToken}` }
+        });
+        if (!response.ok) {
+            throw new Error('AI analysis request failed');
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let analysis = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+
+            for (const raw of events) {
+                const lines = raw.split('\n');
+                const eventLine = lines.find(l => l.startsWith('event: ')) || '';
+                const dataLine = lines.find(l => l.startsWith('data: ')) || 'data: {}';
+                const event = eventLine.slice('event: '.length);
+                const data = JSON.parse(dataLine.slice('data: '.length));
+
+                if (event === 'chunk') {
+                    analysis += data.text;
+                    container.textContent = analysis;
+                } else if (event === 'done') {
+                    container.textContent = data.ai_analysis;
+                }
+            }
+        }
+    } catch (error) {
+        console.error('AI analysis stream failed:', error);
+        container.textContent = 'AI analysis unavailable. Please try again later.';
+    }
+}
+
 async function loadDiagnosisHistory() {
     try {
-        const diagnoses = await apiCall('/diagnosis/history');
+        // Newest first; the AI text is not shown here so it is not fetched
+        const data = await apiCall('/diagnosis/history?limit=10&fields=timestamp,input_symptoms,primary_diagnosis');
+        const diagnoses = data.history;
 
         const container = document.getElementById('diagnosisHistoryList');
         if (!diagnoses || diagnoses.length === 0) {
@@ -369,7 +432,7 @@ async function loadDiagnosisHistory() {
             return;
         }
 
-        container.innerHTML = diagnoses.slice(-10).reverse().map(diag => {
+        container.innerHTML = diagnoses.map(diag => {
             // Handle both old and new data structures
             const disease = diag.primary_diagnosis?.disease || diag.primary_diagnosis || 'Unknown';
             const confidence = diag.primary_diagnosis?.confidence || 0;
@@ -584,7 +647,7 @@ async function handleReminder(e) {
 
 async function loadReminders() {
     try {
-        const data = await apiCall('/reminders');
+        const data = await apiCall('/reminders?limit=100');
         const reminders = data.reminders;
 
         const container = document.getElementById('remindersList');
@@ -654,7 +717,8 @@ async function handleHealthRecord(e) {
 
 async function loadHealthRecords() {
     try {
-        const data = await apiCall('/health-records');
+        // Newest first
+        const data = await apiCall('/health-records?limit=10');
         const records = data.records;
 
         const container = document.getElementById('healthRecordsList');
@@ -663,7 +727,7 @@ async function loadHealthRecords() {
             return;
         }
 
-        container.innerHTML = records.slice(-10).reverse().map(rec => `
+        container.innerHTML = records.map(rec => `
             <div class="list-item">
                 <p><strong>Date:</strong> ${rec.date}</p>
                 <div class="grid grid-3">
@@ -676,7 +740,7 @@ async function loadHealthRecords() {
             </div>
         `).join('');
 
-        updateHeartRateChart(records);
+        updateHeartRateChart(records.slice().reverse());
 
     } catch (error) {
         console.error('Failed to load health records:', error);
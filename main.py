@@ -1,12 +1,31 @@
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+# scipy and scikit-learn are imported inside the functions that build models
+# so that importing this module stays cheap (see IMPORT_SECONDS below)
 import numpy as np 
-import pandas as pd
-from sklearn.neighbors import KNeighborsClassifier
 import datetime
 import webbrowser
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from collections import Counter, OrderedDict
+import copy
 import json
 import os
 import sys
+import hashlib
+import shutil
+import sqlite3
+import asyncio
+import uuid
+import threading
+import bisect
+import base64
+import re
+import weakref
+import decimal
+import pickle
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 # Fix Unicode encoding for Windows console
 if sys.platform == 'win32':
@@ -19,11 +38,6 @@ if sys.platform == 'win32':
         sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
         sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
 
-# Ensure .cursor directory exists for logging
-LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cursor')
-LOG_FILE = os.path.join(LOG_DIR, 'debug.log')
-os.makedirs(LOG_DIR, exist_ok=True)
-
 # Configuration
 GOOGLE_API_KEY = 'GOOGLE_API_KEY'
 SUPABASE_URL = 'YOUR_SUPABASE_URL'
@@ -36,88 +50,196 @@ from dotenv import load_dotenv
 # Load environment variables from .env
 load_dotenv()
 
-# Initialize Supabase Client
-SUPABASE_AVAILABLE = False
-supabase = None
+# Budget in seconds for importing this module (exceeding it logs a warning)
+IMPORT_BUDGET_SECONDS = float(os.getenv('IMPORT_BUDGET_SECONDS', '0.5'))
 
-try:
-    # Initialize Supabase Client
-    from supabase import create_client, Client
-    
-    # Get Supabase credentials from environment or use config
-    supabase_url = os.getenv("SUPABASE_URL", SUPABASE_URL)
-    supabase_key = os.getenv("SUPABASE_KEY", SUPABASE_KEY)
-    
-    print(f"DEBUG: URL present: {bool(supabase_url)}")
-    print(f"DEBUG: Key present: {bool(supabase_key)}")
-    if supabase_url: print(f"DEBUG: URL value: {supabase_url[:10]}...")
-    if supabase_key: print(f"DEBUG: Key value: {supabase_key[:5]}...")
-    
-    print(f"DEBUG: URL={supabase_url} KEY={'Found' if supabase_key else 'Missing'}")
+# Seconds between background reloads of the disease catalog (0 disables)
+CATALOG_REFRESH_SECONDS = float(os.getenv('CATALOG_REFRESH_SECONDS', '300'))
 
-    if supabase_url and supabase_key and "YOUR_SUPABASE" not in supabase_url:
-        try:
-             supabase: Client = create_client(supabase_url, supabase_key)
-             SUPABASE_AVAILABLE = True
-             print("✅ Supabase connected successfully")
-        except Exception as conn_err:
-             print(f"❌ Connection error: {conn_err}")
-             import traceback
-             traceback.print_exc()
-             SUPABASE_AVAILABLE = False
-             supabase = None
-    else:
-        print("⚠️ Supabase credentials not configured or valid.")
-        SUPABASE_AVAILABLE = False
-        supabase = None
-except ImportError as import_error:
-    print(f"⚠️ Supabase library not installed: {import_error}")
-    print("💡 Install it with: pip install supabase")
-    SUPABASE_AVAILABLE = False
-    supabase = None
-except Exception as e:
-    print(f"⚠️ Failed to initialize Supabase: {e}")
-    SUPABASE_AVAILABLE = False
-    supabase = None
-
-# Initialize Gemini / Generative AI Client (robust with fallbacks)
-GEMINI_AVAILABLE = False
-model = None
-try:
-    import google.generativeai as genai
-    
-    # Get API key from environment variable
-    google_api_key = os.getenv('GOOGLE_API_KEY', '')
-    
-    if not google_api_key:
-        print("⚠️ GOOGLE_API_KEY not found in environment variables")
-        print("💡 AI-powered diagnosis will not be available")
-        raise ValueError("GOOGLE_API_KEY not configured")
-    
-    genai.configure(api_key=google_api_key)
-
-    # Try a list of likely-supported model identifiers until one works
-    candidate_models = [
-        'gemini-pro',
-        'gemini-1.5-pro',
-        'gemini-1.5',
-        'models/gemini-1.5',
-        'text-bison-001',
-        'chat-bison'
-    ]
-
-    last_error = None
-    for mname in candidate_models:
-        try:
-            model = genai.GenerativeModel(mname)
-            GEMINI_AVAILABLE = True
-            print(f"✅ Generative AI connected successfully (model={mname})")
-            break
-        except Exception as e:
-            last_error = e
+# On-disk copy of the last catalog snapshot, used for fast cold starts (empty disables)
+CATALOG_CACHE_DIR = os.getenv('CATALOG_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'catalog'))
+CATALOG_CACHE_FORMAT = 1
+# Seconds a cached catalog directory is kept after CURRENT stopped pointing
+# at it, so a worker still loading it is not pulled out from under
+CATALOG_CACHE_GRACE_SECONDS = float(os.getenv('CATALOG_CACHE_GRACE_SECONDS', '600'))
+
+# Minimum trigram similarity (0-1) for a misspelled symptom to be corrected (0 disables)
+SYMPTOM_FUZZY_THRESHOLD = float(os.getenv('SYMPTOM_FUZZY_THRESHOLD', '0.4'))
+
+# Disease classifier, one of CLASSIFIER_BACKENDS (knn-brute, knn-ball-tree,
+# knn-kd-tree, hamming-packed, jaccard, bernoulli-nb)
+CLASSIFIER_BACKEND = os.getenv('CLASSIFIER_BACKEND', 'knn-brute')
+
+# Bounds of the in-process cache of predict_disease results
+PREDICTION_CACHE_SIZE = int(os.getenv('PREDICTION_CACHE_SIZE', '1024'))
+PREDICTION_CACHE_TTL_SECONDS = float(os.getenv('PREDICTION_CACHE_TTL_SECONDS', '3600'))
+
+# Seconds a diagnosis waits for its deferred AI analysis to be requested
+DEFERRED_ANALYSIS_TTL_SECONDS = float(os.getenv('DEFERRED_ANALYSIS_TTL_SECONDS', '900'))
+
+# SQLite file caching Gemini responses across restarts and workers (empty disables)
+GEMINI_CACHE_PATH = os.getenv('GEMINI_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'gemini.sqlite3'))
+GEMINI_CACHE_TTL_SECONDS = float(os.getenv('GEMINI_CACHE_TTL_SECONDS', '86400'))
+GEMINI_CACHE_MAX_BYTES = int(os.getenv('GEMINI_CACHE_MAX_BYTES', str(50 * 1024 * 1024)))
+
+# Limits for Gemini calls made from the API: concurrent calls per process,
+# seconds to wait for a free slot, and seconds allowed per call
+GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', '8'))
+GEMINI_QUEUE_TIMEOUT_SECONDS = float(os.getenv('GEMINI_QUEUE_TIMEOUT_SECONDS', '2'))
+GEMINI_TIMEOUT_SECONDS = float(os.getenv('GEMINI_TIMEOUT_SECONDS', '20'))
+
+# Threads running CPU-bound symptom matching and classifier scoring for the API
+SCORING_WORKERS = int(os.getenv('SCORING_WORKERS', '4'))
+
+# Background workers computing deferred AI analyses, and how many jobs may wait
+ANALYSIS_WORKERS = int(os.getenv('ANALYSIS_WORKERS', '4'))
+ANALYSIS_QUEUE_SIZE = int(os.getenv('ANALYSIS_QUEUE_SIZE', '256'))
+
+# Threads running blocking database calls for the API, and the longest one
+# call (queueing included) may take before the request gives up on it
+DATA_ACCESS_WORKERS = int(os.getenv('DATA_ACCESS_WORKERS', '8'))
+DATA_ACCESS_TIMEOUT_SECONDS = float(os.getenv('DATA_ACCESS_TIMEOUT_SECONDS', '10'))
+
+# Where app data is read and written: 'supabase' (REST client) or 'postgres'
+# (pooled direct connections to DATABASE_URL, e.g. the Supabase project's
+# own Postgres). See DATA_BACKENDS.
+DATA_BACKEND = os.getenv('DATA_BACKEND', 'supabase')
+DATABASE_URL = os.getenv('DATABASE_URL', '')
+DATABASE_POOL_SIZE = int(os.getenv('DATABASE_POOL_SIZE', '12'))
+# Whether statements are PREPAREd once per connection: 'true', 'false', or
+# 'auto' (off for Supabase's transaction-mode pooler on port 6543, which hands
+# each transaction a different server connection, so prepared names vanish)
+DATABASE_PREPARED_STATEMENTS = os.getenv('DATABASE_PREPARED_STATEMENTS', 'auto').lower()
+
+# diagnosis_history rows are written behind the request (see HistoryWriter):
+# inserted in batches of HISTORY_BATCH_SIZE or HISTORY_FLUSH_SECONDS after the
+# oldest arrived. At most HISTORY_QUEUE_SIZE rows wait in memory; past that a
+# request waits up to HISTORY_BACKPRESSURE_SECONDS for room, then its row is
+# spilled to HISTORY_SPILL_PATH (also used while the database is unreachable).
+HISTORY_BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', '50'))
+HISTORY_FLUSH_SECONDS = float(os.getenv('HISTORY_FLUSH_SECONDS', '2'))
+HISTORY_QUEUE_SIZE = int(os.getenv('HISTORY_QUEUE_SIZE', '1000'))
+HISTORY_BACKPRESSURE_SECONDS = float(os.getenv('HISTORY_BACKPRESSURE_SECONDS', '1'))
+# Seconds a user's dashboard summary (counts, latest items) is reused; it is
+# also dropped as soon as that user saves something
+DASHBOARD_CACHE_TTL_SECONDS = float(os.getenv('DASHBOARD_CACHE_TTL_SECONDS', '30'))
+# Users are loaded on demand by email and kept in an LRU of USER_CACHE_SIZE
+# entries for USER_CACHE_TTL_SECONDS; emails with no account are remembered
+# for USER_NEGATIVE_CACHE_TTL_SECONDS, short so that a registration on
+# another worker is picked up quickly
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL_SECONDS = float(os.getenv('USER_CACHE_TTL_SECONDS', '300'))
+USER_NEGATIVE_CACHE_TTL_SECONDS = float(os.getenv('USER_NEGATIVE_CACHE_TTL_SECONDS', '5'))
+
+# Layout of diagnosis_history.primary_diagnosis written by history_record();
+# rows without a 'format' key are the original full copies of the disease info.
+# Format 2 rows hold matched symptoms as catalog column ids, readable only
+# while that catalog is current; format 3 rows hold the symptom names.
+HISTORY_ROW_FORMAT = 3
+HISTORY_SPILL_PATH = os.getenv('HISTORY_SPILL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'history_spill.jsonl'))
+
+# External clients
+# The Supabase client and Gemini model are created on first use (or up front
+# by init_clients) so that importing this module stays cheap; see
+# IMPORT_SECONDS at the bottom of the file.
+_supabase_lock = threading.Lock()
+_supabase_client = None
+_supabase_loaded = False
+
+_gemini_lock = threading.Lock()
+_gemini_model = None
+_gemini_model_name = None
+_gemini_loaded = False
+
+def _create_supabase():
+    """Connect to Supabase; returns the client or None"""
+    try:
+        from supabase import create_client, Client
+        
+        # Get Supabase credentials from environment or use config
+        supabase_url = os.getenv("SUPABASE_URL", SUPABASE_URL)
+        supabase_key = os.getenv("SUPABASE_KEY", SUPABASE_KEY)
+        
+        print(f"DEBUG: URL present: {bool(supabase_url)}")
+        print(f"DEBUG: Key present: {bool(supabase_key)}")
+        if supabase_url: print(f"DEBUG: URL value: {supabase_url[:10]}...")
+        if supabase_key: print(f"DEBUG: Key value: {supabase_key[:5]}...")
+        
+        print(f"DEBUG: URL={supabase_url} KEY={'Found' if supabase_key else 'Missing'}")
 
-    # If none of the candidates worked, try to list available models (if supported)
-    if not GEMINI_AVAILABLE:
+        if supabase_url and supabase_key and "YOUR_SUPABASE" not in supabase_url:
+            try:
+                client: Client = create_client(supabase_url, supabase_key)
+                print("✅ Supabase connected successfully")
+                return client
+            except Exception as conn_err:
+                print(f"❌ Connection error: {conn_err}")
+                import traceback
+                traceback.print_exc()
+                return None
+        else:
+            print("⚠️ Supabase credentials not configured or valid.")
+            return None
+    except ImportError as import_error:
+        print(f"⚠️ Supabase library not installed: {import_error}")
+        print("💡 Install it with: pip install supabase")
+        return None
+    except Exception as e:
+        print(f"⚠️ Failed to initialize Supabase: {e}")
+        return None
+
+def get_supabase():
+    """The shared Supabase client, created on first call; None if unavailable"""
+    global _supabase_client, _supabase_loaded
+    if not _supabase_loaded:
+        with _supabase_lock:
+            if not _supabase_loaded:
+                _supabase_client = _create_supabase()
+                _supabase_loaded = True
+    return _supabase_client
+
+def supabase_available() -> bool:
+    """Whether a Supabase connection could be established"""
+    return get_supabase() is not None
+
+def supabase_connected() -> Optional[bool]:
+    """Whether the Supabase client exists, without waiting; None while it has not been created yet"""
+    return (_supabase_client is not None) if _supabase_loaded else None
+
+def _create_gemini_model():
+    """Configure Generative AI and pick a model; returns (model, model name) or (None, None)"""
+    try:
+        import google.generativeai as genai
+        
+        # Get API key from environment variable
+        google_api_key = os.getenv('GOOGLE_API_KEY', '')
+        
+        if not google_api_key:
+            print("⚠️ GOOGLE_API_KEY not found in environment variables")
+            print("💡 AI-powered diagnosis will not be available")
+            raise ValueError("GOOGLE_API_KEY not configured")
+        
+        genai.configure(api_key=google_api_key)
+
+        # Try a list of likely-supported model identifiers until one works
+        candidate_models = [
+            'gemini-pro',
+            'gemini-1.5-pro',
+            'gemini-1.5',
+            'models/gemini-1.5',
+            'text-bison-001',
+            'chat-bison'
+        ]
+
+        for mname in candidate_models:
+            try:
+                gemini_model = genai.GenerativeModel(mname)
+                print(f"✅ Generative AI connected successfully (model={mname})")
+                return gemini_model, mname
+            except Exception:
+                pass
+
+        # If none of the candidates worked, try to list available models (if supported)
         list_models_fn = getattr(genai, 'list_models', None) or getattr(genai, 'get_models', None)
         try:
             if callable(list_models_fn):
@@ -136,39 +258,98 @@ try:
         # Final informative message
         print("⚠️ Generative AI models not initialized. Update the model name or the client library (google.genai).")
 
-except Exception as e:
-    print(f"⚠️ Generative AI client not available: {e}")
-    GEMINI_AVAILABLE = False
-    model = None
+    except Exception as e:
+        print(f"⚠️ Generative AI client not available: {e}")
+    return None, None
+
+def get_gemini():
+    """The shared (Gemini model, model name), created on first call; (None, None) if unavailable"""
+    global _gemini_model, _gemini_model_name, _gemini_loaded
+    if not _gemini_loaded:
+        with _gemini_lock:
+            if not _gemini_loaded:
+                _gemini_model, _gemini_model_name = _create_gemini_model()
+                _gemini_loaded = True
+    return _gemini_model, _gemini_model_name
+
+def gemini_available() -> bool:
+    """Whether a Gemini model could be initialized"""
+    return get_gemini()[0] is not None
+
+def init_clients():
+    """Create the Supabase client and Gemini model concurrently (e.g. at server startup)"""
+    started = time.perf_counter()
+    workers = [threading.Thread(target=get_supabase), threading.Thread(target=get_gemini)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    logger.info("External clients initialized", seconds=round(time.perf_counter() - started, 3),
+                supabase=supabase_available(), gemini=gemini_available())
+
+# Old module attributes, now resolved lazily
+_LAZY_ATTRIBUTES = {
+    'supabase': lambda: get_supabase(),
+    'SUPABASE_AVAILABLE': lambda: supabase_available(),
+    'model': lambda: get_gemini()[0],
+    'GEMINI_MODEL_NAME': lambda: get_gemini()[1],
+    'GEMINI_AVAILABLE': lambda: gemini_available(),
+}
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # User Authentication System
 class UserAuthSystem:
-    def __init__(self):
+    """Users are fetched by email when first needed, not loaded at startup.
+    
+    `users` is a bounded LRU/TTL cache of user rows without their password
+    hash; `unknown_users` remembers emails that have no account. Call
+    remember() after writing a user and forget() to drop a stale entry.
+    """
+    
+    def __init__(self, store=None):
         self.current_user = None
-        self.users = {}
-        self.load_users()
-        
-    def load_users(self):
-        """Load users from Supabase database only"""
-        if not SUPABASE_AVAILABLE or not supabase:
+        self.users = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+        self.unknown_users = TTLCache(USER_CACHE_SIZE, USER_NEGATIVE_CACHE_TTL_SECONDS)
+        self.store = store or create_store()
+        if not self.store.available:
             logger.error("Supabase is required for production deployment")
             print("❌ Supabase database connection is required!")
             print("💡 Please configure SUPABASE_URL and SUPABASE_KEY in .env file")
-            return
-        
-        try:
-            response = supabase.table('users').select('*').execute()
-            self.users = {}
-            for user in (response.data or []):
-                self.users[user['email']] = user
-            logger.info("Users loaded from Supabase", count=len(self.users))
-        except Exception as e:
-            logger.error("Failed to load users from Supabase", error=str(e))
-            print(f"⚠️ Failed to load users from database: {e}")
+    
+    def find_user(self, email: str) -> Optional[Dict]:
+        """The user with `email`, from the cache or else the database; None if there is none"""
+        user = self.users.get(email)
+        if user is not None:
+            logger.incr("user_cache_hits")
+            return user
+        if self.unknown_users.get(email):
+            logger.incr("user_cache_hits")
+            return None
+        logger.incr("user_cache_misses")
+        user = self.store.get_user(email)
+        if user is None:
+            self.unknown_users.set(email, True)
+            return None
+        return self.remember(user)
+    
+    def remember(self, user_data: Dict) -> Dict:
+        """Cache a user row just read or written; returns the cached copy"""
+        user = {k: v for k, v in user_data.items() if k != 'password_hash'}
+        self.unknown_users.pop(user['email'])
+        self.users.set(user['email'], user)
+        return user
+    
+    def forget(self, email: str):
+        self.users.pop(email)
+        self.unknown_users.pop(email)
     
     def save_users(self):
         """Save/update user to Supabase database only - no JSON files"""
-        if not SUPABASE_AVAILABLE or not supabase:
+        if not supabase_available():
             logger.error("Supabase is required for saving users")
             raise Exception("Database connection required")
         
@@ -178,12 +359,9 @@ class UserAuthSystem:
     
     def save_user(self, user_data):
         """Save or update a single user to Supabase"""
-        if not SUPABASE_AVAILABLE or not supabase:
-            raise Exception("Database connection required")
-        
         try:
-            supabase.table('users').upsert(user_data).execute()
-            self.users[user_data['email']] = user_data
+            self.store.upsert_user(user_data)
+            self.remember(user_data)
             logger.info("User saved to Supabase", email=user_data['email'])
             return True
         except Exception as e:
@@ -204,8 +382,8 @@ class UserAuthSystem:
             return None
         
         # Check if user exists
-        if email in self.users:
-            user_data = self.users[email]
+        user_data = self.find_user(email)
+        if user_data:
             print(f"\n✅ Welcome back, {user_data['name']}!")
         else:
             # New user registration
@@ -222,19 +400,16 @@ class UserAuthSystem:
                 'login_count': 0
             }
             
-            self.users[email] = user_data
             self.save_user(user_data)  # Save to Supabase
             print(f"\n✅ Account created successfully! Welcome, {name}!")
         
         # Update login count
-        self.users[email]['login_count'] = self.users[email].get('login_count', 0) + 1
-        self.users[email]['last_login'] = datetime.datetime.now().isoformat()
-        self.save_user(self.users[email])  # Save to Supabase
+        user_data = dict(user_data)
+        user_data['login_count'] = user_data.get('login_count', 0) + 1
+        user_data['last_login'] = datetime.datetime.now().isoformat()
+        self.save_user(user_data)  # Save to Supabase
         
-        self.current_user = self.users[email]
-        return self.current_user
-        
-        self.current_user = self.users[email]
+        self.current_user = self.users.get(email, user_data)
         return self.current_user
     
     def switch_account(self):
@@ -243,11 +418,13 @@ class UserAuthSystem:
         print("🔄 SWITCH ACCOUNT")
         print("="*60)
         
-        if self.users:
+        # Only the console lists every account, so it reads the table here
+        users = {user['email']: user for user in self.store.list_users()} if self.store.available else {}
+        if users:
             print("\nAvailable accounts:")
-            accounts = list(self.users.keys())
+            accounts = list(users.keys())
             for i, email in enumerate(accounts, 1):
-                user = self.users[email]
+                user = users[email]
                 print(f"{i}. {user['name']} ({email})")
             
             print(f"{len(accounts) + 1}. Login with different account")
@@ -258,7 +435,7 @@ class UserAuthSystem:
                 choice_num = int(choice)
                 if 1 <= choice_num <= len(accounts):
                     email = accounts[choice_num - 1]
-                    self.current_user = self.users[email]
+                    self.current_user = self.remember(users[email])
                     print(f"\n✅ Switched to {self.current_user['name']}'s account")
                     return self.current_user
                 elif choice_num == len(accounts) + 1:
@@ -303,7 +480,6 @@ class UserAuthSystem:
             new_name = input("Enter new name: ").strip()
             if new_name:
                 self.current_user['name'] = new_name
-                self.users[self.current_user['email']]['name'] = new_name
                 self.save_user(self.current_user)  # Save to Supabase
                 print("✅ Name updated successfully!")
 
@@ -311,7 +487,6 @@ class UserAuthSystem:
             new_phone = input("Enter new phone: ").strip()
             if new_phone:
                 self.current_user['phone'] = new_phone
-                self.users[self.current_user['email']]['phone'] = new_phone
                 self.save_user(self.current_user)  # Save to Supabase
                 print("✅ Phone updated successfully!")
 
@@ -342,6 +517,13 @@ class EventsLogger:
     def incr(self, metric_name: str, amount: int = 1):
         self.metrics[metric_name] = self.metrics.get(metric_name, 0) + amount
 
+    def timing(self, metric_name: str, seconds: float):
+        """Record one timed call: <metric>_count, <metric>_ms (total) and <metric>_max_ms"""
+        ms = int(seconds * 1000)
+        self.incr(f"{metric_name}_count")
+        self.incr(f"{metric_name}_ms", ms)
+        self.metrics[f"{metric_name}_max_ms"] = max(self.metrics.get(f"{metric_name}_max_ms", 0), ms)
+
     def dump(self):
         return {
             "logs": self.logs[-50:],
@@ -350,9 +532,1299 @@ class EventsLogger:
 
 logger = EventsLogger()
 
+# Caching
+_MISSING = object()
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, _MISSING)
+            return default if entry is _MISSING else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class GeminiResponseCache:
+    """Content-addressed store of Gemini responses in a local SQLite file.
+
+    Entries are keyed by a hash of the model name and prompt, expire after
+    `ttl` seconds and are evicted least-recently-used once the stored text
+    exceeds `max_bytes`. SQLite's file locking lets every uvicorn worker on
+    the host share one cache; each operation opens its own connection so
+    the cache is safe to use from any thread. Cache errors are logged and
+    treated as misses, never as failed diagnoses.
+    """
+
+    def __init__(self, path: str, ttl: float = 86400, max_bytes: int = 50 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = bool(path)
+        if not self.enabled:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    " key TEXT PRIMARY KEY, model TEXT, response TEXT NOT NULL,"
+                    " size INTEGER NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        except Exception as e:
+            logger.error("Gemini response cache unavailable", path=path, error=str(e))
+            self.enabled = False
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    @staticmethod
+    def make_key(model_name: str, prompt: str) -> str:
+        return hashlib.sha256(f"{model_name}\0{prompt}".encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> str:
+        """Return the cached response for a key, or None"""
+        if not self.enabled:
+            return None
+        try:
+            now = time.time()
+            with self._connect() as conn:
+                row = conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                if now - row[1] > self.ttl:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    return None
+                conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                return row[0]
+        except Exception as e:
+            logger.error("Gemini response cache read failed", error=str(e))
+            return None
+
+    def set(self, key: str, model_name: str, response: str):
+        """Store a response and evict expired or excess entries"""
+        if not self.enabled:
+            return
+        try:
+            now = time.time()
+            size = len(response.encode('utf-8'))
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, accessed_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, model_name, response, size, now, now)
+                )
+                conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+                total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                if total > self.max_bytes:
+                    evict = []
+                    for old_key, old_size in conn.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+                        if total <= self.max_bytes:
+                            break
+                        evict.append((old_key,))
+                        total -= old_size
+                    conn.executemany("DELETE FROM responses WHERE key = ?", evict)
+        except Exception as e:
+            logger.error("Gemini response cache write failed", error=str(e))
+
+    def delete(self, key: str):
+        if not self.enabled:
+            return
+        try:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+        except Exception as e:
+            logger.error("Gemini response cache delete failed", error=str(e))
+
+# Generative AI Gateway
+class GeminiClient:
+    """Single entry point for Gemini text generation with response caching.
+
+    generate() blocks and is meant for the console app. generate_async()
+    never blocks the event loop: at most `max_concurrency` calls run at once,
+    a caller waits `queue_timeout` seconds for a slot and each call gets
+    `timeout` seconds, after which asyncio.TimeoutError is raised so the
+    caller can fall back to the KNN-only result. Concurrent calls for the
+    same prompt share a single in-flight request (single-flight).
+    """
+
+    def __init__(self, gemini_model=None, model_name: str = None, cache: GeminiResponseCache = None,
+                 max_concurrency: int = 8, queue_timeout: float = 2, timeout: float = 20,
+                 loader=None):
+        # `loader` returns (model, model name) and is called on first use
+        self._model = gemini_model
+        self._model_name = model_name
+        self.loader = loader
+        self.cache = cache or GeminiResponseCache('')
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self._semaphore = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def _load(self):
+        if self.loader is not None:
+            self._model, self._model_name = self.loader()
+            self.loader = None
+
+    @property
+    def model(self):
+        self._load()
+        return self._model
+
+    @model.setter
+    def model(self, gemini_model):
+        self._model = gemini_model
+        self.loader = None
+
+    @property
+    def model_name(self) -> str:
+        self._load()
+        return self._model_name or 'unknown'
+
+    @property
+    def available(self) -> bool:
+        return self.model is not None
+
+    def cache_key(self, prompt: str) -> str:
+        return GeminiResponseCache.make_key(self.model_name, prompt)
+
+    def generate(self, prompt: str) -> str:
+        """Return the response text for a prompt, from cache when possible"""
+        key = self.cache_key(prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            logger.incr("gemini_cache_hits")
+            return cached
+        logger.incr("gemini_cache_misses")
+        
+        response = self.model.generate_content(prompt)
+        text = response.text
+        self.cache.set(key, self.model_name, text)
+        return text
+
+    async def generate_async(self, prompt: str, timeout: float = None) -> str:
+        """Awaitable generate() bounded by the concurrency limit and timeouts.
+        
+        `timeout` caps how long this caller waits (e.g. the rest of a request
+        deadline); the call itself keeps running and caches its response.
+        """
+        key = self.cache_key(prompt)
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        
+        while True:
+            # Join an identical request already in flight instead of repeating it.
+            # The shield keeps one caller's cancellation from cancelling the rest.
+            task = self._inflight.get(key)
+            if task is not None:
+                logger.incr("gemini_singleflight_hits")
+            else:
+                task = asyncio.ensure_future(self._generate_shared(prompt, key))
+                self._inflight[key] = task
+                task.add_done_callback(lambda done: self._inflight.pop(key, None)
+                                       if self._inflight.get(key) is done else None)
+            
+            try:
+                if deadline is None:
+                    return await asyncio.shield(task)
+                return await asyncio.wait_for(asyncio.shield(task), max(deadline - loop.time(), 0))
+            except asyncio.CancelledError:
+                # Only a stream abandoned by its reader is cancelled; call again
+                if not task.cancelled():
+                    raise
+
+    async def _generate_shared(self, prompt: str, key: str) -> str:
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            logger.incr("gemini_cache_hits")
+            return cached
+        logger.incr("gemini_cache_misses")
+        
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            logger.incr("gemini_calls_rejected")
+            logger.warning("Gemini concurrency limit reached", limit=self.max_concurrency)
+            raise
+        
+        try:
+            if hasattr(self.model, 'generate_content_async'):
+                call = self.model.generate_content_async(prompt)
+            else:
+                call = asyncio.to_thread(self.model.generate_content, prompt)
+            response = await asyncio.wait_for(call, self.timeout)
+        except asyncio.TimeoutError:
+            logger.incr("gemini_calls_timed_out")
+            logger.warning("Gemini call timed out", timeout=self.timeout)
+            raise
+        finally:
+            self._semaphore.release()
+        
+        text = response.text
+        if text:
+            await asyncio.to_thread(self.cache.set, key, self.model_name, text)
+        return text
+
+    async def stream_async(self, prompt: str):
+        """Yield response text chunks as Gemini produces them.
+        
+        Uses the client's streaming mode under the same concurrency limit;
+        the timeout covers the whole stream. A cached response is yielded as
+        a single chunk and a completed, non-empty stream is added to the
+        cache. While a stream runs it is registered as the in-flight call for
+        its prompt: identical calls receive its full text (or its error) as
+        one chunk, and start their own call if its reader abandons it.
+        """
+        key = self.cache_key(prompt)
+        
+        while True:
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            logger.incr("gemini_singleflight_hits")
+            try:
+                text = await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                continue
+            yield text
+            return
+        
+        if not hasattr(self.model, 'generate_content_async'):
+            yield await self.generate_async(prompt)
+            return
+        
+        shared = asyncio.get_running_loop().create_future()
+        self._inflight[key] = shared
+        try:
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                logger.incr("gemini_cache_hits")
+                shared.set_result(cached)
+                yield cached
+                return
+            logger.incr("gemini_cache_misses")
+            
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                logger.incr("gemini_calls_rejected")
+                logger.warning("Gemini concurrency limit reached", limit=self.max_concurrency)
+                raise
+            
+            chunks = []
+            try:
+                loop = asyncio.get_running_loop()
+                deadline = loop.time() + self.timeout
+                response = await asyncio.wait_for(
+                    self.model.generate_content_async(prompt, stream=True), self.timeout
+                )
+                stream = response.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(stream.__anext__(), max(deadline - loop.time(), 0))
+                    except StopAsyncIteration:
+                        break
+                    if chunk.text:
+                        chunks.append(chunk.text)
+                        yield chunk.text
+            except asyncio.TimeoutError:
+                logger.incr("gemini_calls_timed_out")
+                logger.warning("Gemini stream timed out", timeout=self.timeout)
+                raise
+            finally:
+                self._semaphore.release()
+            
+            text = ''.join(chunks)
+            shared.set_result(text)
+            if text:
+                await asyncio.to_thread(self.cache.set, key, self.model_name, text)
+        except Exception as e:
+            if not shared.done():
+                shared.set_exception(e)
+                # Mark it retrieved: there may be no one waiting on it
+                shared.exception()
+            raise
+        finally:
+            if self._inflight.get(key) is shared:
+                del self._inflight[key]
+            if not shared.done():
+                shared.cancel()
+
+    def forget(self, prompt: str):
+        """Drop a cached response, e.g. one the caller could not use"""
+        self.cache.delete(self.cache_key(prompt))
+
+class AnalysisJobQueue:
+    """Bounded queue of deferred AI analyses served by background workers.
+    
+    `runner(job)` is awaited for each submitted job and returns the analysis
+    text; listeners are then awaited with the finished job (e.g. to write it
+    back to storage). Workers are started on first use on the running loop.
+    """
+
+    def __init__(self, runner, workers: int = 4, max_pending: int = 256):
+        self.runner = runner
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self._queue = None
+        self._tasks = []
+        self._loop = None
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """Await `listener(job)` after every finished job"""
+        self._listeners.append(listener)
+
+    def _ensure_workers(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._tasks:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(self.max_pending)
+        self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+        logger.info("Analysis workers started", workers=self.workers)
+
+    def submit(self, job: Dict) -> bool:
+        """Queue a job; returns False (job finished with a fallback) if the queue is full"""
+        self._ensure_workers()
+        job['status'] = 'pending'
+        job['finished'] = asyncio.Event()
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            logger.incr("analysis_jobs_rejected")
+            logger.warning("Analysis queue full", max_pending=self.max_pending)
+            job['result']['ai_analysis'] = "AI analysis unavailable: too many analyses are queued. Showing the rule-based result only."
+            job['status'] = 'failed'
+            job['finished'].set()
+            return False
+        logger.incr("analysis_jobs_submitted")
+        return True
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                job['status'] = 'running'
+                job['result']['ai_analysis'] = await self.runner(job)
+                job['status'] = 'done'
+                logger.incr("analysis_jobs_done")
+            except Exception as e:
+                logger.error("Analysis job failed", error=str(e))
+                job['result']['ai_analysis'] = f"AI analysis unavailable: {str(e)}"
+                job['status'] = 'failed'
+            finally:
+                job['finished'].set()
+                self._queue.task_done()
+            
+            for listener in self._listeners:
+                try:
+                    await listener(job)
+                except Exception as e:
+                    logger.error("Analysis job listener failed", error=str(e))
+
+    async def stop(self):
+        """Cancel the workers; queued jobs are dropped"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+# Data access
+# Paged reads take `limit`, a keyset position (the sort key of the last row
+# already seen) and the columns to return. API clients get that position as
+# an opaque cursor string.
+def encode_cursor(*values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str, arity: int = 1) -> list:
+    """Keyset values packed by encode_cursor; ValueError if the cursor is malformed"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor") from None
+    if not isinstance(values, list) or len(values) != arity or \
+            not all(v is None or isinstance(v, (str, int)) for v in values):
+        raise ValueError("Invalid cursor")
+    return values
+
+def row_id_position(row_id):
+    """Checked id keyset value (serial or uuid); ValueError if malformed"""
+    try:
+        return int(row_id) if str(row_id).isdigit() else str(uuid.UUID(str(row_id)))
+    except ValueError:
+        raise ValueError("Invalid cursor") from None
+
+def history_position(before: list):
+    """Checked (timestamp, id) keyset values of a diagnosis-history page; ValueError if malformed.
+    
+    The id is None after a row still buffered by HistoryWriter, which has none
+    yet. Buffered rows come before the stored rows of their timestamp, so the
+    next page takes stored rows up to and including that timestamp: one that
+    was flushed in between can show up twice, but none is skipped.
+    """
+    timestamp, row_id = before
+    try:
+        timestamp = datetime.datetime.fromisoformat(str(timestamp)).isoformat()
+    except ValueError:
+        raise ValueError("Invalid cursor") from None
+    return timestamp, None if row_id is None else row_id_position(row_id)
+
+def history_sort_key(row: Dict):
+    """Where a diagnosis-history row sorts, oldest first: by timestamp, then id.
+    
+    A row still buffered by HistoryWriter has no id and sorts after the stored
+    rows of its timestamp; its timestamp is naive local time.
+    """
+    moment = datetime.datetime.fromisoformat(str(row['timestamp']))
+    return (moment if moment.tzinfo else moment.astimezone(),
+            float('inf') if row.get('id') is None else row['id'])
+
+def health_record_position(before: list):
+    """Checked (date, id) keyset values of a health-record page; ValueError if malformed"""
+    date, row_id = before
+    try:
+        date = datetime.date.fromisoformat(str(date)).isoformat()
+    except ValueError:
+        raise ValueError("Invalid cursor") from None
+    return date, row_id_position(row_id)
+
+# Per-user tables counted for the dashboard (see user_counts)
+USER_TABLES = ('diagnosis_history', 'medicine_reminders', 'health_records')
+
+def placeholder_user(email: str) -> Dict:
+    """User row auto-created when data is saved for an unknown email"""
+    username = email.split('@')[0]
+    return {
+        'email': email,
+        'name': f'User {username.capitalize()}',
+        'phone': f'98765{hash(email) % 100000:05d}',
+        'user_type': 'patient',
+        'registered_on': datetime.datetime.now().isoformat(),
+        'login_count': 0
+    }
+
+class SupabaseStore:
+    """Blocking data access for the app's tables through the Supabase REST client.
+    
+    One method per query or flow the app runs, so callers never build
+    PostgREST queries themselves. Every method needs a configured client;
+    async code should go through AsyncRepository instead of calling these.
+    """
+    name = 'supabase'
+
+    @property
+    def available(self) -> bool:
+        return supabase_available()
+
+    @property
+    def connected(self) -> Optional[bool]:
+        """`available` without waiting for a connection in progress; None until it is known"""
+        return supabase_connected()
+
+    def _table(self, name: str):
+        supabase = get_supabase()
+        if not supabase:
+            raise Exception("Database connection required")
+        return supabase.table(name)
+
+    # Users
+    def list_users(self) -> List[Dict]:
+        return self._table('users').select('*').execute().data or []
+
+    def get_user(self, email: str) -> Optional[Dict]:
+        rows = self._table('users').select('*').eq('email', email).execute().data
+        return rows[0] if rows else None
+
+    def user_exists(self, email: str) -> bool:
+        return bool(self._table('users').select('email').eq('email', email).execute().data)
+
+    def count_users(self) -> int:
+        return self._table('users').select('email', count='exact', head=True).execute().count or 0
+
+    def insert_user(self, user_data: Dict) -> List[Dict]:
+        """Insert a user; returns the inserted rows"""
+        return self._table('users').insert(user_data).execute().data or []
+
+    def upsert_user(self, user_data: Dict):
+        self._table('users').upsert(user_data).execute()
+
+    def update_user(self, email: str, fields: Dict):
+        self._table('users').update(fields).eq('email', email).execute()
+
+    def ensure_user(self, email: str):
+        """Create a placeholder patient for `email` unless it exists; failures are only logged"""
+        try:
+            if self.user_exists(email):
+                return
+            self.insert_user(placeholder_user(email))
+            logger.info("Auto-created user", email=email)
+        except Exception as e:
+            logger.error("Failed to ensure user exists", error=str(e))
+
+    # Diagnosis history
+    def insert_diagnoses(self, records: List[Dict]):
+        """Insert many history rows in one request"""
+        self._table('diagnosis_history').insert(records).execute()
+
+    def update_diagnosis_analysis(self, user_email: str, timestamp: str, ai_analysis: str):
+        (self._table('diagnosis_history')
+            .update({'ai_analysis': ai_analysis})
+            .eq('user_email', user_email)
+            .eq('timestamp', timestamp)
+            .execute())
+
+    def diagnosis_history(self, user_email: str, limit: int = None, before: list = None,
+                          columns: List[str] = None) -> List[Dict]:
+        """A user's diagnoses, newest first; `before` is the (timestamp, id) of the last row already seen.
+        
+        Needs diagnosis_history's id column (see schema.sql).
+        """
+        query = self._table('diagnosis_history').select(*(columns or ['*'])).eq('user_email', user_email)
+        if before:
+            timestamp, row_id = history_position(before)
+            if row_id is None:
+                query = query.lte('timestamp', timestamp)
+            else:
+                query = query.or_(f'timestamp.lt."{timestamp}",and(timestamp.eq."{timestamp}",id.lt.{row_id})')
+        query = query.order('timestamp', desc=True).order('id', desc=True)
+        if limit:
+            query = query.limit(limit)
+        return query.execute().data or []
+
+    # Medicine reminders and health records
+    def add_reminder(self, user_email: str, reminder: Dict):
+        """Insert a reminder, creating the user first if needed"""
+        self.ensure_user(user_email)
+        self._table('medicine_reminders').insert({'user_email': user_email, **reminder}).execute()
+
+    def reminders(self, user_email: str, limit: int = None, after: int = None,
+                  columns: List[str] = None) -> List[Dict]:
+        """A user's reminders in the order they were added; `after` is the id of the last row already seen"""
+        query = self._table('medicine_reminders').select(*(columns or ['*'])).eq('user_email', user_email)
+        if after is not None:
+            query = query.gt('id', row_id_position(after))
+        query = query.order('id')
+        if limit:
+            query = query.limit(limit)
+        return query.execute().data or []
+
+    def add_health_record(self, user_email: str, record: Dict):
+        """Insert a health record, creating the user first if needed"""
+        self.ensure_user(user_email)
+        self._table('health_records').insert({'user_email': user_email, **record}).execute()
+
+    def health_records(self, user_email: str, limit: int = None, before: list = None,
+                       columns: List[str] = None) -> List[Dict]:
+        """A user's health records: all of them oldest first, or with `limit` a page newest first.
+        
+        `before` is the (date, id) of the last row already seen.
+        """
+        query = self._table('health_records').select(*(columns or ['*'])).eq('user_email', user_email)
+        if not limit:
+            return query.order('date').execute().data or []
+        if before:
+            date, row_id = health_record_position(before)
+            query = query.or_(f"date.lt.{date},and(date.eq.{date},id.lt.{row_id})")
+        return query.order('date', desc=True).order('id', desc=True).limit(limit).execute().data or []
+
+    def user_counts(self, user_email: str) -> Dict[str, int]:
+        """A user's row count in each of USER_TABLES (count-only requests, no rows transferred)"""
+        return {
+            table: self._table(table).select('user_email', count='exact', head=True)
+                       .eq('user_email', user_email).execute().count or 0
+            for table in USER_TABLES
+        }
+
+    # Appointments and catalogs
+    def insert_appointment(self, appointment: Dict):
+        self._table('appointments').insert(appointment).execute()
+
+    def list_doctors(self) -> List[Dict]:
+        return self._table('doctors').select('*').execute().data or []
+
+    def insert_doctor(self, doctor_info: Dict):
+        self._table('doctors').insert(doctor_info).execute()
+
+    def list_diseases(self) -> List[Dict]:
+        return self._table('diseases').select('*').execute().data or []
+
+    def close(self):
+        """Nothing to release; the REST client is shared"""
+
+def transaction_pooled(dsn: str) -> bool:
+    """Whether `dsn` points at a transaction-mode pooler port (Supabase: 6543)"""
+    from urllib.parse import urlsplit
+
+    try:
+        if '://' in dsn:
+            return urlsplit(dsn).port == 6543
+    except ValueError:
+        return False
+    return re.search(r'\bport\s*=\s*6543\b', dsn) is not None
+
+def _quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def _json_value(value):
+    """Database value as the REST API would return it (timestamps as ISO strings)"""
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+class PostgresStore:
+    """Blocking data access over direct PostgreSQL connections (psycopg2).
+    
+    Same methods and tables as SupabaseStore, but calls borrow a connection
+    from a thread-safe pool instead of making an HTTPS round trip, each
+    statement is PREPAREd once per connection (unless `prepare` is False,
+    see DATABASE_PREPARED_STATEMENTS), and multi-step flows (ensure
+    the user exists, then insert) run as one transaction. Written values
+    are adapted per column: lists and dicts bound for json/jsonb columns are
+    sent as JSON (as the REST API would), other lists as arrays.
+    """
+    name = 'postgres'
+
+    def __init__(self, dsn: str = None, max_connections: int = None, prepare: bool = None):
+        self.dsn = DATABASE_URL if dsn is None else dsn
+        self.max_connections = max_connections or DATABASE_POOL_SIZE
+        if prepare is None:
+            prepare = DATABASE_PREPARED_STATEMENTS == 'true' or (
+                DATABASE_PREPARED_STATEMENTS == 'auto' and not transaction_pooled(self.dsn))
+        self.prepare = prepare
+        self._pool = None
+        self._pool_loaded = False
+        self._pool_lock = threading.Lock()
+        # SQL text -> statement name, and the names prepared on each connection
+        self._statements = {}
+        self._prepared = weakref.WeakKeyDictionary()
+        # Table -> {column: data_type}, read from information_schema on first write
+        self._column_types = {}
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if not self._pool_loaded:
+                if not self.dsn:
+                    logger.error("DATABASE_URL is required for the postgres data backend")
+                else:
+                    try:
+                        from psycopg2.pool import ThreadedConnectionPool
+                        self._pool = ThreadedConnectionPool(1, self.max_connections, self.dsn)
+                        logger.info("Postgres connection pool created", max_connections=self.max_connections,
+                                    prepared_statements=self.prepare)
+                    except Exception as e:
+                        logger.error("Failed to connect to Postgres", error=str(e))
+                self._pool_loaded = True
+            return self._pool
+
+    @property
+    def available(self) -> bool:
+        return self._get_pool() is not None
+
+    @property
+    def connected(self) -> Optional[bool]:
+        """`available` without waiting for a connection in progress; None until it is known"""
+        return (self._pool is not None) if self._pool_loaded else None
+
+    @contextmanager
+    def transaction(self):
+        """A cursor whose statements commit together, or roll back on error"""
+        from psycopg2.extras import RealDictCursor
+
+        pool = self._get_pool()
+        if pool is None:
+            raise Exception("Database connection required")
+        conn = pool.getconn()
+        try:
+            with conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    yield cur
+        finally:
+            pool.putconn(conn, close=bool(conn.closed))
+
+    def _execute(self, cur, sql_text: str, params=()):
+        """Run `sql_text` ($1, $2, ... placeholders) as a statement prepared once per connection"""
+        if not self.prepare:
+            # Same placeholders as named psycopg2 parameters, sent as plain statements
+            values = {str(i): self._adapt(v) for i, v in enumerate(params, 1)}
+            cur.execute(re.sub(r'\$(\d+)', r'%(\1)s', sql_text.replace('%', '%%')), values)
+            return
+        with self._pool_lock:
+            name = self._statements.setdefault(sql_text, f"medai_{len(self._statements) + 1}")
+        prepared = self._prepared.setdefault(cur.connection, set())
+        if name not in prepared:
+            cur.execute(f"PREPARE {name} AS {sql_text}")
+            prepared.add(name)
+        values = [self._adapt(v) for v in params]
+        if values:
+            cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(values))})", values)
+        else:
+            cur.execute(f"EXECUTE {name}")
+
+    @staticmethod
+    def _adapt(value):
+        from psycopg2.extras import Json
+
+        if isinstance(value, dict) or (isinstance(value, list) and any(isinstance(i, dict) for i in value)):
+            return Json(value)
+        return value
+
+    def _adapt_row(self, cur, table: str, row: Dict) -> Dict:
+        """`row` with lists and dicts wrapped as JSON where the column is json or jsonb"""
+        from psycopg2.extras import Json
+
+        types = self._column_types.get(table)
+        if types is None:
+            cur.execute(
+                "SELECT column_name, data_type FROM information_schema.columns "
+                "WHERE table_schema = current_schema() AND table_name = %s", [table]
+            )
+            types = {r['column_name']: r['data_type'] for r in cur.fetchall()}
+            self._column_types[table] = types
+        return {
+            column: Json(value) if isinstance(value, (dict, list)) and types.get(column) in ('json', 'jsonb')
+            else value
+            for column, value in row.items()
+        }
+
+    def _rows(self, cur) -> List[Dict]:
+        return [{k: _json_value(v) for k, v in row.items()} for row in cur.fetchall()]
+
+    def _query(self, sql_text: str, *params) -> List[Dict]:
+        with self.transaction() as cur:
+            self._execute(cur, sql_text, params)
+            return self._rows(cur)
+
+    def _insert(self, cur, table: str, row: Dict, suffix: str = ''):
+        row = self._adapt_row(cur, table, row)
+        columns = list(row)
+        self._execute(
+            cur,
+            f"INSERT INTO {_quote_identifier(table)} ({', '.join(map(_quote_identifier, columns))}) "
+            f"VALUES ({', '.join(f'${i}' for i in range(1, len(columns) + 1))}){suffix}",
+            [row[c] for c in columns]
+        )
+
+    def _write(self, table: str, row: Dict):
+        with self.transaction() as cur:
+            self._insert(cur, table, row)
+
+    def _ensure_user(self, cur, email: str):
+        self._insert(cur, 'users', placeholder_user(email), ' ON CONFLICT (email) DO NOTHING')
+        if cur.rowcount:
+            logger.info("Auto-created user", email=email)
+
+    # Users
+    def list_users(self) -> List[Dict]:
+        return self._query('SELECT * FROM users')
+
+    def get_user(self, email: str) -> Optional[Dict]:
+        rows = self._query('SELECT * FROM users WHERE email = $1', email)
+        return rows[0] if rows else None
+
+    def user_exists(self, email: str) -> bool:
+        return bool(self._query('SELECT email FROM users WHERE email = $1', email))
+
+    def count_users(self) -> int:
+        return self._query('SELECT count(*) AS users FROM users')[0]['users']
+
+    def insert_user(self, user_data: Dict) -> List[Dict]:
+        """Insert a user; returns the inserted rows"""
+        with self.transaction() as cur:
+            self._insert(cur, 'users', user_data, ' RETURNING *')
+            return self._rows(cur)
+
+    def upsert_user(self, user_data: Dict):
+        updates = ', '.join(f'{c} = EXCLUDED.{c}' for c in map(_quote_identifier, user_data) if c != '"email"')
+        with self.transaction() as cur:
+            self._insert(cur, 'users', user_data,
+                         f' ON CONFLICT (email) DO UPDATE SET {updates}' if updates else ' ON CONFLICT (email) DO NOTHING')
+
+    def update_user(self, email: str, fields: Dict):
+        if not fields:
+            return
+        columns = list(fields)
+        assignments = ', '.join(f'{_quote_identifier(c)} = ${i}' for i, c in enumerate(columns, 1))
+        with self.transaction() as cur:
+            fields = self._adapt_row(cur, 'users', fields)
+            self._execute(cur, f'UPDATE users SET {assignments} WHERE email = ${len(columns) + 1}',
+                          [fields[c] for c in columns] + [email])
+
+    def ensure_user(self, email: str):
+        """Create a placeholder patient for `email` unless it exists; failures are only logged"""
+        try:
+            with self.transaction() as cur:
+                self._ensure_user(cur, email)
+        except Exception as e:
+            logger.error("Failed to ensure user exists", error=str(e))
+
+    # Diagnosis history
+    def insert_diagnoses(self, records: List[Dict]):
+        """Insert many history rows with one multi-row INSERT.
+        
+        A column missing from a row gets its DEFAULT, not NULL.
+        """
+        from psycopg2.extensions import AsIs
+        from psycopg2.extras import execute_values
+
+        if not records:
+            return
+        columns = list(dict.fromkeys(c for record in records for c in record))
+        default = AsIs('DEFAULT')
+        with self.transaction() as cur:
+            records = [self._adapt_row(cur, 'diagnosis_history', record) for record in records]
+            execute_values(
+                cur,
+                f"INSERT INTO diagnosis_history ({', '.join(map(_quote_identifier, columns))}) VALUES %s",
+                [[self._adapt(record[c]) if c in record else default for c in columns] for record in records],
+                page_size=len(records)
+            )
+
+    def update_diagnosis_analysis(self, user_email: str, timestamp: str, ai_analysis: str):
+        with self.transaction() as cur:
+            self._execute(cur, 'UPDATE diagnosis_history SET ai_analysis = $1 WHERE user_email = $2 AND "timestamp" = $3',
+                          [ai_analysis, user_email, timestamp])
+
+    @staticmethod
+    def _select_list(columns: List[str] = None) -> str:
+        return ', '.join(map(_quote_identifier, columns)) if columns else '*'
+
+    def diagnosis_history(self, user_email: str, limit: int = None, before: list = None,
+                          columns: List[str] = None) -> List[Dict]:
+        """A user's diagnoses, newest first; `before` is the (timestamp, id) of the last row already seen"""
+        position = [p for p in history_position(before) if p is not None] if before else []
+        where = {0: '', 1: ' AND "timestamp" <= $3', 2: ' AND ("timestamp", id) < ($3, $4)'}[len(position)]
+        return self._query(
+            f'SELECT {self._select_list(columns)} FROM diagnosis_history WHERE user_email = $1{where} '
+            f'ORDER BY "timestamp" DESC, id DESC LIMIT $2',
+            user_email, limit, *position
+        )
+
+    # Medicine reminders and health records
+    def add_reminder(self, user_email: str, reminder: Dict):
+        """Insert a reminder, creating the user first if needed (one transaction)"""
+        with self.transaction() as cur:
+            self._ensure_user(cur, user_email)
+            self._insert(cur, 'medicine_reminders', {'user_email': user_email, **reminder})
+
+    def reminders(self, user_email: str, limit: int = None, after: int = None,
+                  columns: List[str] = None) -> List[Dict]:
+        """A user's reminders in the order they were added; `after` is the id of the last row already seen"""
+        where = ' AND id > $3' if after is not None else ''
+        return self._query(
+            f'SELECT {self._select_list(columns)} FROM medicine_reminders WHERE user_email = $1{where} '
+            f'ORDER BY id LIMIT $2',
+            user_email, limit, *([row_id_position(after)] if after is not None else [])
+        )
+
+    def add_health_record(self, user_email: str, record: Dict):
+        """Insert a health record, creating the user first if needed (one transaction)"""
+        with self.transaction() as cur:
+            self._ensure_user(cur, user_email)
+            self._insert(cur, 'health_records', {'user_email': user_email, **record})
+
+    def health_records(self, user_email: str, limit: int = None, before: list = None,
+                       columns: List[str] = None) -> List[Dict]:
+        """A user's health records: all of them oldest first, or with `limit` a page newest first.
+        
+        `before` is the (date, id) of the last row already seen.
+        """
+        select = f'SELECT {self._select_list(columns)} FROM health_records WHERE user_email = $1'
+        if not limit:
+            return self._query(f'{select} ORDER BY "date"', user_email)
+        where = ' AND ("date", id) < ($3, $4)' if before else ''
+        return self._query(f'{select}{where} ORDER BY "date" DESC, id DESC LIMIT $2',
+                           user_email, limit, *(health_record_position(before) if before else []))
+
+    def user_counts(self, user_email: str) -> Dict[str, int]:
+        """A user's row count in each of USER_TABLES, in one statement"""
+        counts = ', '.join(f'(SELECT count(*) FROM {t} WHERE user_email = $1) AS {t}' for t in USER_TABLES)
+        return self._query(f'SELECT {counts}', user_email)[0]
+
+    # Appointments and catalogs
+    def insert_appointment(self, appointment: Dict):
+        self._write('appointments', appointment)
+
+    def list_doctors(self) -> List[Dict]:
+        return self._query('SELECT * FROM doctors')
+
+    def insert_doctor(self, doctor_info: Dict):
+        self._write('doctors', doctor_info)
+
+    def list_diseases(self) -> List[Dict]:
+        return self._query('SELECT * FROM diseases')
+
+    def close(self):
+        """Close every pooled connection"""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+
+DATA_BACKENDS = {
+    'supabase': SupabaseStore,
+    'postgres': PostgresStore,
+}
+
+def create_store(name: str = None):
+    """Data store for the configured (or named) backend"""
+    name = name or DATA_BACKEND
+    if name not in DATA_BACKENDS:
+        raise ValueError(f"Unknown data backend {name!r}; choose from {', '.join(DATA_BACKENDS)}")
+    return DATA_BACKENDS[name]()
+
+class AsyncRepository:
+    """Async front for a blocking store, so one slow query never stalls the event loop.
+    
+    Calls run on a bounded thread pool and each is given `timeout` seconds,
+    queueing included. Store methods are exposed as coroutines
+    (`await repository.get_user(email)`); any other blocking callable can go
+    through `run`. Latency is recorded per call as db_<name> timing metrics.
+    """
+
+    def __init__(self, store, workers: int = 8, timeout: float = 10):
+        self.store = store
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="data-access")
+
+    @property
+    def available(self) -> bool:
+        return self.store.available
+
+    async def run(self, fn, *args, timeout: float = None):
+        """Run `fn(*args)` on the data-access pool; TimeoutError after `timeout` seconds"""
+        name = getattr(fn, '__name__', 'call')
+        timeout = self.timeout if timeout is None else timeout
+        started = time.perf_counter()
+        try:
+            return await asyncio.wait_for(
+                asyncio.get_running_loop().run_in_executor(self._pool, fn, *args), timeout
+            )
+        except asyncio.TimeoutError:
+            logger.incr("db_timeouts")
+            logger.warning("Database call timed out", call=name, timeout=timeout)
+            raise TimeoutError(f"Database call {name} timed out after {timeout}s") from None
+        except Exception:
+            logger.incr("db_errors")
+            raise
+        finally:
+            logger.timing(f"db_{name}", time.perf_counter() - started)
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+        if not callable(method):
+            return method
+
+        async def call(*args, timeout: float = None):
+            return await self.run(method, *args, timeout=timeout)
+        call.__name__ = name
+        return call
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+        self.store.close()
+
+class HistoryWriter:
+    """Write-behind buffer for diagnosis_history rows, inserted in batches.
+    
+    add() buffers a row and returns at once; a background task bulk-inserts
+    the buffer when `batch_size` rows are waiting or `flush_interval` seconds
+    after the first one arrived. At most `max_pending` rows are held: add()
+    then waits up to `backpressure_timeout` for room before spilling the row
+    to `spill_path` (JSON lines). Batches that fail to insert are spilled
+    too, and spilled rows are retried once an insert succeeds again. A
+    replay works on a per-process copy of the spill file, removed once its
+    rows are inserted and cut down to the rows still missing if the database
+    fails part-way; copies left by a process that died mid-replay are picked
+    up by the next replay.
+    close() writes out whatever is still buffered.
+    """
+
+    def __init__(self, repository, batch_size: int = 50, flush_interval: float = 2,
+                 max_pending: int = 1000, backpressure_timeout: float = 1, spill_path: str = None):
+        self.repository = repository
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_pending = max(1, max_pending)
+        self.backpressure_timeout = backpressure_timeout
+        self.spill_path = spill_path
+        # Rows not yet taken by a flush, and rows being inserted, keyed by (user_email, timestamp)
+        self._buffer = OrderedDict()
+        self._inflight = {}
+        self._task = None
+        self._loop = None
+
+    @staticmethod
+    def key(record: Dict):
+        return record['user_email'], record['timestamp']
+
+    def _ensure_task(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._wake = asyncio.Event()
+            self._room = asyncio.Condition()
+            self._flush_lock = asyncio.Lock()
+            self._task = None
+        if self._task is None or self._task.done():
+            if self._task is not None:
+                logger.warning("History flush task had stopped, restarting it")
+            self._task = loop.create_task(self._run())
+
+    async def add(self, record: Dict) -> bool:
+        """Buffer a row; False if it had to be spilled to disk instead"""
+        self._ensure_task()
+        if len(self._buffer) >= self.max_pending:
+            logger.incr("history_backpressure_waits")
+            self._wake.set()
+            try:
+                async with self._room:
+                    await asyncio.wait_for(
+                        self._room.wait_for(lambda: len(self._buffer) < self.max_pending),
+                        self.backpressure_timeout
+                    )
+            except asyncio.TimeoutError:
+                logger.warning("History buffer full, spilling row", max_pending=self.max_pending)
+                self.spill([record])
+                return False
+        self._buffer[self.key(record)] = record
+        if len(self._buffer) == 1 or len(self._buffer) >= self.batch_size:
+            self._wake.set()
+        return True
+
+    async def amend(self, user_email: str, timestamp: str, fields: Dict) -> bool:
+        """Update a row that is still buffered; False if the caller must update the database row too"""
+        key = (user_email, timestamp)
+        record = self._buffer.get(key)
+        if record is not None:
+            record.update(fields)
+            return True
+        record = self._inflight.get(key)
+        if record is not None:
+            # The insert may already have serialized the row, so the caller
+            # still updates it once the insert is done; if the insert fails
+            # instead, the row is spilled (and later replayed) with the fields.
+            record.update(fields)
+            async with self._flush_lock:
+                pass
+        return False
+
+    def pending(self, user_email: str) -> List[Dict]:
+        """A user's rows not yet in the database, newest first"""
+        rows = [r for r in (*self._inflight.values(), *self._buffer.values()) if r['user_email'] == user_email]
+        return sorted(rows, key=lambda r: r['timestamp'], reverse=True)
+
+    async def _run(self):
+        if self.spill_path:
+            await self._flush_safely()
+        while True:
+            if not self._buffer:
+                self._wake.clear()
+                await self._wake.wait()
+            if len(self._buffer) < self.batch_size:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            await self._flush_safely()
+
+    async def _flush_safely(self):
+        """flush() for the background task: an error is logged, never ends the task"""
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error("History flush failed", error=str(e), error_type=type(e).__name__)
+            logger.incr("history_flush_errors")
+            await asyncio.sleep(self.flush_interval)
+
+    async def flush(self):
+        """Insert every buffered row now; then retry spilled rows if the database took them"""
+        async with self._flush_lock:
+            attempted = written = False
+            while self._buffer:
+                attempted = True
+                keys = list(self._buffer)[:self.batch_size]
+                batch = {k: self._buffer.pop(k) for k in keys}
+                self._inflight.update(batch)
+                async with self._room:
+                    self._room.notify_all()
+                try:
+                    written = await self._insert(list(batch.values())) or written
+                finally:
+                    for k in keys:
+                        self._inflight.pop(k, None)
+            if written or not attempted:
+                await self._replay_spill()
+
+    async def _insert(self, rows: List[Dict], spill: bool = True) -> bool:
+        try:
+            await self.repository.insert_diagnoses(rows)
+            logger.incr("history_batches_written")
+            logger.incr("history_rows_written", len(rows))
+            return True
+        except Exception as e:
+            logger.error("History batch insert failed", error=str(e), rows=len(rows))
+            if spill:
+                self.spill(rows)
+            return False
+
+    def spill(self, rows: List[Dict]) -> bool:
+        """Append rows to the spill file so they survive a database outage or restart"""
+        logger.incr("history_rows_spilled", len(rows))
+        if not self.spill_path:
+            logger.error("History rows dropped, no spill file configured", rows=len(rows))
+            return False
+        try:
+            os.makedirs(os.path.dirname(self.spill_path) or '.', exist_ok=True)
+            with open(self.spill_path, 'a', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(json.dumps(row, default=str) + '\n')
+            return True
+        except OSError as e:
+            logger.error("Failed to spill history rows", error=str(e), rows=len(rows))
+            return False
+
+    def _orphaned_replays(self) -> List[str]:
+        """Replay files of processes that are no longer running"""
+        if sys.platform == 'win32':
+            # os.kill(pid, 0) would terminate the process on Windows
+            return []
+        directory = os.path.dirname(self.spill_path) or '.'
+        prefix = os.path.basename(self.spill_path) + '.'
+        orphans = []
+        for name in os.listdir(directory):
+            pid = name[len(prefix):-len('.replay')]
+            if not (name.startswith(prefix) and name.endswith('.replay') and pid.isdigit()):
+                continue
+            if int(pid) == os.getpid():
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                orphans.append(os.path.join(directory, name))
+            except OSError:
+                pass
+        return orphans
+
+    async def _replay_spill(self):
+        if not self.spill_path:
+            return
+        # The spill file is moved aside so other workers and _insert (which
+        # spills failures to a fresh file) never touch the rows being replayed
+        replaying = f'{self.spill_path}.{os.getpid()}.replay'
+        try:
+            sources = [replaying, *self._orphaned_replays(), self.spill_path]
+        except OSError:
+            sources = [replaying, self.spill_path]
+        for source in sources:
+            if source != replaying:
+                try:
+                    os.replace(source, replaying)
+                except FileNotFoundError:
+                    # Nothing spilled, or another worker took it first
+                    continue
+            elif not os.path.exists(replaying):
+                continue
+            if not await self._replay_file(replaying):
+                return
+
+    async def _replay_file(self, path: str) -> bool:
+        """Insert the rows of one replay file, then remove it; False if the database failed again"""
+        rows = []
+        with open(path, encoding='utf-8') as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError as e:
+                    logger.error("Skipping undecodable spilled history row", line=number, error=str(e))
+                    logger.incr("history_rows_undecodable")
+        for start in range(0, len(rows), self.batch_size):
+            if not await self._insert(rows[start:start + self.batch_size], spill=False):
+                self._keep_unreplayed(path, rows[start:])
+                return False
+        os.remove(path)
+        logger.info("Spilled history rows replayed", rows=len(rows))
+        return True
+
+    def _keep_unreplayed(self, path: str, rows: List[Dict]):
+        """Cut a replay file down to the rows not inserted yet, so the next replay does not repeat the others"""
+        temporary = f'{path}.tmp'
+        try:
+            with open(temporary, 'w', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(json.dumps(row, default=str) + '\n')
+            os.replace(temporary, path)
+            return
+        except OSError as e:
+            logger.error("Failed to rewrite history replay file, buffering its rows", error=str(e), rows=len(rows))
+        # The file still holds rows that are in the database now: drop it and
+        # keep the rest in memory, where the next flush (or close) picks them up
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.error("Failed to remove history replay file", error=str(e))
+            return
+        for row in rows:
+            self._buffer.setdefault(self.key(row), row)
+
+    async def close(self):
+        """Stop the flush task and write out (or spill) everything still buffered"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            await self.flush()
+
 class DoctorProfile:
-    def __init__(self):
+    def __init__(self, store=None):
         self.doctors = {}
+        self.store = store or create_store()
         self.load_doctors()
         logger.info("Doctor profile system initialized")
     
@@ -363,14 +1835,13 @@ class DoctorProfile:
         doctors must be managed from Supabase dashboard.
         """
         self.doctors = {}
-        if not SUPABASE_AVAILABLE:
+        if not self.store.available:
             print("❌ Supabase required for doctor listings. Doctors are managed via Supabase dashboard.")
             logger.info("Supabase unavailable - doctor listings disabled")
             return
 
         try:
-            response = supabase.table('doctors').select('*').execute()
-            for doc in (response.data or []):
+            for doc in self.store.list_doctors():
                 # Ensure we index by id
                 doc_id = doc.get('id') or doc.get('uid') or doc.get('uuid')
                 if not doc_id:
@@ -386,29 +1857,13 @@ class DoctorProfile:
         doctor_info['id'] = doctor_id
         
         try:
-            if SUPABASE_AVAILABLE:
-                # #region agent log
-                with open(LOG_FILE, 'a', encoding='utf-8') as f:
-                    import json
-                    import time
-                    f.write(json.dumps({"sessionId":"debug-session","runId":"add_doctor","hypothesisId":"I","location":"main.py:320","message":"Inserting doctor to Supabase","data":{"doctor_id":doctor_id},"timestamp":int(time.time()*1000)})+'\n')
-                # #endregion
-                supabase.table('doctors').insert(doctor_info).execute()
-                # #region agent log
-                with open(LOG_FILE, 'a', encoding='utf-8') as f:
-                    f.write(json.dumps({"sessionId":"debug-session","runId":"add_doctor","hypothesisId":"I","location":"main.py:323","message":"Doctor inserted to Supabase successfully","data":{"doctor_id":doctor_id},"timestamp":int(time.time()*1000)})+'\n')
-                # #endregion
+            if self.store.available:
+                self.store.insert_doctor(doctor_info)
             
             self.doctors[doctor_id] = doctor_info
             logger.info("New doctor added", doctor_id=doctor_id)
             return doctor_id
         except Exception as e:
-            # #region agent log
-            with open(LOG_FILE, 'a', encoding='utf-8') as f:
-                import json
-                import time
-                f.write(json.dumps({"sessionId":"debug-session","runId":"add_doctor","hypothesisId":"I","location":"main.py:331","message":"Failed to save doctor to Supabase","data":{"error":str(e),"error_type":type(e).__name__,"doctor_id":doctor_id},"timestamp":int(time.time()*1000)})+'\n')
-            # #endregion
             logger.error("Failed to save doctor info", error=str(e))
             # Still save locally
             self.doctors[doctor_id] = doctor_info
@@ -449,17 +1904,23 @@ class DoctorProfile:
 
 # Appointment Management
 class AppointmentSystem:
-    def __init__(self):
+    def __init__(self, store=None):
         self.appointments = []
+        self.store = store or create_store()
         self.appointment_counter = 1
+        # Bookings run on the repository's thread pool; ids must stay unique
+        self._counter_lock = threading.Lock()
         logger.info("Appointment system initialized")
     
     def book_appointment(self, patient_info: Dict, doctor_id: str, 
                         appointment_date: str, appointment_time: str, 
                         is_emergency: bool = False) -> Dict:
         """Book an appointment"""
+        with self._counter_lock:
+            number = self.appointment_counter
+            self.appointment_counter += 1
         appointment = {
-            'appointment_id': f"APT{str(self.appointment_counter).zfill(4)}",
+            'appointment_id': f"APT{str(number).zfill(4)}",
             'patient_name': patient_info['name'],
             'patient_phone': patient_info['phone'],
             'patient_age': patient_info.get('age', 'N/A'),
@@ -473,13 +1934,12 @@ class AppointmentSystem:
         }
         
         self.appointments.append(appointment)
-        self.appointment_counter += 1
         logger.incr("appointments_booked")
         logger.info("Appointment booked", appointment_id=appointment['appointment_id'])
         # Persist appointment to Supabase if available
-        if SUPABASE_AVAILABLE and supabase:
+        if self.store.available:
             try:
-                supabase.table('appointments').insert(appointment).execute()
+                self.store.insert_appointment(appointment)
             except Exception as e:
                 logger.error("Failed to persist appointment to Supabase", error=str(e))
         
@@ -510,58 +1970,27 @@ class AppointmentSystem:
 
 
 class MedicineReminder:
-    def __init__(self):
-        if not SUPABASE_AVAILABLE or not supabase:
+    def __init__(self, store=None):
+        self.store = store or create_store()
+        if not self.store.available:
             logger.error("Supabase is required for medicine reminders")
             raise Exception("Database connection required for medicine reminders")
-        self.supabase = supabase
 
     def add_reminder(self, user_email: str, reminder: Dict):
-        """Add medicine reminder to Supabase database"""
+        """Add medicine reminder to Supabase database (the user is auto-created if needed)"""
         try:
-            # First, ensure the user exists (auto-create if needed)
-            self._ensure_user_exists(user_email)
-            
-            # Now insert the reminder
-            self.supabase.table('medicine_reminders').insert({
-                'user_email': user_email,
-                **reminder
-            }).execute()
+            self.store.add_reminder(user_email, reminder)
             logger.info("Reminder added", user_email=user_email, medicine=reminder.get('medicine_name'))
             return True
         except Exception as e:
             logger.error("Failed to add reminder", error=str(e))
             raise
     
-    def _ensure_user_exists(self, user_email: str):
-        """Ensure user exists in database, create if not"""
+    def get_reminders(self, user_email: str, limit: int = None, after: int = None,
+                      fields: List[str] = None) -> List[Dict]:
+        """Get medicine reminders from Supabase database (all, or one page with `limit`)"""
         try:
-            # Check if user exists
-            response = self.supabase.table('users').select('email').eq('email', user_email).execute()
-            
-            if not response.data or len(response.data) == 0:
-                # User doesn't exist, create them
-                import datetime
-                username = user_email.split('@')[0]
-                user_data = {
-                    'email': user_email,
-                    'name': f'User {username.capitalize()}',
-                    'phone': f'98765{hash(user_email) % 100000:05d}',
-                    'user_type': 'patient',
-                    'registered_on': datetime.datetime.now().isoformat(),
-                    'login_count': 0
-                }
-                self.supabase.table('users').insert(user_data).execute()
-                logger.info("Auto-created user", email=user_email)
-        except Exception as e:
-            logger.error("Failed to ensure user exists", error=str(e))
-            # Don't raise - let the original insert attempt proceed
-
-    def get_reminders(self, user_email: str) -> List[Dict]:
-        """Get medicine reminders from Supabase database"""
-        try:
-            resp = self.supabase.table('medicine_reminders').select('*').eq('user_email', user_email).execute()
-            return resp.data or []
+            return self.store.reminders(user_email, limit, after, fields)
         except Exception as e:
             logger.error("Failed to get reminders", error=str(e))
             raise
@@ -600,58 +2029,27 @@ class MedicineReminder:
 
 
 class HealthMonitor:
-    def __init__(self):
-        if not SUPABASE_AVAILABLE or not supabase:
+    def __init__(self, store=None):
+        self.store = store or create_store()
+        if not self.store.available:
             logger.error("Supabase is required for health monitoring")
             raise Exception("Database connection required for health monitoring")
-        self.supabase = supabase
 
     def add_record(self, user_email: str, record: Dict):
-        """Add health record to Supabase database"""
+        """Add health record to Supabase database (the user is auto-created if needed)"""
         try:
-            # First, ensure the user exists (auto-create if needed)
-            self._ensure_user_exists(user_email)
-            
-            # Now insert the health record
-            self.supabase.table('health_records').insert({
-                'user_email': user_email,
-                **record
-            }).execute()
+            self.store.add_health_record(user_email, record)
             logger.info("Health record added", user_email=user_email, date=record.get('date'))
             return True
         except Exception as e:
             logger.error("Failed to add health record", error=str(e))
             raise
     
-    def _ensure_user_exists(self, user_email: str):
-        """Ensure user exists in database, create if not"""
+    def get_history(self, user_email: str, limit: int = None, before: list = None,
+                    fields: List[str] = None) -> List[Dict]:
+        """Get health records from Supabase database (all oldest first, or one page newest first)"""
         try:
-            # Check if user exists
-            response = self.supabase.table('users').select('email').eq('email', user_email).execute()
-            
-            if not response.data or len(response.data) == 0:
-                # User doesn't exist, create them
-                import datetime
-                username = user_email.split('@')[0]
-                user_data = {
-                    'email': user_email,
-                    'name': f'User {username.capitalize()}',
-                    'phone': f'98765{hash(user_email) % 100000:05d}',
-                    'user_type': 'patient',
-                    'registered_on': datetime.datetime.now().isoformat(),
-                    'login_count': 0
-                }
-                self.supabase.table('users').insert(user_data).execute()
-                logger.info("Auto-created user", email=user_email)
-        except Exception as e:
-            logger.error("Failed to ensure user exists", error=str(e))
-            # Don't raise - let the original insert attempt proceed
-
-    def get_history(self, user_email: str) -> List[Dict]:
-        """Get health records from Supabase database"""
-        try:
-            resp = self.supabase.table('health_records').select('*').eq('user_email', user_email).order('date').execute()
-            return resp.data or []
+            return self.store.health_records(user_email, limit, before, fields)
         except Exception as e:
             logger.error("Failed to get health records", error=str(e))
             raise
@@ -755,69 +2153,614 @@ class HospitalLocator:
             print(f"❌ Could not open browser. Please visit: {maps_url}")
             return maps_url
     
-    def get_emergency_contacts(self):
-        """Display emergency contact numbers"""
-        print(f"\n{'='*60}")
-        print("🚨 EMERGENCY CONTACTS")
-        print(f"{'='*60}")
-        print("Emergency (General): 112")
-        print("Ambulance: 108 / 102")
-        print("Police: 100")
-        print("Fire: 101")
-        print("Women Helpline: 1091")
-        print("Child Helpline: 1098")
-        print("National Emergency Number: 112")
-        print(f"{'='*60}\n")
+    def get_emergency_contacts(self):
+        """Display emergency contact numbers"""
+        print(f"\n{'='*60}")
+        print("🚨 EMERGENCY CONTACTS")
+        print(f"{'='*60}")
+        print("Emergency (General): 112")
+        print("Ambulance: 108 / 102")
+        print("Police: 100")
+        print("Fire: 101")
+        print("Women Helpline: 1091")
+        print("Child Helpline: 1098")
+        print("National Emergency Number: 112")
+        print(f"{'='*60}\n")
+
+# Symptom Matching
+SYMPTOM_MODIFIERS = ['severe', 'mild', 'high', 'low', 'acute', 'chronic', 'dry', 'wet', 'with', 'without']
+
+def normalize_symptom(symptom: str) -> str:
+    """Lowercase and trim a symptom for comparison"""
+    return symptom.lower().strip()
+
+def strip_symptom_modifiers(symptom: str) -> str:
+    """Remove common modifiers (severe, mild, ...) from a normalized symptom"""
+    for mod in SYMPTOM_MODIFIERS:
+        symptom = symptom.replace(mod, '').strip()
+    return symptom
+
+def symptom_ngrams(text: str, n: int = 3) -> set:
+    """Distinct character n-grams of a string"""
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+def padded_trigrams(text: str) -> set:
+    """Trigrams of a string padded so word starts and ends weigh in (pg_trgm style)"""
+    return symptom_ngrams(f"  {text} ")
+
+class SymptomIndex:
+    """Inverted index over the symptom vocabulary.
+
+    Holds the normalized and modifier-stripped form of every symptom and a
+    trigram -> symptom postings list for each form. A user symptom matches a
+    database symptom when either form of one contains the same form of the
+    other (the rules of ``MedicalDiagnosisSystem.match_symptom``). Containment
+    implies every trigram of the shorter string occurs in the longer one, so
+    counting posting hits yields the candidates without scanning the catalog.
+
+    User symptoms with no such match (typically misspellings) fall back to
+    the closest symptom by padded-trigram Jaccard similarity, if it reaches
+    `fuzzy_threshold`.
+    """
+
+    def __init__(self, symptoms: List[str], fuzzy_threshold: float = SYMPTOM_FUZZY_THRESHOLD):
+        self.symptoms = list(symptoms)
+        self.fuzzy_threshold = fuzzy_threshold
+        normalized = [normalize_symptom(s) for s in self.symptoms]
+        cleaned = [strip_symptom_modifiers(s) for s in normalized]
+        self.forms = [self._build_postings(normalized), self._build_postings(cleaned)]
+        
+        self.fuzzy_postings: Dict[str, List[int]] = {}
+        self.fuzzy_gram_counts = []
+        for idx, form in enumerate(normalized):
+            grams = padded_trigrams(form)
+            self.fuzzy_gram_counts.append(len(grams))
+            for gram in grams:
+                self.fuzzy_postings.setdefault(gram, []).append(idx)
+
+    @staticmethod
+    def _build_postings(forms: List[str]) -> Dict[str, Any]:
+        postings: Dict[str, List[int]] = {}
+        gram_counts = []
+        short = []
+        for idx, form in enumerate(forms):
+            grams = symptom_ngrams(form)
+            gram_counts.append(len(grams))
+            if not grams:
+                short.append(idx)
+            for gram in grams:
+                postings.setdefault(gram, []).append(idx)
+        return {'forms': forms, 'postings': postings, 'gram_counts': gram_counts, 'short': short}
+
+    @staticmethod
+    def _related(query: str, index: Dict[str, Any]) -> set:
+        """Ids of forms that contain, or are contained in, the query"""
+        forms = index['forms']
+        grams = symptom_ngrams(query)
+        if not grams:
+            # Too short for trigrams: only a direct scan is exact
+            return {i for i, form in enumerate(forms) if query in form or form in query}
+
+        hits: Dict[int, int] = {}
+        for gram in grams:
+            for idx in index['postings'].get(gram, ()):
+                hits[idx] = hits.get(idx, 0) + 1
+
+        related = set()
+        gram_counts = index['gram_counts']
+        for idx, count in hits.items():
+            form = forms[idx]
+            if count == len(grams) and query in form:
+                related.add(idx)
+            elif count == gram_counts[idx] and form in query:
+                related.add(idx)
+        for idx in index['short']:
+            if forms[idx] in query:
+                related.add(idx)
+        return related
+
+    def fuzzy_match(self, query: str):
+        """Closest vocabulary position to a (misspelled) query: (position, similarity) or None"""
+        grams = padded_trigrams(query)
+        if not grams or self.fuzzy_threshold <= 0:
+            return None
+        
+        hits: Dict[int, int] = {}
+        for gram in grams:
+            for idx in self.fuzzy_postings.get(gram, ()):
+                hits[idx] = hits.get(idx, 0) + 1
+        
+        best = None
+        for idx, shared in hits.items():
+            similarity = shared / (len(grams) + self.fuzzy_gram_counts[idx] - shared)
+            if similarity >= self.fuzzy_threshold and (best is None or (similarity, -idx) > (best[1], -best[0])):
+                best = (idx, similarity)
+        return best
+
+    def match_with_corrections(self, user_symptoms: List[str]):
+        """Like match(), also returning {user symptom: corrected symptom} for fuzzy matches"""
+        matched = set()
+        corrections = {}
+        for user_symptom in user_symptoms:
+            normalized = normalize_symptom(user_symptom)
+            cleaned = strip_symptom_modifiers(normalized)
+            related = self._related(normalized, self.forms[0]) | self._related(cleaned, self.forms[1])
+            if not related:
+                candidates = [c for c in (self.fuzzy_match(normalized), self.fuzzy_match(cleaned)) if c]
+                if candidates:
+                    idx = max(candidates, key=lambda c: c[1])[0]
+                    related = {idx}
+                    corrections[user_symptom] = self.symptoms[idx]
+            matched |= related
+        return sorted(matched), corrections
+
+    def match(self, user_symptoms: List[str]) -> List[int]:
+        """Return the sorted vocabulary positions matched by any user symptom"""
+        return self.match_with_corrections(user_symptoms)[0]
+
+class SymptomSuggester:
+    """Prefix autocomplete over the symptom vocabulary.
+
+    Every word-start suffix of each normalized symptom ("severe headache"
+    and "headache") is kept in one sorted array, so the symptoms having a
+    word that starts with the query are a contiguous range found by bisect.
+    Results are ranked by how many diseases list the symptom.
+    """
+
+    def __init__(self, symptoms: List[str], disease_counts: List[int]):
+        self.symptoms = list(symptoms)
+        self.disease_counts = [int(count) for count in disease_counts]
+        entries = []
+        for idx, symptom in enumerate(self.symptoms):
+            words = normalize_symptom(symptom).split()
+            for start in range(len(words)):
+                entries.append((' '.join(words[start:]), idx))
+        entries.sort()
+        self.keys = [key for key, _ in entries]
+        self.ids = [idx for _, idx in entries]
+        # Whole vocabulary by rank, for empty queries
+        self.ranked = sorted(range(len(self.symptoms)), key=self._rank)
+
+    def _rank(self, idx: int):
+        return (-self.disease_counts[idx], self.symptoms[idx])
+
+    def suggest(self, query: str, limit: int = 10) -> List[Dict]:
+        """Top `limit` symptoms with a word starting with `query`"""
+        query = ' '.join(normalize_symptom(query).split())
+        if not query:
+            matches = self.ranked[:limit]
+        else:
+            start = bisect.bisect_left(self.keys, query)
+            end = bisect.bisect_left(self.keys, query + '\uffff', start)
+            matches = sorted(set(self.ids[start:end]), key=self._rank)[:limit]
+        return [{'symptom': self.symptoms[idx], 'disease_count': self.disease_counts[idx]} for idx in matches]
+
+# Classifier backends
+# A backend is fitted on a catalog's training matrix (one 0/1 row per
+# disease) and scores query rows built the same way. CLASSIFIER_BACKEND
+# selects one from CLASSIFIER_BACKENDS; benchmark_classifiers.py compares them.
+
+class ClassifierBackend:
+    """Interface of the disease classifiers used by predict_disease"""
+
+    name = None
+
+    def __init__(self, n_neighbors: int = 3):
+        self.n_neighbors = n_neighbors
+
+    def fit(self, X_train, y_train):
+        """Learn the catalog (CSR matrix and disease labels); returns self"""
+        raise NotImplementedError
+
+    def predict(self, symptom_matrix) -> List[Dict]:
+        """Score each query row: primary_prediction, confidence, all_predictions (top 3), distance"""
+        raise NotImplementedError
+
+class NeighborsBackend(ClassifierBackend):
+    """Backends that find the closest diseases and take a majority vote.
+    
+    The predicted disease is the majority label among the neighbours with
+    ties going to the first label in class order, which is how
+    KNeighborsClassifier.predict resolves uniform-weight votes.
+    """
+
+    def fit(self, X_train, y_train):
+        self.y_train = y_train
+        self.k = min(self.n_neighbors, len(y_train))
+        self._fit(X_train)
+        return self
+
+    def _fit(self, X_train):
+        raise NotImplementedError
+
+    def kneighbors(self, symptom_matrix):
+        """(distances, indices) of the k closest diseases per row, nearest first"""
+        raise NotImplementedError
+
+    def confidence(self, distance: float) -> float:
+        return 1 / (1 + distance) if distance > 0 else 1.0
+
+    def _nearest(self, distances: np.ndarray):
+        """kneighbors() result from a full (queries x diseases) distance array.
+        
+        Selects with argpartition and orders with argsort, the same steps
+        scikit-learn's brute-force search takes, so equal distances resolve
+        the same way as in knn-brute.
+        """
+        rows = np.arange(distances.shape[0])[:, None]
+        indices = np.argpartition(distances, self.k - 1, axis=1)[:, :self.k]
+        indices = indices[rows, np.argsort(distances[rows, indices])]
+        return distances[rows, indices], indices
+
+    def predict(self, symptom_matrix) -> List[Dict]:
+        distances, indices = self.kneighbors(symptom_matrix)
+        
+        scored = []
+        for row_distances, row_indices in zip(distances, indices):
+            neighbours = [self.y_train[idx] for idx in row_indices]
+            votes = Counter(neighbours)
+            top_votes = max(votes.values())
+            prediction = min(disease for disease, count in votes.items() if count == top_votes)
+            
+            predictions_proba = []
+            for disease, distance in zip(neighbours, row_distances):
+                if disease not in [p['disease'] for p in predictions_proba]:
+                    predictions_proba.append({
+                        'disease': disease,
+                        'confidence': round(self.confidence(distance), 2)
+                    })
+            
+            scored.append({
+                'primary_prediction': prediction,
+                'confidence': round(self.confidence(row_distances[0]), 2),
+                'all_predictions': predictions_proba[:3],
+                'distance': row_distances[0] if len(row_distances) > 0 else 0
+            })
+        return scored
+
+class BruteKNNBackend(NeighborsBackend):
+    """Euclidean KNN by exhaustive search on the sparse matrix (the original model)"""
+
+    name = 'knn-brute'
+    algorithm = 'brute'
+
+    def _fit(self, X_train):
+        from sklearn.neighbors import NearestNeighbors
+        
+        self.model = NearestNeighbors(n_neighbors=self.k, algorithm=self.algorithm)
+        self.model.fit(self._prepare(X_train))
+
+    def _prepare(self, matrix):
+        return matrix
+
+    def kneighbors(self, symptom_matrix):
+        return self.model.kneighbors(self._prepare(symptom_matrix))
+
+class BallTreeKNNBackend(BruteKNNBackend):
+    """Euclidean KNN over a BallTree (dense vectors)"""
+
+    name = 'knn-ball-tree'
+    algorithm = 'ball_tree'
+
+    def _prepare(self, matrix):
+        return matrix.toarray() if hasattr(matrix, 'toarray') else matrix
+
+class KDTreeKNNBackend(BallTreeKNNBackend):
+    """Euclidean KNN over a KDTree (dense vectors)"""
+
+    name = 'knn-kd-tree'
+    algorithm = 'kd_tree'
+
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def popcount(words: np.ndarray) -> np.ndarray:
+    """Number of set bits in each element of a uint64 array"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    # numpy < 2.0: look up each byte
+    return _BYTE_POPCOUNT[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1)
+
+class PackedSymptomMatrix:
+    """Binary symptom matrix packed 64 symptoms to a uint64 word.
+    
+    Words are stored word-major (all diseases of a word are contiguous), so
+    intersecting a query with the whole catalog touches only the few words
+    in which the query has symptoms: one vectorized AND + popcount per word.
+    """
+
+    def __init__(self, X_train):
+        X_train = X_train.tocsr()
+        disease_count, symptom_count = X_train.shape
+        self.shape = X_train.shape
+        self.row_sizes = np.diff(X_train.indptr).astype(np.int32)
+        self.words = np.zeros(((symptom_count + 63) // 64, disease_count), dtype=np.uint64)
+        rows = np.repeat(np.arange(disease_count), self.row_sizes)
+        word_ids, bits = self.split_columns(X_train.indices)
+        np.bitwise_or.at(self.words, (word_ids, rows), bits)
+
+    @staticmethod
+    def split_columns(columns):
+        """(word index, bit mask) of each symptom column"""
+        columns = np.asarray(columns, dtype=np.int64)
+        return columns >> 6, np.left_shift(np.uint64(1), (columns & 63).astype(np.uint64))
+
+    @property
+    def nbytes(self) -> int:
+        return self.words.nbytes + self.row_sizes.nbytes
+
+    def intersections(self, symptom_matrix) -> np.ndarray:
+        """Shared symptom counts, (queries x diseases)"""
+        symptom_matrix = symptom_matrix.tocsr()
+        shared = np.zeros((symptom_matrix.shape[0], self.shape[0]), dtype=np.int32)
+        for row in range(symptom_matrix.shape[0]):
+            columns = symptom_matrix.indices[symptom_matrix.indptr[row]:symptom_matrix.indptr[row + 1]]
+            word_ids, bits = self.split_columns(columns)
+            query_word_ids, positions = np.unique(word_ids, return_inverse=True)
+            query_words = np.zeros(len(query_word_ids), dtype=np.uint64)
+            np.bitwise_or.at(query_words, positions, bits)
+            for word_id, query_word in zip(query_word_ids, query_words):
+                shared[row] += popcount(self.words[word_id] & query_word)
+        return shared
+
+class HammingBackend(NeighborsBackend):
+    """KNN by Hamming distance on bit-packed vectors.
+    
+    For 0/1 vectors the Euclidean distance is sqrt(Hamming), so neighbours
+    and confidences match knn-brute while the catalog takes one bit per
+    (disease, symptom) and no floating-point distance computation.
+    """
+
+    name = 'hamming-packed'
+
+    def _fit(self, X_train):
+        self.packed = PackedSymptomMatrix(X_train)
+
+    def kneighbors(self, symptom_matrix):
+        symptom_matrix = symptom_matrix.tocsr()
+        shared = self.packed.intersections(symptom_matrix)
+        hamming = np.diff(symptom_matrix.indptr)[:, None] + self.packed.row_sizes[None, :] - 2 * shared
+        return self._nearest(np.sqrt(hamming))
+
+class JaccardBackend(HammingBackend):
+    """Nearest diseases by Jaccard distance between symptom sets.
+    
+    Overlaps come from the same bit-packed store as hamming-packed;
+    confidence is the Jaccard similarity.
+    """
+
+    name = 'jaccard'
+
+    def kneighbors(self, symptom_matrix):
+        symptom_matrix = symptom_matrix.tocsr()
+        shared = self.packed.intersections(symptom_matrix)
+        union = np.diff(symptom_matrix.indptr)[:, None] + self.packed.row_sizes[None, :] - shared
+        return self._nearest(1 - shared / np.maximum(union, 1))
+
+    def confidence(self, distance: float) -> float:
+        return 1 - distance
+
+class BernoulliNBBackend(ClassifierBackend):
+    """Bernoulli naive Bayes; confidence is the posterior probability"""
+
+    name = 'bernoulli-nb'
+
+    def fit(self, X_train, y_train):
+        from sklearn.naive_bayes import BernoulliNB
+        
+        self.model = BernoulliNB()
+        self.model.fit(X_train, y_train)
+        return self
+
+    def predict(self, symptom_matrix) -> List[Dict]:
+        classes = self.model.classes_
+        scored = []
+        for row in self.model.predict_proba(symptom_matrix):
+            top = np.argsort(-row, kind='stable')[:3]
+            scored.append({
+                'primary_prediction': classes[top[0]],
+                'confidence': round(float(row[top[0]]), 2),
+                'all_predictions': [
+                    {'disease': classes[idx], 'confidence': round(float(row[idx]), 2)} for idx in top
+                ],
+                'distance': 1 - float(row[top[0]])
+            })
+        return scored
+
+CLASSIFIER_BACKENDS = {
+    backend.name: backend
+    for backend in (BruteKNNBackend, BallTreeKNNBackend, KDTreeKNNBackend, HammingBackend, JaccardBackend,
+                    BernoulliNBBackend)
+}
+
+def create_classifier(name: str = None, n_neighbors: int = 3) -> ClassifierBackend:
+    """Instantiate a registered backend (CLASSIFIER_BACKEND by default)"""
+    name = name or CLASSIFIER_BACKEND
+    if name not in CLASSIFIER_BACKENDS:
+        raise ValueError(f"Unknown classifier backend {name!r}; expected one of {', '.join(CLASSIFIER_BACKENDS)}")
+    return CLASSIFIER_BACKENDS[name](n_neighbors=n_neighbors)
+
+class CatalogSnapshot:
+    """One immutable version of the disease catalog and its trained model.
+
+    A snapshot is never modified after it is built; a catalog update builds a
+    new snapshot and MedicalDatabase swaps it in, so a diagnosis that holds a
+    snapshot keeps a consistent vocabulary, matrix and classifier.
+    """
+
+    def __init__(self, version: int, fingerprint: str, disease_data: Dict, all_symptoms: List[str],
+                 symptom_columns: Dict[str, int], X_train, y_train, classifier: ClassifierBackend,
+                 symptom_index: SymptomIndex,
+                 symptom_suggester: SymptomSuggester):
+        self.version = version
+        self.fingerprint = fingerprint
+        self.disease_data = disease_data
+        self.all_symptoms = all_symptoms
+        self.symptom_columns = symptom_columns
+        self.X_train = X_train
+        self.y_train = y_train
+        self.classifier = classifier
+        self.symptom_index = symptom_index
+        self.symptom_suggester = symptom_suggester
+        # Catalog row id -> disease name, for rows that reference a disease by id
+        self.disease_ids = {str(info['id']): name for name, info in disease_data.items() if info.get('id') is not None}
+        self.created_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+    def symptom_matrix(self, column_sets: List[List[int]]):
+        """Build a sparse query matrix with one row per list of symptom columns"""
+        from scipy import sparse
+        
+        columns = []
+        row_starts = [0]
+        for row_columns in column_sets:
+            columns.extend(row_columns)
+            row_starts.append(len(columns))
+        return sparse.csr_matrix(
+            (np.ones(len(columns)), np.array(columns, dtype=np.int32), np.array(row_starts, dtype=np.int32)),
+            shape=(len(column_sets), len(self.all_symptoms))
+        )
+
+    def get_disease_info(self, disease_name: str) -> Dict:
+        """Get detailed information about a disease"""
+        return self.disease_data.get(disease_name, {})
+
+    def is_emergency(self, disease_name: str) -> bool:
+        """Check if disease requires emergency care"""
+        disease_info = self.disease_data.get(disease_name, {})
+        return disease_info.get('emergency', False)
+
+def build_training_matrix(disease_data: Dict):
+    """Vocabulary, training matrix and labels for a catalog: (all_symptoms, X_train, labels).
+    
+    Each disease is a sparse CSR row whose columns are its symptoms,
+    built from a symptom -> column dictionary, so construction is linear
+    in the number of (disease, symptom) pairs and memory is proportional
+    to that count rather than to diseases x symptoms.
+    """
+    from scipy import sparse
+    
+    all_symptoms = set()
+    for disease_info in disease_data.values():
+        all_symptoms.update(disease_info['symptoms'])
+    
+    all_symptoms = sorted(list(all_symptoms))
+    symptom_columns = {symptom: column for column, symptom in enumerate(all_symptoms)}
+    
+    columns = []
+    row_starts = [0]
+    y = []
+    
+    for disease, info in disease_data.items():
+        columns.extend(sorted({symptom_columns[symptom] for symptom in info['symptoms']}))
+        row_starts.append(len(columns))
+        y.append(disease)
+    
+    X_train = sparse.csr_matrix(
+        (np.ones(len(columns)), np.array(columns, dtype=np.int32), np.array(row_starts, dtype=np.int32)),
+        shape=(len(y), len(all_symptoms))
+    )
+    return all_symptoms, X_train, y
+
+def catalog_fingerprint(disease_data: Dict) -> str:
+    """Content hash of a disease catalog, used to detect changes"""
+    payload = json.dumps(disease_data, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+_fitted_cache_name = None
+
+def fitted_cache_name() -> str:
+    """File name of a cached catalog's pickled classifier, symptom index and suggester.
+    
+    It names the classifier backend and a hash of this module's source, so a
+    worker never unpickles objects fitted by another backend or other code.
+    """
+    global _fitted_cache_name
+    if _fitted_cache_name is None:
+        with open(__file__, 'rb') as f:
+            source = hashlib.sha256(f.read()).hexdigest()[:12]
+        _fitted_cache_name = f'fitted-{CLASSIFIER_BACKEND}-{source}.pkl'
+    return _fitted_cache_name
 
 class MedicalDatabase:
-    def __init__(self):
-        self.disease_data = {}
-        self.load_disease_data()
+    def __init__(self, store=None):
+        self.snapshot: CatalogSnapshot = None
+        self.store = store or create_store()
+        self._reload_lock = threading.Lock()
+        self._refresher = None
+        self._refresher_stop = threading.Event()
+        self._snapshot_listeners = []
+        
+        cached = self.load_cached_snapshot()
+        if cached:
+            self.install_snapshot(cached)
+            logger.info("Medical database initialized from cache", disease_count=len(self.disease_data))
+            # Revalidate against Supabase without holding up startup
+            threading.Thread(target=self._revalidate, name="catalog-revalidate", daemon=True).start()
+            return
         
-        if self.disease_data:
-            self.create_training_data()
+        disease_data = self.load_disease_data()
+        
+        if disease_data:
+            self.install_snapshot(self.create_training_data(disease_data))
+            self.save_cached_snapshot(self.snapshot)
             logger.info("Medical database initialized", disease_count=len(self.disease_data))
         else:
             logger.error("Medical database empty - using fallback data")
-            self.load_fallback_data()
-            self.create_training_data()
+            self.install_snapshot(self.create_training_data(self.load_fallback_data()))
+
+    # The attributes below always describe the current snapshot. Code that
+    # needs several of them consistently should hold on to self.snapshot.
+    @property
+    def version(self) -> int:
+        return self.snapshot.version
+
+    @property
+    def disease_data(self) -> Dict:
+        return self.snapshot.disease_data
+
+    @property
+    def all_symptoms(self) -> List[str]:
+        return self.snapshot.all_symptoms
+
+    @property
+    def symptom_columns(self) -> Dict[str, int]:
+        return self.snapshot.symptom_columns
+
+    @property
+    def X_train(self):
+        return self.snapshot.X_train
+
+    @property
+    def y_train(self):
+        return self.snapshot.y_train
+
+    @property
+    def classifier(self) -> ClassifierBackend:
+        return self.snapshot.classifier
+
+    @property
+    def symptom_index(self) -> SymptomIndex:
+        return self.snapshot.symptom_index
 
     def load_disease_data(self):
         """Fetch disease data from Supabase"""
-        # #region agent log
-        with open(LOG_FILE, 'a', encoding='utf-8') as f:
-            import json
-            import time
-            f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"H","location":"main.py:492","message":"load_disease_data called","data":{"supabase_available":SUPABASE_AVAILABLE},"timestamp":int(time.time()*1000)})+'\n')
-        # #endregion
-        if not SUPABASE_AVAILABLE:
-            return
+        disease_data = {}
+        if not self.store.available:
+            return disease_data
         
         try:
-            # #region agent log
-            with open(LOG_FILE, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"H","location":"main.py:498","message":"Querying Supabase diseases table","data":{},"timestamp":int(time.time()*1000)})+'\n')
-            # #endregion
-            response = supabase.table('diseases').select("*").execute()
-            # #region agent log
-            with open(LOG_FILE, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"H","location":"main.py:501","message":"Supabase diseases query successful","data":{"disease_count":len(response.data) if response.data else 0},"timestamp":int(time.time()*1000)})+'\n')
-            # #endregion
-            for item in response.data:
+            rows = self.store.list_diseases()
+            for item in rows:
                 name = item.get('name')
                 if name:
-                    self.disease_data[name] = item
-            logger.info("Diseases loaded from Supabase", count=len(self.disease_data))
+                    disease_data[name] = item
+            logger.info("Diseases loaded from Supabase", count=len(disease_data))
         except Exception as e:
-            # #region agent log
-            with open(LOG_FILE, 'a', encoding='utf-8') as f:
-                f.write(json.dumps({"sessionId":"debug-session","runId":"init","hypothesisId":"H","location":"main.py:509","message":"Failed to load diseases from Supabase","data":{"error":str(e),"error_type":type(e).__name__},"timestamp":int(time.time()*1000)})+'\n')
-            # #endregion
             logger.error("Failed to load diseases from Supabase", error=str(e))
+        return disease_data
     
-    def load_fallback_data(self):
+    def load_fallback_data(self) -> Dict:
         """Load fallback disease data when database is unavailable"""
-        self.disease_data = {
+        disease_data = {
             'Common Cold': {
                 'symptoms': ['runny nose', 'sneezing', 'sore throat', 'cough', 'mild fever'],
                 'description': 'A viral infection of the upper respiratory tract',
@@ -875,55 +2818,393 @@ class MedicalDatabase:
                 'emergency': True
             }
         }
-        logger.info("Loaded fallback disease data", count=len(self.disease_data))
+        logger.info("Loaded fallback disease data", count=len(disease_data))
+        return disease_data
        
-    def create_training_data(self):
-        """Create training dataset for KNN classifier"""
-        all_symptoms = set()
-        for disease_info in self.disease_data.values():
-            all_symptoms.update(disease_info['symptoms'])
+    def create_training_data(self, disease_data: Dict) -> CatalogSnapshot:
+        """Create the classifier's training dataset as a new catalog snapshot"""
+        all_symptoms, X_train, y = build_training_matrix(disease_data)
+        return self.assemble_snapshot(disease_data, all_symptoms, X_train, y, catalog_fingerprint(disease_data))
+    
+    def assemble_snapshot(self, disease_data: Dict, all_symptoms: List[str], X_train, labels: List[str],
+                          fingerprint: str, fitted: Dict = None) -> CatalogSnapshot:
+        """Fit the classifier, symptom index and suggester over a prepared training matrix.
+        
+        `fitted` holds the three already fitted (read from the catalog cache),
+        which are then used as they are.
+        """
+        y_train = np.array(labels)
+        
+        if fitted is None:
+            fitted = {
+                'classifier': create_classifier(CLASSIFIER_BACKEND).fit(X_train, y_train),
+                'symptom_index': SymptomIndex(all_symptoms),
+                'symptom_suggester': SymptomSuggester(
+                    all_symptoms, np.bincount(X_train.indices, minlength=len(all_symptoms))
+                )
+            }
+            message = "Classifier trained"
+        else:
+            message = "Fitted classifier loaded from cache"
+        classifier = fitted['classifier']
         
-        self.all_symptoms = sorted(list(all_symptoms))
+        snapshot = CatalogSnapshot(
+            version=self.snapshot.version + 1 if self.snapshot else 1,
+            fingerprint=fingerprint,
+            disease_data=disease_data,
+            all_symptoms=all_symptoms,
+            symptom_columns={symptom: column for column, symptom in enumerate(all_symptoms)},
+            X_train=X_train,
+            y_train=y_train,
+            classifier=classifier,
+            symptom_index=fitted['symptom_index'],
+            symptom_suggester=fitted['symptom_suggester']
+        )
+        logger.info(message, backend=classifier.name, total_symptoms=len(all_symptoms),
+                    nonzero=X_train.nnz, catalog_version=snapshot.version)
+        return snapshot
+    
+    def save_cached_snapshot(self, snapshot: CatalogSnapshot):
+        """Write a snapshot to CATALOG_CACHE_DIR for the next cold start.
         
-        X = []
-        y = []
+        Each catalog goes to its own directory named by fingerprint holding
+        the CSR index arrays as .npy files (memory-mappable), a JSON manifest
+        with the vocabulary, labels and disease metadata, and the fitted
+        classifier, symptom index and suggester pickled under
+        fitted_cache_name(), so a warm start skips refitting them. The
+        directory is written under a temporary name and renamed into place,
+        then the CURRENT pointer file is replaced atomically, so neither a
+        crash nor another worker ever sees a half-written cache. Other
+        catalog directories are removed only once CURRENT has not pointed
+        at them for CATALOG_CACHE_GRACE_SECONDS.
+        """
+        if not CATALOG_CACHE_DIR:
+            return
+        try:
+            target = os.path.join(CATALOG_CACHE_DIR, snapshot.fingerprint)
+            if not os.path.isdir(target):
+                self._write_cache_directory(snapshot, target)
+            elif not os.path.exists(os.path.join(target, fitted_cache_name())):
+                # Cached by another backend or an earlier version of the code
+                self._write_fitted(snapshot, target)
+            
+            pointer = os.path.join(CATALOG_CACHE_DIR, 'CURRENT')
+            previous = self._cache_pointer()
+            if previous and previous != snapshot.fingerprint:
+                # The grace period of the catalog being replaced starts now
+                try:
+                    os.utime(os.path.join(CATALOG_CACHE_DIR, previous))
+                except OSError:
+                    pass
+            pointer_tmp = f'{pointer}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(pointer_tmp, 'w', encoding='utf-8') as f:
+                json.dump({'format': CATALOG_CACHE_FORMAT, 'fingerprint': snapshot.fingerprint}, f)
+            os.replace(pointer_tmp, pointer)
+            
+            self._prune_cache(keep={snapshot.fingerprint, self._cache_pointer()})
+            logger.info("Catalog snapshot cached", fingerprint=snapshot.fingerprint, path=target)
+        except Exception as e:
+            logger.error("Failed to cache catalog snapshot", error=str(e))
+    
+    @staticmethod
+    def _write_cache_directory(snapshot: CatalogSnapshot, target: str):
+        """Write the snapshot files to a temporary directory, then rename it to `target`"""
+        staging = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+        os.makedirs(staging, exist_ok=True)
+        try:
+            np.save(os.path.join(staging, 'indices.npy'), snapshot.X_train.indices)
+            np.save(os.path.join(staging, 'indptr.npy'), snapshot.X_train.indptr)
+            with open(os.path.join(staging, 'catalog.json'), 'w', encoding='utf-8') as f:
+                json.dump({
+                    'format': CATALOG_CACHE_FORMAT,
+                    'fingerprint': snapshot.fingerprint,
+                    'saved_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    'all_symptoms': snapshot.all_symptoms,
+                    'labels': [str(label) for label in snapshot.y_train],
+                    'disease_data': snapshot.disease_data
+                }, f, default=str)
+            MedicalDatabase._write_fitted(snapshot, staging)
+            os.replace(staging, target)
+        except OSError:
+            # Another worker renamed the same catalog into place first
+            if not os.path.isdir(target):
+                raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+    
+    @staticmethod
+    def _write_fitted(snapshot: CatalogSnapshot, directory: str):
+        """Pickle the snapshot's fitted objects into a catalog directory, replacing the file atomically"""
+        path = os.path.join(directory, fitted_cache_name())
+        temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(temporary, 'wb') as f:
+                pickle.dump({
+                    'classifier': snapshot.classifier,
+                    'symptom_index': snapshot.symptom_index,
+                    'symptom_suggester': snapshot.symptom_suggester
+                }, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+    
+    @staticmethod
+    def _cache_pointer() -> Optional[str]:
+        """Fingerprint CURRENT points at, or None"""
+        try:
+            with open(os.path.join(CATALOG_CACHE_DIR, 'CURRENT'), encoding='utf-8') as f:
+                return json.load(f).get('fingerprint')
+        except (OSError, ValueError):
+            return None
+    
+    @staticmethod
+    def _prune_cache(keep: set):
+        """Remove catalog and leftover temporary directories idle past the grace period"""
+        cutoff = time.time() - CATALOG_CACHE_GRACE_SECONDS
+        for name in os.listdir(CATALOG_CACHE_DIR):
+            path = os.path.join(CATALOG_CACHE_DIR, name)
+            if name in keep or not os.path.isdir(path):
+                continue
+            try:
+                if os.path.getmtime(path) > cutoff:
+                    continue
+            except OSError:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+    
+    def load_cached_snapshot(self) -> CatalogSnapshot:
+        """Rebuild the last cached snapshot from disk, or None if unusable"""
+        if not CATALOG_CACHE_DIR:
+            return None
+        from scipy import sparse
         
-        for disease, info in self.disease_data.items():
-            symptom_vector = [1 if symptom in info['symptoms'] else 0 
-                            for symptom in self.all_symptoms]
-            X.append(symptom_vector)
-            y.append(disease)
+        try:
+            with open(os.path.join(CATALOG_CACHE_DIR, 'CURRENT'), encoding='utf-8') as f:
+                pointer = json.load(f)
+            if pointer.get('format') != CATALOG_CACHE_FORMAT:
+                return None
+            
+            target = os.path.join(CATALOG_CACHE_DIR, pointer['fingerprint'])
+            with open(os.path.join(target, 'catalog.json'), encoding='utf-8') as f:
+                manifest = json.load(f)
+            indices = np.load(os.path.join(target, 'indices.npy'), mmap_mode='r')
+            indptr = np.load(os.path.join(target, 'indptr.npy'), mmap_mode='r')
+            
+            labels = manifest['labels']
+            all_symptoms = manifest['all_symptoms']
+            if len(indptr) != len(labels) + 1 or int(indptr[-1]) != len(indices):
+                logger.warning("Catalog cache is inconsistent, ignoring it", path=target)
+                return None
+            
+            X_train = sparse.csr_matrix(
+                (np.ones(len(indices)), indices, indptr),
+                shape=(len(labels), len(all_symptoms))
+            )
+            # The pickle is written only by save_cached_snapshot; without it
+            # (another backend, changed code) the objects are fitted again
+            fitted = None
+            try:
+                with open(os.path.join(target, fitted_cache_name()), 'rb') as f:
+                    fitted = pickle.load(f)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning("Cached fitted classifier is unusable, refitting", error=str(e))
+            snapshot = self.assemble_snapshot(manifest['disease_data'], all_symptoms, X_train, labels,
+                                              manifest['fingerprint'], fitted)
+            if fitted is None:
+                try:
+                    self._write_fitted(snapshot, target)
+                except OSError as e:
+                    logger.error("Failed to cache fitted classifier", error=str(e))
+            logger.info("Catalog snapshot loaded from cache", fingerprint=snapshot.fingerprint,
+                        saved_at=manifest.get('saved_at'))
+            return snapshot
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error("Failed to load cached catalog snapshot", error=str(e))
+            return None
+    
+    def install_snapshot(self, snapshot: CatalogSnapshot):
+        """Make a snapshot current; requests already holding the old one keep it"""
+        self.snapshot = snapshot
+        for listener in list(self._snapshot_listeners):
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logger.error("Catalog snapshot listener failed", error=str(e))
+        logger.incr("catalog_snapshots_installed")
+        logger.info("Catalog snapshot installed", catalog_version=snapshot.version,
+                    fingerprint=snapshot.fingerprint, disease_count=len(snapshot.disease_data))
+    
+    def add_snapshot_listener(self, listener):
+        """Call `listener(snapshot)` whenever a new snapshot is installed"""
+        self._snapshot_listeners.append(listener)
+    
+    def refresh(self) -> bool:
+        """Reload the catalog from Supabase and swap in a new snapshot if it changed"""
+        with self._reload_lock:
+            disease_data = self.load_disease_data()
+            if not disease_data:
+                return False
+            if catalog_fingerprint(disease_data) == self.snapshot.fingerprint:
+                return False
+            snapshot = self.create_training_data(disease_data)
+            self.install_snapshot(snapshot)
+            self.save_cached_snapshot(snapshot)
+            return True
+    
+    def _revalidate(self):
+        """One-off refresh after booting from the on-disk cache"""
+        try:
+            if self.refresh():
+                logger.info("Cached catalog was stale and has been replaced", catalog_version=self.version)
+        except Exception as e:
+            logger.error("Catalog revalidation failed", error=str(e))
+    
+    def start_refresher(self, interval: float = None):
+        """Refresh the catalog every `interval` seconds on a background thread"""
+        interval = CATALOG_REFRESH_SECONDS if interval is None else interval
+        if interval <= 0 or (self._refresher and self._refresher.is_alive()):
+            return
         
-        self.X_train = np.array(X)
-        self.y_train = np.array(y)
+        def run():
+            while not self._refresher_stop.wait(interval):
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.error("Catalog refresh failed", error=str(e))
         
-        self.knn_model = KNeighborsClassifier(n_neighbors=min(3, len(self.y_train)))
-        self.knn_model.fit(self.X_train, self.y_train)
-        logger.info("KNN model trained", total_symptoms=len(self.all_symptoms))
+        self._refresher_stop.clear()
+        self._refresher = threading.Thread(target=run, name="catalog-refresher", daemon=True)
+        self._refresher.start()
+        logger.info("Catalog refresher started", interval=interval)
+    
+    def stop_refresher(self):
+        """Stop the background catalog refresher"""
+        self._refresher_stop.set()
+    
+    def symptom_matrix(self, column_sets: List[List[int]]):
+        """Build a sparse query matrix against the current snapshot"""
+        return self.snapshot.symptom_matrix(column_sets)
     
     def get_disease_info(self, disease_name: str) -> Dict:
         """Get detailed information about a disease"""
-        return self.disease_data.get(disease_name, {})
+        return self.snapshot.get_disease_info(disease_name)
     
     def is_emergency(self, disease_name: str) -> bool:
         """Check if disease requires emergency care"""
-        disease_info = self.disease_data.get(disease_name, {})
-        return disease_info.get('emergency', False)
+        return self.snapshot.is_emergency(disease_name)
+
+    def suggest_symptoms(self, query: str, limit: int = 10) -> List[Dict]:
+        """Autocomplete symptoms, most referenced first"""
+        return self.snapshot.symptom_suggester.suggest(query, limit)
 
 # Medical Diagnosis System
+def timed_load(factory, count_rows):
+    """Build a component and measure it: (component, {'seconds', 'rows'})"""
+    started = time.perf_counter()
+    component = factory()
+    return component, {
+        'seconds': round(time.perf_counter() - started, 3),
+        'rows': count_rows(component)
+    }
+
+class DiagnosisContext:
+    """Per-request state of a diagnosis: who asked, by when, and a trace id for logs.
+    
+    Passed explicitly through diagnose/predict so concurrent requests never
+    share mutable state. `deadline` is a time.monotonic() value or None.
+    """
+
+    def __init__(self, user: Dict = None, deadline: float = None, trace_id: str = None):
+        self.user = user
+        self.deadline = deadline
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+
+    @classmethod
+    def with_timeout(cls, user: Dict, timeout: float, trace_id: str = None) -> 'DiagnosisContext':
+        return cls(user, time.monotonic() + timeout, trace_id)
+
+    @property
+    def user_email(self) -> str:
+        return self.user['email'] if self.user else 'guest'
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline (None without one)"""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
+
 class MedicalDiagnosisSystem:
     def __init__(self):
-        self.db = MedicalDatabase()
-        self.doctor_profiles = DoctorProfile()
-        self.appointment_system = AppointmentSystem()
+        # Every component reads and writes through this one store; async
+        # callers (the API) use the repository wrapped around it
+        self.store = create_store()
+        self.repository = AsyncRepository(self.store, DATA_ACCESS_WORKERS, DATA_ACCESS_TIMEOUT_SECONDS)
+        self.history_writer = HistoryWriter(
+            self.repository,
+            batch_size=HISTORY_BATCH_SIZE,
+            flush_interval=HISTORY_FLUSH_SECONDS,
+            max_pending=HISTORY_QUEUE_SIZE,
+            backpressure_timeout=HISTORY_BACKPRESSURE_SECONDS,
+            spill_path=HISTORY_SPILL_PATH
+        )
+        
+        # The disease and doctor tables are fetched concurrently; the time and
+        # row count of each load is kept in startup_report. Users are loaded
+        # on demand by UserAuthSystem.
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="startup") as pool:
+            diseases = pool.submit(timed_load, lambda: MedicalDatabase(self.store), lambda db: len(db.disease_data))
+            doctors = pool.submit(timed_load, lambda: DoctorProfile(self.store), lambda profiles: len(profiles.doctors))
+            self.db, diseases_report = diseases.result()
+            self.doctor_profiles, doctors_report = doctors.result()
+        self.startup_report = {'diseases': diseases_report, 'doctors': doctors_report}
+        self.auth_system = UserAuthSystem(self.store)
+        for table, report in self.startup_report.items():
+            logger.info("Startup table loaded", table=table, **report)
+        
+        self.appointment_system = AppointmentSystem(self.store)
         self.hospital_locator = HospitalLocator()
-        self.auth_system = UserAuthSystem()
         # New services
-        self.reminder = MedicineReminder()
-        self.health_monitor = HealthMonitor()
+        self.reminder = MedicineReminder(self.store)
+        self.health_monitor = HealthMonitor(self.store)
         self.patient_history = []
+        # Results of predict_disease keyed by catalog version and symptom set
+        self.prediction_cache = TTLCache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL_SECONDS)
+        self.db.add_snapshot_listener(lambda snapshot: self.prediction_cache.clear())
+        self.gemini = GeminiClient(
+            cache=GeminiResponseCache(GEMINI_CACHE_PATH, GEMINI_CACHE_TTL_SECONDS, GEMINI_CACHE_MAX_BYTES),
+            max_concurrency=GEMINI_MAX_CONCURRENCY,
+            queue_timeout=GEMINI_QUEUE_TIMEOUT_SECONDS,
+            timeout=GEMINI_TIMEOUT_SECONDS,
+            loader=get_gemini
+        )
+        # Dashboard summaries keyed by user email (see invalidate_dashboard)
+        self.dashboard_cache = TTLCache(1024, DASHBOARD_CACHE_TTL_SECONDS)
+        # Diagnoses whose AI analysis is produced later, keyed by diagnosis_id
+        self.deferred_analyses = TTLCache(1024, DEFERRED_ANALYSIS_TTL_SECONDS)
+        self.analysis_jobs = AnalysisJobQueue(
+            self._run_analysis_job, workers=ANALYSIS_WORKERS, max_pending=ANALYSIS_QUEUE_SIZE
+        )
+        # CPU-bound matching and scoring for async callers (see run_scoring)
+        self.scoring_pool = ThreadPoolExecutor(max_workers=SCORING_WORKERS, thread_name_prefix="scoring")
         logger.info("Medical Diagnosis System initialized")
     
+    def invalidate_dashboard(self, user_email: str):
+        """Drop a user's cached dashboard summary after they save something"""
+        self.dashboard_cache.pop(user_email)
+    
+    def console_context(self, context: DiagnosisContext = None) -> DiagnosisContext:
+        """The given context, or one for the user logged in to the console app"""
+        return context or DiagnosisContext(self.auth_system.current_user)
+    
+    async def run_scoring(self, fn, *args):
+        """Run CPU-bound work (matching, classifier scoring) on the scoring pool"""
+        return await asyncio.get_running_loop().run_in_executor(self.scoring_pool, fn, *args)
+    
     def parse_symptoms(self, symptom_input: str) -> List[str]:
         """Parse symptom input from user"""
         # Remove quotation marks (both single and double) that users might accidentally include
@@ -936,8 +3217,8 @@ class MedicalDiagnosisSystem:
     
     def match_symptom(self, user_symptom: str, db_symptom: str) -> bool:
         """Check if user symptom matches database symptom (flexible matching)"""
-        user_symptom = user_symptom.lower().strip()
-        db_symptom = db_symptom.lower().strip()
+        user_symptom = normalize_symptom(user_symptom)
+        db_symptom = normalize_symptom(db_symptom)
         
         # Exact match
         if user_symptom == db_symptom:
@@ -948,13 +3229,8 @@ class MedicalDiagnosisSystem:
             return True
         
         # Remove common modifiers for better matching
-        modifiers = ['severe', 'mild', 'high', 'low', 'acute', 'chronic', 'dry', 'wet', 'with', 'without']
-        user_clean = user_symptom
-        db_clean = db_symptom
-        
-        for mod in modifiers:
-            user_clean = user_clean.replace(mod, '').strip()
-            db_clean = db_clean.replace(mod, '').strip()
+        user_clean = strip_symptom_modifiers(user_symptom)
+        db_clean = strip_symptom_modifiers(db_symptom)
         
         # Check if cleaned versions match
         if user_clean == db_clean:
@@ -966,75 +3242,111 @@ class MedicalDiagnosisSystem:
         
         return False
     
-    def predict_disease(self, symptoms: List[str]) -> Dict:
-        """Predict disease based on symptoms using KNN"""
-        logger.info("Starting disease prediction", symptom_count=len(symptoms))
+    def predict_disease(self, symptoms: List[str], snapshot: CatalogSnapshot = None,
+                        context: DiagnosisContext = None) -> Dict:
+        """Predict disease based on symptoms using KNN.
+        
+        Results are cached per catalog version and normalized symptom set,
+        since matching ignores order, case and duplicates. The context only
+        tags log lines; predictions do not depend on the caller.
+        """
+        snapshot = snapshot or self.db.snapshot
+        cache_key = (snapshot.version, tuple(sorted({normalize_symptom(s) for s in symptoms})))
+        
+        cached = self.prediction_cache.get(cache_key, _MISSING)
+        if cached is not _MISSING:
+            logger.incr("prediction_cache_hits")
+            return copy.deepcopy(cached)
+        logger.incr("prediction_cache_misses")
         
-        # Create symptom vector with flexible matching
-        symptom_vector = []
-        matched_symptoms = []
+        prediction = self._predict_uncached(symptoms, snapshot, context.trace_id if context else None)
+        self.prediction_cache.set(cache_key, prediction)
+        return copy.deepcopy(prediction)
+    
+    def _predict_uncached(self, symptoms: List[str], snapshot: CatalogSnapshot, trace_id: str = None) -> Dict:
+        logger.info("Starting disease prediction", symptom_count=len(symptoms), trace_id=trace_id)
         
-        for db_symptom in self.db.all_symptoms:
-            matched = False
-            for user_symptom in symptoms:
-                if self.match_symptom(user_symptom, db_symptom):
-                    matched = True
-                    if db_symptom not in matched_symptoms:
-                        matched_symptoms.append(db_symptom)
-                    break
-            symptom_vector.append(1 if matched else 0)
+        # Create symptom vector with flexible matching (see match_symptom),
+        # touching only the candidates found through the symptom index
+        matched_columns, fuzzy_matches = snapshot.symptom_index.match_with_corrections(symptoms)
+        matched_symptoms = [snapshot.all_symptoms[i] for i in matched_columns]
+        if fuzzy_matches:
+            logger.incr("symptoms_fuzzy_matched", len(fuzzy_matches))
+            logger.info("Misspelled symptoms corrected", corrections=fuzzy_matches)
         
         # If no symptoms matched, return None for strict validation
-        if sum(symptom_vector) == 0:
+        if not matched_columns:
             logger.warning("No symptoms matched", user_symptoms=symptoms)
             return None
         
-        symptom_array = np.array(symptom_vector).reshape(1, -1)
+        symptom_array = snapshot.symptom_matrix([matched_columns])
         
         # Log the symptom vector for debugging
         logger.info("Symptom vector created", 
-                   matched_count=sum(symptom_vector), 
-                   total_symptoms=len(symptom_vector),
+                   matched_count=len(matched_columns), 
+                   total_symptoms=len(snapshot.all_symptoms),
                    matched_symptoms=matched_symptoms[:5])
         
-        prediction = self.db.knn_model.predict(symptom_array)[0]
-        
-        distances, indices = self.db.knn_model.kneighbors(symptom_array)
-        confidence = 1 / (1 + distances[0][0]) if distances[0][0] > 0 else 1.0
+        prediction = self.score_symptom_vectors(symptom_array, snapshot)[0]
         
         # Log prediction details
         logger.info("Disease predicted", 
-                   disease=prediction, 
-                   confidence=confidence,
-                   distance=distances[0][0] if len(distances[0]) > 0 else 0)
-        
-        predictions_proba = []
-        for idx in indices[0]:
-            disease = self.db.y_train[idx]
-            if disease not in [p['disease'] for p in predictions_proba]:
-                dist_idx = list(indices[0]).index(idx)
-                conf = 1 / (1 + distances[0][dist_idx]) if distances[0][dist_idx] > 0 else 1.0
-                predictions_proba.append({
-                    'disease': disease,
-                    'confidence': round(conf, 2)
-                })
+                   disease=prediction['primary_prediction'], 
+                   confidence=prediction['confidence'],
+                   distance=prediction['distance'])
         
         logger.incr("predictions_made")
         return {
-            'primary_prediction': prediction,
-            'confidence': round(confidence, 2),
-            'all_predictions': predictions_proba[:3],
+            'primary_prediction': prediction['primary_prediction'],
+            'confidence': prediction['confidence'],
+            'all_predictions': prediction['all_predictions'],
             'matched_symptoms': matched_symptoms,
-            'is_emergency': self.db.is_emergency(prediction)
+            'fuzzy_matches': fuzzy_matches,
+            'is_emergency': snapshot.is_emergency(prediction['primary_prediction'])
         }
     
-    def get_ai_diagnosis(self, symptoms: List[str]) -> Dict:
-        """Get diagnosis directly from Gemini for sparse symptoms (1-2 inputs)"""
-        if not GEMINI_AVAILABLE or not model:
-            return None
+    def predict_many(self, symptom_sets: List[List[str]], snapshot: CatalogSnapshot = None) -> List[Dict]:
+        """Predict diseases for many symptom lists with a single KNN query.
         
-        try:
-            prompt = f"""You are an expert medical diagnostician. A patient has presented with only these symptoms: {', '.join(symptoms)}.
+        Returns one entry per input, in order; entries whose symptoms did not
+        match the database are None, as with predict_disease.
+        """
+        logger.info("Starting batch disease prediction", case_count=len(symptom_sets))
+        snapshot = snapshot or self.db.snapshot
+        
+        matched, corrections = [], []
+        for symptoms in symptom_sets:
+            columns, fuzzy_matches = snapshot.symptom_index.match_with_corrections(symptoms)
+            matched.append(columns)
+            corrections.append(fuzzy_matches)
+        rows = [i for i, columns in enumerate(matched) if columns]
+        results: List[Dict] = [None] * len(symptom_sets)
+        if not rows:
+            return results
+        
+        symptom_matrix = snapshot.symptom_matrix([matched[case] for case in rows])
+        
+        for case, prediction in zip(rows, self.score_symptom_vectors(symptom_matrix, snapshot)):
+            results[case] = {
+                'primary_prediction': prediction['primary_prediction'],
+                'confidence': prediction['confidence'],
+                'all_predictions': prediction['all_predictions'],
+                'matched_symptoms': [snapshot.all_symptoms[i] for i in matched[case]],
+                'fuzzy_matches': corrections[case],
+                'is_emergency': snapshot.is_emergency(prediction['primary_prediction'])
+            }
+        
+        logger.incr("predictions_made", len(rows))
+        return results
+    
+    def score_symptom_vectors(self, symptom_matrix, snapshot: CatalogSnapshot = None) -> List[Dict]:
+        """Score symptom vectors (one per row) with the snapshot's classifier backend in one call"""
+        snapshot = snapshot or self.db.snapshot
+        return snapshot.classifier.predict(symptom_matrix)
+    
+    def build_ai_diagnosis_prompt(self, symptoms: List[str]) -> str:
+        """Prompt asking Gemini for a direct diagnosis of sparse symptoms"""
+        return f"""You are an expert medical diagnostician. A patient has presented with only these symptoms: {', '.join(symptoms)}.
             
             This is sparse information, but based on common medical knowledge, what is the SINGLE most likely condition?
             
@@ -1048,40 +3360,64 @@ class MedicalDiagnosisSystem:
             
             Be realistic about confidence. If it's too vague, return "Viral Infection" or "General Fatigue" with lower confidence.
             """
-            
-            response = model.generate_content(prompt)
-            text = response.text.replace('```json', '').replace('```', '').strip()
-            
-            import json
+    
+    def parse_ai_diagnosis(self, prompt: str, response_text: str, symptoms: List[str]) -> Dict:
+        """Map Gemini's JSON diagnosis onto the prediction structure"""
+        text = response_text.replace('```json', '').replace('```', '').strip()
+        
+        try:
             data = json.loads(text)
-            
-            # Map to internal format structure
-            # Ensure we have a valid confidence float
-            conf = float(data.get('confidence', 0.5))
-            
-            return {
-                'primary_prediction': data.get('disease', 'Unknown'),
-                'confidence': conf,
-                'all_predictions': [{'disease': data.get('disease', 'Unknown'), 'confidence': conf}],
-                'matched_symptoms': symptoms,
-                'is_emergency': data.get('is_emergency', False),
-                'ai_analysis': data.get('reasoning', 'AI formulated diagnosis based on limited symptoms.')
-            }
-            
+        except ValueError:
+            # Do not keep serving an unparseable answer from the cache
+            self.gemini.forget(prompt)
+            raise
+        
+        # Map to internal format structure
+        # Ensure we have a valid confidence float
+        conf = float(data.get('confidence', 0.5))
+        
+        return {
+            'primary_prediction': data.get('disease', 'Unknown'),
+            'confidence': conf,
+            'all_predictions': [{'disease': data.get('disease', 'Unknown'), 'confidence': conf}],
+            'matched_symptoms': symptoms,
+            'is_emergency': data.get('is_emergency', False),
+            'ai_analysis': data.get('reasoning', 'AI formulated diagnosis based on limited symptoms.')
+        }
+    
+    def get_ai_diagnosis(self, symptoms: List[str]) -> Dict:
+        """Get diagnosis directly from Gemini for sparse symptoms (1-2 inputs)"""
+        if not self.gemini.available:
+            return None
+        
+        try:
+            prompt = self.build_ai_diagnosis_prompt(symptoms)
+            return self.parse_ai_diagnosis(prompt, self.gemini.generate(prompt), symptoms)
         except Exception as e:
             logger.error("AI Diagnosis failed", error=str(e))
             return None
-
-    def get_gemini_analysis(self, symptoms: List[str], prediction: Dict) -> str:
-        """Get AI-powered analysis from Gemini"""
-        if not GEMINI_AVAILABLE or not model:
-            return "AI analysis unavailable. Gemini API not configured."
-        
-        logger.info("Requesting Gemini analysis")
+    
+    async def get_ai_diagnosis_async(self, symptoms: List[str], context: DiagnosisContext = None) -> Dict:
+        """Non-blocking get_ai_diagnosis; None on failure, timeout or overload"""
+        if not self.gemini.available:
+            return None
         
-        disease_info = self.db.get_disease_info(prediction['primary_prediction'])
+        try:
+            prompt = self.build_ai_diagnosis_prompt(symptoms)
+            text = await self.gemini.generate_async(prompt, context.remaining() if context else None)
+            return self.parse_ai_diagnosis(prompt, text, symptoms)
+        except asyncio.TimeoutError:
+            logger.warning("AI Diagnosis skipped: Gemini budget exhausted")
+            return None
+        except Exception as e:
+            logger.error("AI Diagnosis failed", error=str(e))
+            return None
+
+    def build_analysis_prompt(self, symptoms: List[str], prediction: Dict, snapshot: CatalogSnapshot = None) -> str:
+        """Prompt asking Gemini to analyse a predicted diagnosis"""
+        disease_info = (snapshot or self.db.snapshot).get_disease_info(prediction['primary_prediction'])
         
-        prompt = f"""You are a medical AI assistant. Analyze the following patient case:
+        return f"""You are a medical AI assistant. Analyze the following patient case:
 
 Patient Symptoms: {', '.join(symptoms)}
 
@@ -1107,20 +3443,52 @@ Please provide:
 
 Keep the response concise and professional."""
 
+    def get_gemini_analysis(self, symptoms: List[str], prediction: Dict, snapshot: CatalogSnapshot = None) -> str:
+        """Get AI-powered analysis from Gemini"""
+        if not self.gemini.available:
+            return "AI analysis unavailable. Gemini API not configured."
+        
+        logger.info("Requesting Gemini analysis")
+        
+        prompt = self.build_analysis_prompt(symptoms, prediction, snapshot)
+
+        try:
+            text = self.gemini.generate(prompt)
+            logger.incr("gemini_calls_success")
+            return text
+        except Exception as e:
+            logger.error("Gemini API error", error=str(e))
+            logger.incr("gemini_calls_failed")
+            return f"AI analysis unavailable: {str(e)}"
+    
+    async def get_gemini_analysis_async(self, symptoms: List[str], prediction: Dict,
+                                        snapshot: CatalogSnapshot = None,
+                                        context: DiagnosisContext = None) -> str:
+        """Non-blocking get_gemini_analysis with the same fallback messages"""
+        if not self.gemini.available:
+            return "AI analysis unavailable. Gemini API not configured."
+        
+        logger.info("Requesting Gemini analysis")
+        
+        prompt = self.build_analysis_prompt(symptoms, prediction, snapshot)
+
         try:
-            response = model.generate_content(prompt)
+            text = await self.gemini.generate_async(prompt, context.remaining() if context else None)
             logger.incr("gemini_calls_success")
-            return response.text
+            return text
+        except asyncio.TimeoutError:
+            logger.incr("gemini_calls_failed")
+            return "AI analysis unavailable: the AI service did not respond in time. Showing the rule-based result only."
         except Exception as e:
             logger.error("Gemini API error", error=str(e))
             logger.incr("gemini_calls_failed")
             return f"AI analysis unavailable: {str(e)}"
     
-    def diagnose(self, symptom_input: str, user_type: str = "patient") -> Dict:
-        """Main diagnosis function"""
-        logger.info("New diagnosis request", user_type=user_type)
+    def _start_diagnosis(self, symptom_input: str, user_type: str, context: DiagnosisContext):
+        """Validate, parse and score input: (symptoms, snapshot, prediction) or an error dict"""
+        logger.info("New diagnosis request", user_type=user_type, trace_id=context.trace_id)
         # Require user login for AI diagnosis
-        if not self.auth_system.current_user:
+        if not context.user:
             return {"error": "Login required to access AI diagnosis"}
 
         symptoms = self.parse_symptoms(symptom_input)
@@ -1128,48 +3496,272 @@ Keep the response concise and professional."""
         if not symptoms:
             return {"error": "No symptoms provided"}
         
+        # The whole request runs against the catalog snapshot current now,
+        # even if a refresh swaps in a newer one meanwhile
+        snapshot = self.db.snapshot
+        
         # Default to rule-based prediction
-        prediction = self.predict_disease(symptoms)
+        prediction = self.predict_disease(symptoms, snapshot, context)
         
         # Strict validation check
         if prediction is None:
             return {"error": "Data not found or pls reenter"}
         
+        return symptoms, snapshot, prediction
+    
+    def _wants_ai_diagnosis(self, symptoms: List[str], prediction: Dict) -> bool:
         # IMPROVEMENT: If symptoms are sparse (1-2) or rule-based confidence is low, try AI diagnosis
-        if (len(symptoms) <= 2 or prediction['confidence'] < 0.4) and GEMINI_AVAILABLE:
+        if (len(symptoms) <= 2 or prediction['confidence'] < 0.4) and self.gemini.available:
             logger.info("Using AI diagnosis for sparse/low-confidence input", symptoms=symptoms)
+            return True
+        return False
+    
+    def diagnose(self, symptom_input: str, user_type: str = "patient", context: DiagnosisContext = None) -> Dict:
+        """Main diagnosis function (for the console user unless a context is given)"""
+        context = self.console_context(context)
+        started = self._start_diagnosis(symptom_input, user_type, context)
+        if isinstance(started, dict):
+            return started
+        symptoms, snapshot, prediction = started
+        
+        if self._wants_ai_diagnosis(symptoms, prediction):
             ai_prediction = self.get_ai_diagnosis(symptoms)
             if ai_prediction:
                 prediction = ai_prediction
         
-        disease_info = self.db.get_disease_info(prediction['primary_prediction'])
-        
         # If we already have AI analysis from the direct diagnosis, use it, otherwise call gemini analysis
         if 'ai_analysis' in prediction and prediction['ai_analysis']:
            ai_analysis = prediction['ai_analysis']
         else:
-           ai_analysis = self.get_gemini_analysis(symptoms, prediction)
+           ai_analysis = self.get_gemini_analysis(symptoms, prediction, snapshot)
+        
+        result = self.build_result(symptoms, prediction, user_type, ai_analysis, snapshot, context)
+        
+        self.patient_history.append(result)
+        
+        return result
+    
+    async def diagnose_async(self, symptom_input: str, user_type: str = "patient",
+                             defer_analysis: bool = False, context: DiagnosisContext = None) -> Dict:
+        """diagnose() for the API: Gemini calls are awaited, bounded and timed out,
+        falling back to the KNN result when the AI budget or the context's
+        deadline is exhausted. Matching and scoring run on the scoring pool.
+        
+        With defer_analysis the KNN result is returned straight away with
+        ai_analysis set to None; the analysis is produced later through
+        stream_analysis using the returned diagnosis_id.
+        """
+        context = self.console_context(context)
+        started = await self.run_scoring(self._start_diagnosis, symptom_input, user_type, context)
+        if isinstance(started, dict):
+            return started
+        symptoms, snapshot, prediction = started
+        
+        if defer_analysis:
+            result = self.build_result(symptoms, prediction, user_type, None, snapshot, context)
+            self.deferred_analyses.set(result['diagnosis_id'], {
+                'result': result,
+                'symptoms': symptoms,
+                'prediction': prediction,
+                'snapshot': snapshot
+            })
+            self.patient_history.append(result)
+            return result
+        
+        if self._wants_ai_diagnosis(symptoms, prediction):
+            ai_prediction = await self.get_ai_diagnosis_async(symptoms, context)
+            if ai_prediction:
+                prediction = ai_prediction
+        
+        if 'ai_analysis' in prediction and prediction['ai_analysis']:
+            ai_analysis = prediction['ai_analysis']
+        else:
+            ai_analysis = await self.get_gemini_analysis_async(symptoms, prediction, snapshot, context)
+        
+        result = self.build_result(symptoms, prediction, user_type, ai_analysis, snapshot, context)
+        
+        self.patient_history.append(result)
+        
+        return result
+    
+    def get_deferred_analysis(self, diagnosis_id: str) -> Dict:
+        """The pending analysis entry for a diagnosis, or None if unknown/expired"""
+        return self.deferred_analyses.get(diagnosis_id)
+    
+    def submit_analysis_job(self, diagnosis_id: str) -> bool:
+        """Hand a deferred diagnosis to the background analysis workers"""
+        deferred = self.get_deferred_analysis(diagnosis_id)
+        if deferred is None:
+            return False
+        return self.analysis_jobs.submit(deferred)
+    
+    async def _run_analysis_job(self, deferred: Dict) -> str:
+        analysis = await self.get_gemini_analysis_async(
+            deferred['symptoms'], deferred['prediction'], deferred['snapshot']
+        )
+        # Keep the finished analysis readable for a full TTL from now
+        self.deferred_analyses.set(deferred['result']['diagnosis_id'], deferred)
+        return analysis
+    
+    async def stream_analysis(self, deferred: Dict):
+        """Yield the Gemini analysis of a deferred diagnosis chunk by chunk.
+        
+        On completion the text is stored on the diagnosis result. Failures
+        yield the same fallback text the non-streaming path returns.
+        """
+        result = deferred['result']
+        if result.get('ai_analysis'):
+            yield result['ai_analysis']
+            return
+        if not self.gemini.available:
+            result['ai_analysis'] = "AI analysis unavailable. Gemini API not configured."
+            yield result['ai_analysis']
+            return
+        
+        logger.info("Streaming Gemini analysis", diagnosis_id=result['diagnosis_id'])
+        prompt = self.build_analysis_prompt(deferred['symptoms'], deferred['prediction'], deferred['snapshot'])
+        chunks = []
+        try:
+            async for chunk in self.gemini.stream_async(prompt):
+                chunks.append(chunk)
+                yield chunk
+            logger.incr("gemini_calls_success")
+        except asyncio.TimeoutError:
+            logger.incr("gemini_calls_failed")
+            chunks = ["AI analysis unavailable: the AI service did not respond in time. Showing the rule-based result only."]
+            yield chunks[0]
+        except Exception as e:
+            logger.error("Gemini API error", error=str(e))
+            logger.incr("gemini_calls_failed")
+            chunks = [f"AI analysis unavailable: {str(e)}"]
+            yield chunks[0]
+        result['ai_analysis'] = ''.join(chunks)
+    
+    def diagnose_many(self, symptom_inputs: List[str], user_type: str = "patient",
+                      context: DiagnosisContext = None) -> List[Dict]:
+        """Diagnose many symptom inputs at once using only the KNN model.
+        
+        Every input is parsed and matched, then all cases are scored as one
+        matrix. AI analysis is skipped so bulk jobs are not bound by Gemini
+        latency. Failed cases are returned in place as {"error": ...}.
+        """
+        context = self.console_context(context)
+        logger.info("New batch diagnosis request", user_type=user_type, case_count=len(symptom_inputs),
+                    trace_id=context.trace_id)
+        if not context.user:
+            return [{"error": "Login required to access AI diagnosis"} for _ in symptom_inputs]
+        
+        snapshot = self.db.snapshot
+        parsed = [self.parse_symptoms(symptom_input) for symptom_input in symptom_inputs]
+        predictions = self.predict_many(parsed, snapshot)
         
-        result = {
+        results = []
+        for symptoms, prediction in zip(parsed, predictions):
+            if not symptoms:
+                results.append({"error": "No symptoms provided"})
+            elif prediction is None:
+                results.append({"error": "Data not found or pls reenter"})
+            else:
+                results.append(self.build_result(symptoms, prediction, user_type, None, snapshot, context))
+        
+        logger.incr("batch_diagnoses", len(results))
+        return results
+    
+    def build_result(self, symptoms: List[str], prediction: Dict, user_type: str, ai_analysis: str,
+                     snapshot: CatalogSnapshot = None, context: DiagnosisContext = None) -> Dict:
+        """Assemble the diagnosis report for a prediction"""
+        snapshot = snapshot or self.db.snapshot
+        context = self.console_context(context)
+        return {
+            'diagnosis_id': uuid.uuid4().hex,
             'timestamp': datetime.datetime.now().isoformat(),
             'user_type': user_type,
-            'user_email': self.auth_system.current_user['email'] if self.auth_system.current_user else 'guest',
+            'user_email': context.user_email,
+            'trace_id': context.trace_id,
             'input_symptoms': symptoms,
             'matched_symptoms': prediction['matched_symptoms'],
-            'unmatched_symptoms': [s for s in symptoms if s not in prediction['matched_symptoms']],
+            'unmatched_symptoms': [s for s in symptoms if s not in prediction['matched_symptoms']
+                                   and s not in prediction.get('fuzzy_matches', {})],
+            'fuzzy_matches': prediction.get('fuzzy_matches', {}),
             'primary_diagnosis': {
                 'disease': prediction['primary_prediction'],
                 'confidence': prediction['confidence'],
-                'info': disease_info,
+                'info': snapshot.get_disease_info(prediction['primary_prediction']),
                 'is_emergency': prediction['is_emergency']
             },
-            'alternative_diagnoses': prediction['all_predictions'][1:],
-            'ai_analysis': ai_analysis
+            'alternative_diagnoses': [
+                {
+                    **alt,
+                    'info': snapshot.get_disease_info(alt['disease']),
+                    'is_emergency': snapshot.is_emergency(alt['disease'])
+                }
+                for alt in prediction['all_predictions'][1:]
+            ],
+            'ai_analysis': ai_analysis,
+            'catalog_version': snapshot.version,
+            'catalog_fingerprint': snapshot.fingerprint
         }
+    
+    def history_record(self, result: Dict) -> Dict:
+        """Compact diagnosis_history row for a result.
         
-        self.patient_history.append(result)
-        
-        return result
+        Instead of a copy of the disease info, primary_diagnosis references the
+        disease (catalog id and name) and keeps its severity, the matched
+        symptom names and the catalog it was diagnosed against; history_entry()
+        fills the details back in from the catalog when the row is read.
+        Nothing in it depends on column positions of the current catalog, so
+        rows stay readable after the catalog is reloaded.
+        """
+        diagnosis = result['primary_diagnosis']
+        compact = {
+            'format': HISTORY_ROW_FORMAT,
+            'disease': diagnosis['disease'],
+            'disease_id': diagnosis['info'].get('id'),
+            'severity': diagnosis['info'].get('severity'),
+            'confidence': diagnosis['confidence'],
+            'is_emergency': diagnosis['is_emergency'],
+            'catalog': result.get('catalog_fingerprint'),
+            'matched_symptoms': list(result['matched_symptoms'])
+        }
+        return {
+            'user_email': result['user_email'],
+            'timestamp': result['timestamp'],
+            'input_symptoms': result['input_symptoms'],
+            'primary_diagnosis': compact,
+            'ai_analysis': result.get('ai_analysis')
+        }
+    
+    def history_entry(self, record: Dict) -> Dict:
+        """A diagnosis_history row as returned to clients; older full rows pass through unchanged"""
+        diagnosis = record.get('primary_diagnosis')
+        matched_symptoms = None
+        if isinstance(diagnosis, dict) and diagnosis.get('format') in (2, HISTORY_ROW_FORMAT):
+            snapshot = self.db.snapshot
+            disease = snapshot.disease_ids.get(str(diagnosis.get('disease_id')), diagnosis['disease'])
+            if 'matched_symptoms' in diagnosis:
+                matched_symptoms = diagnosis['matched_symptoms']
+            elif diagnosis.get('catalog') == snapshot.fingerprint and 'symptom_ids' in diagnosis:
+                matched_symptoms = [snapshot.all_symptoms[i] for i in diagnosis['symptom_ids']
+                                    if i < len(snapshot.all_symptoms)]
+            # A disease since removed from the catalog keeps what the row recorded
+            info = snapshot.get_disease_info(disease) or {
+                'severity': diagnosis.get('severity'),
+                'emergency': diagnosis['is_emergency']
+            }
+            diagnosis = {
+                'disease': disease,
+                'confidence': diagnosis['confidence'],
+                'info': info,
+                'is_emergency': diagnosis['is_emergency']
+            }
+        return {
+            'id': record.get('id'),
+            'timestamp': record['timestamp'],
+            'input_symptoms': record.get('input_symptoms'),
+            'primary_diagnosis': diagnosis,
+            'matched_symptoms': matched_symptoms,
+            'ai_analysis': record.get('ai_analysis')
+        }
     
     def display_result(self, result: Dict):
         """Display diagnosis result in formatted way"""
@@ -1182,6 +3774,9 @@ Keep the response concise and professional."""
         
         print(f"\n📋 INPUT SYMPTOMS:")
         for symptom in result['input_symptoms']:
+            if symptom in result.get('fuzzy_matches', {}):
+                print(f"  ~ {symptom} (read as: {result['fuzzy_matches'][symptom]})")
+                continue
             status = "✓" if symptom in result['matched_symptoms'] else "✗"
             print(f"  {status} {symptom}")
         
@@ -1421,7 +4016,7 @@ def display_statistics(system):
     print(f"  • Emergency Diagnoses: {emergency_diagnoses}")
     
     print(f"\nUser Stats:")
-    print(f"  • Total Registered Users: {len(system.auth_system.users)}")
+    print(f"  • Total Registered Users: {system.store.count_users() if system.store.available else 0}")
     if system.auth_system.current_user:
         print(f"  • Current User: {system.auth_system.current_user['name']}")
         print(f"  • Login Count: {system.auth_system.current_user.get('login_count', 0)}")
@@ -1684,5 +4279,11 @@ def main():
         else:
             print("\n❌ Invalid option! Please select 1-6.")
 
+# Seconds spent importing this module; startup logs a warning above the budget
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+if IMPORT_SECONDS > IMPORT_BUDGET_SECONDS:
+    logger.warning("Importing main.py exceeded its budget", seconds=round(IMPORT_SECONDS, 3),
+                   budget=IMPORT_BUDGET_SECONDS)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,105 @@
+-- Tables used by MEDAI, as the app reads and writes them.
+--
+-- Supabase projects get these from the dashboard; this file recreates them
+-- for the 'postgres' data backend on a local PostgreSQL (see
+-- tests/test_postgres_store.py) and documents the columns the code relies
+-- on. List values sent by the REST API land in jsonb columns.
+
+create table if not exists users (
+    email text primary key,
+    name text,
+    phone text,
+    password_hash text,
+    user_type text default 'patient',
+    registered_on timestamptz default now(),
+    login_count integer default 0,
+    last_login timestamptz
+);
+
+create table if not exists doctors (
+    id text primary key,
+    name text,
+    specialization text,
+    qualifications text,
+    experience text,
+    phone text,
+    email text,
+    hospital text,
+    available_days jsonb,
+    available_times jsonb,
+    consultation_fee numeric,
+    emergency_available boolean default false,
+    rating numeric
+);
+
+create table if not exists diseases (
+    id bigint generated by default as identity primary key,
+    name text unique not null,
+    symptoms jsonb not null,
+    description text,
+    treatment text,
+    severity text,
+    duration text,
+    emergency boolean default false
+);
+
+create table if not exists appointments (
+    id bigint generated by default as identity primary key,
+    appointment_id text,
+    patient_name text,
+    patient_phone text,
+    patient_age text,
+    symptoms text,
+    doctor_id text,
+    appointment_date text,
+    appointment_time text,
+    is_emergency boolean default false,
+    status text,
+    booked_on timestamptz default now(),
+    user_email text
+);
+
+-- Reminders page on id (GET /api/reminders)
+create table if not exists medicine_reminders (
+    id bigint generated by default as identity primary key,
+    user_email text references users (email),
+    medicine_name text,
+    dosage text,
+    time text,
+    start_date date,
+    end_date date,
+    notes text
+);
+
+-- Health records page on (date, id), newest first (GET /api/health-records)
+create table if not exists health_records (
+    id bigint generated by default as identity primary key,
+    user_email text references users (email),
+    date date,
+    blood_pressure text,
+    heart_rate integer,
+    sugar_level numeric,
+    weight numeric,
+    temperature numeric
+);
+
+create index if not exists health_records_user_date_id
+    on health_records (user_email, date desc, id desc);
+
+-- History pages on ("timestamp", id), newest first (GET /api/diagnosis/history),
+-- so the table needs an id column. On a project created before paging, add it
+-- with:
+--     alter table diagnosis_history
+--         add column if not exists id bigint generated by default as identity;
+-- primary_diagnosis holds the compact row written by history_record().
+create table if not exists diagnosis_history (
+    id bigint generated by default as identity primary key,
+    user_email text,
+    "timestamp" timestamptz not null,
+    input_symptoms jsonb,
+    primary_diagnosis jsonb,
+    ai_analysis text
+);
+
+create index if not exists diagnosis_history_user_timestamp_id
+    on diagnosis_history (user_email, "timestamp" desc, id desc);
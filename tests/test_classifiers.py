@@ -0,0 +1,53 @@
+"""The fast KNN backends must predict what the original scikit-learn KNN did"""
+import numpy as np
+import pytest
+
+import main
+from benchmark_classifiers import make_queries, synthetic_catalog
+
+# Every synthetic disease is its own class
+pytestmark = pytest.mark.filterwarnings('ignore:The number of unique classes')
+
+
+@pytest.fixture(scope='module', params=[
+    main.MedicalDatabase.load_fallback_data(None),
+    synthetic_catalog(300, seed=1),
+    synthetic_catalog(2000, seed=2),
+], ids=['fallback', 'synthetic-300', 'synthetic-2000'])
+def catalog(request):
+    all_symptoms, X_train, labels = main.build_training_matrix(request.param)
+    y_train = np.array(labels)
+    queries, _ = make_queries(X_train, labels, 200, seed=3)
+    return X_train, y_train, queries
+
+
+def baseline(X_train, y_train, queries):
+    """Predictions and nearest distances of the original model: KNeighborsClassifier on dense 0/1 integer rows"""
+    from sklearn.neighbors import KNeighborsClassifier
+
+    model = KNeighborsClassifier(n_neighbors=min(3, len(y_train)))
+    model.fit(X_train.toarray().astype(int), y_train)
+    dense_queries = queries.toarray().astype(int)
+    distances, _ = model.kneighbors(dense_queries)
+    return list(model.predict(dense_queries)), distances[:, 0]
+
+
+@pytest.mark.parametrize('backend', ['knn-brute', 'hamming-packed'])
+def test_predictions_equal_baseline_knn(catalog, backend):
+    X_train, y_train, queries = catalog
+    expected, distances = baseline(X_train, y_train, queries)
+
+    scored = main.create_classifier(backend).fit(X_train, y_train).predict(queries)
+
+    assert [row['primary_prediction'] for row in scored] == expected
+    np.testing.assert_allclose([row['distance'] for row in scored], distances)
+    assert [row['confidence'] for row in scored] == [round(1 / (1 + d), 2) if d > 0 else 1.0 for d in distances]
+
+
+def test_hamming_packed_ranks_like_knn_brute(catalog):
+    X_train, y_train, queries = catalog
+
+    brute = main.create_classifier('knn-brute').fit(X_train, y_train).predict(queries)
+    packed = main.create_classifier('hamming-packed').fit(X_train, y_train).predict(queries)
+
+    assert [row['all_predictions'] for row in packed] == [row['all_predictions'] for row in brute]
@@ -0,0 +1,180 @@
+"""HistoryWriter: batching, spilling on failure and replaying spilled rows exactly once"""
+import asyncio
+import json
+import threading
+
+import pytest
+
+import main
+
+
+class FakeStore:
+    """insert_diagnoses into a list; `fail_from` makes that call and every later one fail"""
+    available = True
+
+    def __init__(self):
+        self.rows = []
+        self.calls = 0
+        self.fail_from = None
+        self.gate = None
+
+    def insert_diagnoses(self, rows):
+        self.calls += 1
+        if self.gate:
+            self.gate.wait()
+        if self.fail_from is not None and self.calls >= self.fail_from:
+            raise ConnectionError("database down")
+        self.rows.extend(dict(row) for row in rows)
+
+    def close(self):
+        pass
+
+
+def row(i):
+    return {'user_email': 'a@example.com', 'timestamp': f'2026-01-01T10:00:{i:02d}'}
+
+
+@pytest.fixture
+def store():
+    return FakeStore()
+
+
+@pytest.fixture
+def make_writer(store, tmp_path):
+    repositories = []
+
+    def make(**options):
+        repository = main.AsyncRepository(store, workers=2)
+        repositories.append(repository)
+        options.setdefault('batch_size', 2)
+        options.setdefault('flush_interval', 3600)
+        options.setdefault('spill_path', str(tmp_path / 'spill.jsonl'))
+        return main.HistoryWriter(repository, **options)
+
+    yield make
+    for repository in repositories:
+        repository.shutdown()
+
+
+def spill_files(tmp_path):
+    return sorted(path.name for path in tmp_path.iterdir())
+
+
+def timestamps(rows):
+    return sorted(row['timestamp'] for row in rows)
+
+
+def test_rows_are_pending_until_flushed(store, make_writer):
+    async def scenario():
+        writer = make_writer(spill_path=None)
+        for i in range(3):
+            assert await writer.add(row(i))
+        assert timestamps(writer.pending('a@example.com')) == timestamps([row(0), row(1), row(2)])
+        await writer.close()
+
+    asyncio.run(scenario())
+    assert timestamps(store.rows) == timestamps([row(0), row(1), row(2)])
+    assert store.calls == 2
+
+
+def test_failed_batches_are_spilled_then_replayed_once(store, make_writer, tmp_path):
+    async def scenario():
+        writer = make_writer()
+        writer._ensure_task()
+        store.fail_from = 1
+        for i in range(4):
+            await writer.add(row(i))
+        await writer.flush()
+        assert store.rows == []
+        assert len((tmp_path / 'spill.jsonl').read_text().splitlines()) == 4
+
+        store.fail_from = None
+        await writer.add(row(4))
+        await writer.flush()
+        await writer.close()
+
+    asyncio.run(scenario())
+    assert timestamps(store.rows) == timestamps([row(i) for i in range(5)])
+    assert spill_files(tmp_path) == []
+
+
+def test_replay_failing_part_way_keeps_only_the_rest(store, make_writer, tmp_path):
+    spill = tmp_path / 'spill.jsonl'
+    spill.write_text(''.join(json.dumps(row(i)) + '\n' for i in range(6)))
+
+    async def scenario():
+        writer = make_writer()
+        writer._ensure_task()
+        # The first batch goes in, the second fails, and so does spilling
+        store.fail_from = store.calls + 2
+        writer.spill = lambda rows: False
+        await writer.flush()
+        assert len(store.rows) == 2
+        [replay] = spill_files(tmp_path)
+        assert len((tmp_path / replay).read_text().splitlines()) == 4
+
+        store.fail_from = None
+        del writer.spill
+        await writer.flush()
+        await writer.close()
+
+    asyncio.run(scenario())
+    assert timestamps(store.rows) == timestamps([row(i) for i in range(6)])
+    assert spill_files(tmp_path) == []
+
+
+def test_replay_skips_undecodable_lines_and_orphaned_replays(store, make_writer, tmp_path):
+    (tmp_path / 'spill.jsonl').write_text(json.dumps(row(0)) + '\n{"user_email": "a@ex\n' + json.dumps(row(1)) + '\n')
+    # Left behind by a process that no longer exists
+    (tmp_path / 'spill.jsonl.999999999.replay').write_text(json.dumps(row(2)) + '\n')
+
+    async def scenario():
+        writer = make_writer()
+        writer._ensure_task()
+        await writer.flush()
+        await writer.close()
+
+    asyncio.run(scenario())
+    assert timestamps(store.rows) == timestamps([row(0), row(1), row(2)])
+    assert spill_files(tmp_path) == []
+
+
+def test_full_buffer_spills_after_backpressure_timeout(store, make_writer, tmp_path):
+    async def scenario():
+        writer = make_writer(batch_size=10, max_pending=2, backpressure_timeout=0.05)
+        assert await writer.add(row(0))
+        assert await writer.add(row(1))
+        # A flush that does not get going leaves no room
+        async with writer._flush_lock:
+            assert not await writer.add(row(2))
+            assert (tmp_path / 'spill.jsonl').read_text().splitlines() == [json.dumps(row(2))]
+        await writer.close()
+
+    asyncio.run(scenario())
+    # Replayed once the buffered rows went in
+    assert timestamps(store.rows) == timestamps([row(0), row(1), row(2)])
+
+
+def test_amend_reaches_buffered_and_inflight_rows(store, make_writer, tmp_path):
+    async def scenario():
+        writer = make_writer(batch_size=1, flush_interval=0)
+        assert await writer.add(row(0))
+        assert await writer.amend('a@example.com', row(0)['timestamp'], {'ai_analysis': 'buffered'})
+        await writer.flush()
+
+        # The insert of row 1 is in flight and fails: the amended row is spilled
+        store.gate = threading.Event()
+        store.fail_from = store.calls + 1
+        await writer.add(row(1))
+        while not writer._inflight:
+            await asyncio.sleep(0.01)
+        amending = asyncio.ensure_future(writer.amend('a@example.com', row(1)['timestamp'], {'ai_analysis': 'late'}))
+        await asyncio.sleep(0.05)
+        store.gate.set()
+        assert not await amending
+        writer._task.cancel()
+
+    asyncio.run(scenario())
+    assert store.rows == [{**row(0), 'ai_analysis': 'buffered'}]
+    spilled = [json.loads(line) for line in (tmp_path / 'spill.jsonl').read_text().splitlines()]
+    assert spilled == [{**row(1), 'ai_analysis': 'late'}]
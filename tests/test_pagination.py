@@ -0,0 +1,111 @@
+"""Keyset pages must add up to every row exactly once, whatever rows share a sort key.
+
+Runs against PostgreSQL through the `store` fixture (see conftest.py).
+"""
+import asyncio
+
+import pytest
+
+import main
+
+EMAIL = 'pages@example.com'
+
+
+def walk(fetch, position_of, limit=4):
+    """Concatenate pages fetched with the position of the last row of the previous one"""
+    rows, position = [], None
+    while True:
+        page = fetch(limit + 1, position)
+        rows.extend(page[:limit])
+        if len(page) <= limit:
+            return rows
+        position = position_of(page[limit - 1])
+
+
+def test_history_pages(store):
+    # Several rows per timestamp, inserted out of order
+    store.insert_diagnoses([
+        {'user_email': EMAIL, 'timestamp': f'2026-02-01T10:{minute:02d}:00+00:00', 'input_symptoms': [f'row {i}']}
+        for i, minute in enumerate([3, 1, 3, 0, 2, 1, 3, 3, 0, 2, 1, 1, 2, 0, 3, 3, 2])
+    ])
+    everything = store.diagnosis_history(EMAIL)
+
+    paged = walk(lambda limit, before: store.diagnosis_history(EMAIL, limit, before),
+                 lambda row: [row['timestamp'], row['id']])
+
+    assert [row['id'] for row in paged] == [row['id'] for row in everything]
+    assert [(row['timestamp'], row['id']) for row in paged] == sorted(
+        ((row['timestamp'], row['id']) for row in everything), reverse=True)
+
+
+def test_reminder_pages(store):
+    for i in range(11):
+        store.add_reminder(EMAIL, {'medicine_name': f'm{i}', 'dosage': '1', 'time': '08:00',
+                                   'start_date': '2026-01-01'})
+
+    paged = walk(lambda limit, after: store.reminders(EMAIL, limit, after), lambda row: row['id'])
+
+    assert [row['medicine_name'] for row in paged] == [f'm{i}' for i in range(11)]
+
+
+def test_health_record_pages(store):
+    for i in range(13):
+        store.add_health_record(EMAIL, {'date': f'2026-01-{(i * 7) % 5 + 1:02d}', 'heart_rate': 60 + i})
+    everything = store.health_records(EMAIL)
+
+    paged = walk(lambda limit, before: store.health_records(EMAIL, limit, before),
+                 lambda row: [row['date'], row['id']])
+
+    assert [(str(row['date']), row['id']) for row in paged] == sorted(
+        ((str(row['date']), row['id']) for row in everything), reverse=True)
+
+
+def test_history_endpoint_merges_unflushed_rows(store, monkeypatch):
+    """Rows still held by the history writer are paged together with stored ones"""
+    httpx = pytest.importorskip('httpx')
+    import api_server
+
+    monkeypatch.setattr(main, 'create_store', lambda: store)
+    system = main.MedicalDiagnosisSystem()
+    store.ensure_user(EMAIL)
+    system.auth_system.remember(store.get_user(EMAIL))
+    monkeypatch.setattr(api_server, 'medical_system', system)
+
+    store.insert_diagnoses(
+        [{'user_email': EMAIL, 'timestamp': f'2026-02-01T10:{i:02d}:00', 'input_symptoms': [f'stored {i}']}
+         for i in range(7)]
+        # Stored row newer than some pending ones, and one sharing a pending row's timestamp
+        + [{'user_email': EMAIL, 'timestamp': '2026-03-01T10:05:00', 'input_symptoms': ['stored late']}]
+    )
+    writer = system.history_writer
+    writer.batch_size, writer.flush_interval = 1000, 3600
+
+    async def pages():
+        for i in range(8):
+            await writer.add({'user_email': EMAIL, 'timestamp': f'2026-03-01T10:{i:02d}:00',
+                              'input_symptoms': [f'pending {i}']})
+        transport = httpx.ASGITransport(app=api_server.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            seen, cursor = [], None
+            while True:
+                response = await client.get(
+                    '/api/diagnosis/history', headers={'Authorization': f'Bearer {EMAIL}'},
+                    params={'limit': 3, 'fields': 'timestamp,input_symptoms', **({'cursor': cursor} if cursor else {})}
+                )
+                assert response.status_code == 200, response.text
+                body = response.json()
+                seen.extend(row['input_symptoms'][0] for row in body['history'])
+                cursor = body['next_cursor']
+                if not cursor:
+                    break
+        writer._task.cancel()
+        return seen
+
+    try:
+        seen = asyncio.run(pages())
+    finally:
+        system.repository.shutdown()
+
+    assert seen == (['pending 7', 'pending 6', 'pending 5', 'stored late']
+                    + [f'pending {i}' for i in range(4, -1, -1)]
+                    + [f'stored {i}' for i in range(6, -1, -1)])
@@ -0,0 +1,64 @@
+"""SymptomIndex must match exactly what MedicalDiagnosisSystem.match_symptom does"""
+import pytest
+
+import main
+
+VOCABULARY = sorted({
+    symptom
+    for info in main.MedicalDatabase.load_fallback_data(None).values()
+    for symptom in info['symptoms']
+} | {'pain', 'back pain', 'lower back pain', 'chronic cough', 'itchy eyes', 'rash'})
+
+QUERIES = VOCABULARY + [
+    'Fever', '  HIGH   fever ', 'severe headache', 'mild cough', 'chronic back pain',
+    'pain in chest', 'cough', 'ache', 'eyes', 'a', 'ra', 'sore throat and fever',
+    'very severe chest pain', 'nausea', 'stomach',
+]
+
+
+def expected_matches(query):
+    """Vocabulary positions match_symptom accepts, by scanning the whole vocabulary"""
+    return [idx for idx, symptom in enumerate(VOCABULARY)
+            if main.MedicalDiagnosisSystem.match_symptom(None, query, symptom)]
+
+
+def closest_symptom(query, threshold):
+    """Best padded-trigram Jaccard match by exhaustive search, lowest position on ties"""
+    grams = main.padded_trigrams(main.normalize_symptom(query))
+    best = None
+    for idx, symptom in enumerate(VOCABULARY):
+        other = main.padded_trigrams(main.normalize_symptom(symptom))
+        similarity = len(grams & other) / len(grams | other)
+        if similarity >= threshold and (best is None or similarity > best[1]):
+            best = (idx, similarity)
+    return best
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_exact_matches_equal_match_symptom(query):
+    index = main.SymptomIndex(VOCABULARY, fuzzy_threshold=0)
+    assert index.match([query]) == expected_matches(query)
+
+
+def test_several_symptoms_match_the_union():
+    index = main.SymptomIndex(VOCABULARY, fuzzy_threshold=0)
+    queries = ['fever', 'back pain', 'nausea']
+    assert index.match(queries) == sorted(set().union(*(expected_matches(q) for q in queries)))
+
+
+@pytest.mark.parametrize('query', ['fevr', 'hedache', 'shortnes of breath', 'diarhea', 'vomitting', 'zzzzqqq'])
+def test_misspellings_fall_back_to_the_closest_symptom(query):
+    assert not expected_matches(query)
+    index = main.SymptomIndex(VOCABULARY, fuzzy_threshold=0.4)
+    matched, corrections = index.match_with_corrections([query])
+
+    best = closest_symptom(query, 0.4)
+    if best is None:
+        assert (matched, corrections) == ([], {})
+    else:
+        assert matched == [best[0]]
+        assert corrections == {query: VOCABULARY[best[0]]}
+
+
+def test_fuzzy_matching_can_be_disabled():
+    assert main.SymptomIndex(VOCABULARY, fuzzy_threshold=0).match(['fevr']) == []